@@ -1,9 +1,43 @@
-from sgetk.sge_summary import bytes2human
-from sgetk.sge_summary import human2bytes
-from sgetk.qstat import qstat
-from sgetk.qhost import qhost
-from sgetk.qstat import qstat2xml
-from sgetk.qstat import xml2data_frame
-from sgetk.qstat import user_running_job_info
-from sgetk.qstat import pretty_xml
-from sgetk.qstat import print_xml
\ No newline at end of file
+import sys
+
+from sgetk.lazy import ExportPackage, lazy_getattr
+
+# exports are imported on first access, so "from sgetk import bytes2human"
+# does not pay for pandas, numpy and lxml
+_exports = {
+    'bytes2human': 'sgetk.sge_summary',
+    'human2bytes': 'sgetk.sge_summary',
+    'bytes2human_array': 'sgetk.sge_summary',
+    'human2bytes_array': 'sgetk.sge_summary',
+    'qstat': 'sgetk.qstat',
+    'qhost': 'sgetk.qhost',
+    'qhost2xml': 'sgetk.qhost',
+    'xml2host_frame': 'sgetk.qhost',
+    'qstat2xml': 'sgetk.qstat',
+    'xml2data_frame': 'sgetk.qstat',
+    'user_running_job_info': 'sgetk.qstat',
+    'pretty_xml': 'sgetk.qstat',
+    'print_xml': 'sgetk.qstat',
+    'parse_job_request': 'sgetk.qstat',
+    'running_job_info': 'sgetk.qstat',
+    'qstat_async': 'sgetk.qstat',
+    'squeue': 'sgetk.slurm',
+    'sacct': 'sgetk.slurm',
+    'SnapshotCache': 'sgetk.cache',
+    'SnapshotArchive': 'sgetk.archive',
+    'AccountingStore': 'sgetk.acct',
+    'SchedulerClient': 'sgetk.sched',
+    'run_command': 'sgetk.sched',
+    'run_commands': 'sgetk.sched',
+    'node_idle': 'sgetk.node_idle',
+}
+
+__all__ = list(_exports)
+
+__getattr__ = lazy_getattr(globals(), _exports)
+# qstat, qhost and node_idle stay the functions of the baseline after their submodules are imported
+sys.modules[__name__].__class__ = ExportPackage
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+
+import argparse
+import collections
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+import sgetk.sched
+import sgetk.sge_summary
+from sgetk.lazy import lazy_import
+from sgetk.paths import STORE_ENV, default_store_path
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+# store column: sqlite type
+COLUMNS = collections.OrderedDict([
+    ('backend', 'TEXT NOT NULL'),
+    ('job_number', 'TEXT NOT NULL'),
+    ('task', "TEXT NOT NULL DEFAULT ''"),
+    ('job_name', 'TEXT'),
+    ('owner', 'TEXT'),
+    ('project', 'TEXT'),
+    ('department', 'TEXT'),
+    ('queue', 'TEXT'),
+    ('host', 'TEXT'),
+    ('state', 'TEXT'),
+    ('exit_status', 'INTEGER'),
+    ('slots', 'REAL'),
+    ('num_proc', 'INTEGER'),
+    ('mem_request', 'REAL'),
+    ('cpu_usage', 'REAL'),
+    # integral memory usage, GB x cpu seconds, as mem of qacct and qstat, NULL for slurm
+    ('mem_usage', 'REAL'),
+    ('io_usage', 'REAL'),
+    # peak memory, bytes: maxvmem of qacct, MaxRSS of sacct, maxrss of asub -system local tasks
+    ('maxvmem', 'REAL'),
+    ('wallclock', 'REAL'),
+    # seconds since the epoch
+    ('submit_time', 'REAL'),
+    ('start_time', 'REAL'),
+    ('end_time', 'REAL NOT NULL'),
+])
+INDEXES = ['owner', 'project', 'job_name', 'end_time']
+# store column: column of the qstat frames
+QSTAT_COLUMNS = {
+    'job_number': 'JB_job_number',
+    'task': 'tasks',
+    'job_name': 'JB_name',
+    'owner': 'JB_owner',
+    'project': 'JB_project',
+    'department': 'JB_department',
+    'queue': 'hard_req_queue',
+    'host': 'queue_name',
+}
+QACCT_SEPARATOR = re.compile(rb'^={10,}\s*$')
+QACCT_TIME_FORMATS = ['%a %b %d %H:%M:%S %Y', '%m/%d/%Y %H:%M:%S.%f', '%m/%d/%Y %H:%M:%S']
+REQUEST = re.compile(r'-l\s+(\S+)')
+REQUEST_QUEUE = re.compile(r'-q\s+(\S+)')
+INSERT_BATCH = 5000
+
+
+def qacct_time(value):
+    """
+    qacct time to seconds since the epoch, both 'Wed Oct  1 00:00:00 2026' (sge 8.1)
+    and '10/01/2026 00:00:00.123' (sge 8.1.9+), None for '-/-' of a job which never started
+    """
+    value = " ".join(value.split())
+    for time_format in QACCT_TIME_FORMATS:
+        try:
+            return datetime.strptime(value, time_format).timestamp()
+        except ValueError:
+            pass
+    return None
+
+
+def qacct_number(value):
+    """
+    '123.450s' (sge 8.1.9+ cpu), '12.3' -> float, '1.234GB', '512.000M' (maxvmem) -> bytes
+    """
+    value = value.strip()
+    try:
+        return float(value.rstrip('s'))
+    except ValueError:
+        pass
+    try:
+        return float(sgetk.sge_summary.human2bytes(value.rstrip('Bb') or '0'))
+    except ValueError:
+        return None
+
+
+def qacct_record(fields):
+    """
+    a 'qacct -j' record {key: value} to a store row, None if the job never ran
+    """
+    end_time = qacct_time(fields.get('end_time', ''))
+    if end_time is None:
+        return None
+    category = fields.get('category', '')
+    requests = {}
+    for match in REQUEST.finditer(category):
+        for request in match.group(1).split(','):
+            name, _, value = request.partition('=')
+            requests[name] = value
+    mem_request = None
+    if requests.get('virtual_free'):
+        mem_str = requests['virtual_free']
+        if mem_str[-1].isdigit():
+            mem_str += 'B'
+        mem_request = float(sgetk.sge_summary.human2bytes(mem_str))
+    queue = REQUEST_QUEUE.search(category)
+    task = fields.get('taskid', 'undefined')
+    failed = fields.get('failed', '0').split()[0]
+    exit_status = int(fields.get('exit_status', '0').split()[0])
+    return {
+        'backend': 'sge',
+        'job_number': fields.get('jobnumber'),
+        'task': '' if task == 'undefined' else task,
+        'job_name': fields.get('jobname'),
+        'owner': fields.get('owner'),
+        'project': fields.get('project'),
+        'department': fields.get('department'),
+        'queue': queue.group(1) if queue else fields.get('qname'),
+        'host': f"{fields.get('qname')}@{fields.get('hostname')}",
+        'state': 'completed' if failed == '0' and exit_status == 0 else 'failed',
+        'exit_status': exit_status,
+        'slots': qacct_number(fields.get('slots', '1')),
+        'num_proc': int(requests['num_proc']) if requests.get('num_proc', '').isdigit() else None,
+        'mem_request': mem_request,
+        'cpu_usage': qacct_number(fields.get('cpu', '0')),
+        # GB seconds, same unit as mem usage of qstat
+        'mem_usage': qacct_number(fields.get('mem', '0').replace('GBs', '')),
+        'io_usage': qacct_number(fields.get('io', '0')),
+        'maxvmem': qacct_number(fields.get('maxvmem', '0')),
+        'wallclock': qacct_number(fields.get('ru_wallclock', '0')),
+        'submit_time': qacct_time(fields.get('qsub_time', '')),
+        'start_time': qacct_time(fields.get('start_time', '')),
+        'end_time': end_time,
+    }
+
+
+class QacctParser:
+    """
+    split a 'qacct -j' stream into records, chunks may end in the middle of a line,
+    records are handed to on_record(row) as soon as the next separator is seen
+    """
+    def __init__(self, on_record):
+        self.on_record = on_record
+        self.reset()
+
+    def reset(self):
+        self.fields = {}
+        self.pending = b''
+
+    def feed(self, chunk):
+        lines = (self.pending + chunk).split(b'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.append(line)
+
+    def close(self):
+        if self.pending:
+            self.append(self.pending)
+        self.pending = b''
+        self.flush()
+
+    def flush(self):
+        if self.fields:
+            row = qacct_record(self.fields)
+            if row is not None:
+                self.on_record(row)
+        self.fields = {}
+
+    def append(self, line):
+        if QACCT_SEPARATOR.match(line):
+            self.flush()
+            return
+        key, _, value = line.decode(errors='replace').partition(' ')
+        if key:
+            self.fields[key] = value.strip()
+
+
+def sacct_rows(df):
+    """
+    store rows of a sgetk.slurm.sacct frame, jobs which have not ended are dropped
+    """
+    from sgetk.qstat import parse_job_request
+
+    df = df[df['end'].notna()] if 'end' in df.columns else df.iloc[:0]
+    df = parse_job_request(df)
+
+    def seconds(col):
+        return (df[col] - pd.Timestamp(0)).dt.total_seconds().where(df[col].notna(), None)
+
+    rows = pd.DataFrame({
+        'backend': 'slurm',
+        'job_number': df['JB_job_number'],
+        'task': df['tasks'].fillna(''),
+        'job_name': df['JB_name'],
+        'owner': df['JB_owner'],
+        'project': df['JB_project'],
+        'department': None,
+        'queue': df['hard_req_queue'],
+        'host': df['queue_name'],
+        'state': df['@state'],
+        'exit_status': None,
+        'slots': df['slots'],
+        'num_proc': df['core_request'],
+        'mem_request': df['mem_request'],
+        'cpu_usage': df['cpu_usage'],
+        # sacct has no integral memory usage, its MaxRSS (bytes) is the peak
+        'mem_usage': None,
+        'io_usage': df['io_usage'],
+        'maxvmem': df['mem_usage'],
+        'wallclock': df['elapsed'],
+        'submit_time': seconds('submit'),
+        'start_time': seconds('start'),
+        'end_time': seconds('end'),
+    }, columns=list(COLUMNS))
+    rows = rows.astype(object).where(rows.notna(), None)
+    return rows.to_dict('records')
+
+
+class AccountingStore:
+    """
+    local sqlite copy of finished job accounting records (qacct -j, sacct),
+    every ingest only asks the scheduler for records after the last end_time in the store,
+    rows are deduplicated by (backend, job_number, task, start_time, end_time),
+    so overlapping ingests are harmless
+
+    store = AccountingStore()
+    store.ingest_sge()
+    df = store.query(owner='alice', start=datetime(2026, 9, 1))
+    running_job_info(df, by='JB_project')
+    """
+    def __init__(self, path=None):
+        self.path = default_store_path() if path is None else path
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.create()
+
+    def create(self):
+        columns = ", ".join(f"{k} {v}" for k, v in COLUMNS.items())
+        with self.conn:
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS jobs ({columns}, "
+                "UNIQUE (backend, job_number, task, start_time, end_time))")
+            for col in INDEXES:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS jobs_{col} ON jobs ({col})")
+
+    def close(self):
+        self.conn.close()
+
+    def last_end_time(self, backend):
+        """
+        the last end_time (datetime) of backend in the store, None if empty
+        """
+        value = self.conn.execute("SELECT MAX(end_time) FROM jobs WHERE backend = ?", (backend,)).fetchone()[0]
+        return None if value is None else datetime.fromtimestamp(value)
+
+    def insert(self, rows):
+        """
+        insert store rows (dict), return the number of new rows
+        """
+        columns = list(COLUMNS)
+        sql = f"INSERT OR IGNORE INTO jobs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(sql, ([row.get(i) for i in columns] for row in rows))
+        return self.conn.total_changes - before
+
+    def ingest_sge(self, qacct_cmd='qacct', since=None, lookback=timedelta(days=7), client=None, timeout=3600):
+        """
+        ingest 'qacct -j' records, from since on the first run, later from the last end_time,
+        qacct -b selects by start time, so jobs which started lookback before
+        the last end_time are read again to catch long jobs which ended later
+        """
+        if client is None:
+            client = sgetk.sched.SchedulerClient(timeout=timeout)
+        last = self.last_end_time('sge')
+        begin = since if last is None else last - lookback
+        cmd = sgetk.sched.command_argv(qacct_cmd) + ['-j']
+        if begin is not None:
+            cmd += ['-b', begin.strftime('%Y%m%d%H%M.%S')]
+
+        batch = []
+        inserted = 0
+
+        def on_record(row):
+            nonlocal inserted
+            batch.append(row)
+            if len(batch) >= INSERT_BATCH:
+                inserted += self.insert(batch)
+                batch.clear()
+
+        parser = QacctParser(on_record)
+
+        def reset():
+            parser.reset()
+            batch.clear()
+
+        sgetk.sched.run_sync(client.stream(cmd, parser.feed, reset))
+        parser.close()
+        inserted += self.insert(batch)
+        return inserted
+
+    def ingest_slurm(self, sacct_cmd='sacct', since=None, window=timedelta(days=1), client=None):
+        """
+        ingest finished jobs of sacct, from since (default: 30 days ago) on the first run,
+        later from the last end_time, the range is fetched in parallel windows
+        """
+        import sgetk.slurm
+
+        last = self.last_end_time('slurm')
+        begin = last if last is not None else (since or datetime.now() - timedelta(days=30))
+        df = sgetk.slurm.sacct(begin, datetime.now(), window, sacct_cmd, client=client)
+        return self.insert(sacct_rows(df))
+
+    def query(self, owner=None, project=None, job_name=None, start=None, end=None, backend=None):
+        """
+        finished jobs whose end_time is in [start, end), as a frame with the qstat columns
+        (JB_owner, JB_project, JB_name, hard_req_queue, queue_name, slots, hard_request,
+        binding, cpu_usage, mem_usage, io_usage, JAT_prio ...) plus the accounting columns,
+        mem_usage is GB seconds (sge only), maxvmem the peak bytes of both backends,
+        so running_job_info works on it
+        """
+        where = []
+        params = []
+        for col, value in [('owner', owner), ('project', project), ('job_name', job_name), ('backend', backend)]:
+            if value is not None:
+                where.append(f"{col} = ?")
+                params.append(value)
+        if start is not None:
+            where.append("end_time >= ?")
+            params.append(start.timestamp())
+        if end is not None:
+            where.append("end_time < ?")
+            params.append(end.timestamp())
+        sql = "SELECT * FROM jobs" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY end_time"
+        df = pd.read_sql_query(sql, self.conn, params=params)
+        return store_frame(df)
+
+
+def hard_request(num_proc, mem_request):
+    request = []
+    if not pd.isna(num_proc):
+        request.append(collections.OrderedDict([('@name', 'num_proc'), ('#text', str(int(num_proc)))]))
+    if not pd.isna(mem_request):
+        request.append(collections.OrderedDict([('@name', 'virtual_free'), ('#text', str(int(mem_request)))]))
+    return request
+
+
+def store_frame(df):
+    for col in ['submit_time', 'start_time', 'end_time']:
+        df[col] = pd.to_datetime(df[col], unit='s')
+    df['hard_request'] = [hard_request(i, j) for i, j in zip(df['num_proc'], df['mem_request'])]
+    df['binding'] = None
+    df['JAT_prio'] = 0.0
+    df['@state'] = df['state']
+    return df.rename(columns=QSTAT_COLUMNS)
+
+
+def main():
+    from sgetk.qstat import running_job_info
+
+    parser = argparse.ArgumentParser(description='incremental local store of finished job accounting (qacct, sacct)')
+    parser.add_argument('-db', type=str, default=None, help=f'sqlite store, default: ${STORE_ENV} or ~/.sgetk/accounting.db')
+    parser.add_argument('-system', choices=['sge', 'slurm'], default='sge', help='scheduler to ingest from, default: sge')
+    parser.add_argument('-ingest', action='store_true', help='ingest records finished since the last ingest')
+    parser.add_argument('-since', type=int, default=None, help='days of history for the first ingest, default: all (sge), 30 (slurm)')
+    parser.add_argument('-lookback', type=float, default=7, help='days of start time read again by a sge ingest, default: 7')
+    parser.add_argument('-owner', type=str, default=None, help='only jobs of this owner')
+    parser.add_argument('-project', type=str, default=None, help='only jobs of this project')
+    parser.add_argument('-jobname', type=str, default=None, help='only jobs of this name')
+    parser.add_argument('-days', type=float, default=None, help='only jobs ended in the last days')
+    parser.add_argument('-by', nargs='*', default=None, help='print a running_job_info rollup by these columns, e.g. JB_owner JB_project')
+    args = parser.parse_args()
+
+    store = AccountingStore(args.db)
+    if args.ingest:
+        since = None if args.since is None else datetime.now() - timedelta(days=args.since)
+        if args.system == 'sge':
+            inserted = store.ingest_sge(since=since, lookback=timedelta(days=args.lookback))
+        else:
+            inserted = store.ingest_slurm(since=since)
+        print(f"ingested {inserted} new records into {store.path}", file=sys.stderr)
+
+    if args.by is not None or not args.ingest:
+        start = None if args.days is None else datetime.now() - timedelta(days=args.days)
+        df = store.query(args.owner, args.project, args.jobname, start, backend=args.system)
+        if args.by:
+            df = running_job_info(df, by=args.by if len(args.by) > 1 else args.by[0])
+            df.to_csv(sys.stdout, sep='\t')
+        else:
+            df.drop(columns=['hard_request']).to_csv(sys.stdout, sep='\t', index=False)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+
+import argparse
+import calendar
+import os
+import shutil
+import subprocess as subp
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sgetk.lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+TABLES = ['jobs', 'hosts', 'queues']
+# archive column: column of the xml2data_frame output
+JOB_COLUMNS = {
+    'job_number': 'JB_job_number',
+    'task': 'tasks',
+    'name': 'JB_name',
+    'owner': 'JB_owner',
+    'project': 'JB_project',
+    'department': 'JB_department',
+    'job_state': '@state',
+    'state': 'state',
+    'queue': 'queue_name',
+    'hard_req_queue': 'hard_req_queue',
+    'slots': 'slots',
+    'cpu_usage': 'cpu_usage',
+    'mem_usage': 'mem_usage',
+    'io_usage': 'io_usage',
+    'priority': 'JAT_prio',
+    'submit_time': 'JB_submission_time',
+    'start_time': 'JAT_start_time',
+}
+# dictionary encoded in every segment, also when a snapshot has no value in them
+STRING_COLUMNS = {
+    'jobs': ['job_number', 'task', 'name', 'owner', 'project', 'department', 'job_state', 'state', 'queue',
+             'hard_req_queue'],
+    'hosts': ['host', 'arch'],
+    'queues': ['host', 'queue', 'qtype', 'state'],
+}
+# seconds since the epoch in the archive, local datetimes in query results
+TIME_COLUMNS = ['time', 'submit_time', 'start_time']
+# a partition holds the snapshots of one UTC hour
+PARTITION_SECONDS = 3600
+PARTITION_FORMAT = '%Y%m%d%H'
+
+
+def default_archive_root():
+    return os.path.join(os.path.expanduser("~"), ".sgetk", "archive")
+
+
+def code_dtype(n):
+    """
+    the smallest signed int type for dictionary codes 0..n-1 and -1 (missing)
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if n <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def epoch_seconds(values):
+    """
+    local time strings ('2026-10-01T12:00:00') to float seconds since the epoch, NaN if missing,
+    every distinct value is converted once
+    """
+    times = pd.to_datetime(pd.Series(values, dtype=object), errors='coerce')
+    codes, uniques = pd.factorize(times)
+    seconds = np.array([i.to_pydatetime().timestamp() for i in uniques] + [np.nan], dtype=float)
+    return seconds[codes]
+
+
+def local_datetime(seconds):
+    """
+    seconds since the epoch to local datetimes, every distinct value is converted once
+    """
+    codes, uniques = pd.factorize(pd.Series(seconds, dtype=float))
+    times = pd.to_datetime([datetime.fromtimestamp(i) for i in uniques] + [pd.NaT]).to_numpy()
+    return times[codes]
+
+
+def job_frame(df):
+    """
+    the archived columns of a xml2data_frame (or squeue) output
+    """
+    out = pd.DataFrame({i: df[j] for i, j in JOB_COLUMNS.items() if j in df.columns}, index=df.index)
+    for col in ['submit_time', 'start_time']:
+        if col in out.columns:
+            out[col] = epoch_seconds(out[col])
+    return out.reset_index(drop=True)
+
+
+def encode_frame(df, when=None, strings=()):
+    """
+    npz arrays of a frame: 'time' (int64 seconds) of every row, when or the 'time' column,
+    numbers as float64 with a '{col}.range' [min, max] zone map,
+    strings and the strings columns dictionary encoded: '{col}' codes (-1 is missing) and '{col}.dict' values
+    """
+    if when is None:
+        arrays = {'time': df['time'].to_numpy(dtype=np.int64)}
+    else:
+        arrays = {'time': np.full(len(df), int(when), dtype=np.int64)}
+    for col in df.columns.drop('time', errors='ignore'):
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.cat.remove_unused_categories()
+            arrays[col] = values.cat.codes.to_numpy().astype(code_dtype(len(values.cat.categories)))
+            arrays[f"{col}.dict"] = np.asarray(values.cat.categories, dtype=str)
+        elif col not in strings and pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            values = values.to_numpy(dtype=float)
+            arrays[col] = values
+            finite = values[~np.isnan(values)]
+            arrays[f"{col}.range"] = np.array([finite.min(), finite.max()] if len(finite) else [np.nan, np.nan])
+        else:
+            values = values.astype(object)
+            codes, uniques = pd.factorize(values.where(values.isna(), values.astype(str)))
+            arrays[col] = codes.astype(code_dtype(len(uniques)))
+            arrays[f"{col}.dict"] = np.asarray(uniques, dtype=str)
+    return arrays
+
+
+def write_npz(path, arrays):
+    """
+    write a compressed npz, replaced atomically so readers never see a partial file
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as h:
+            np.savez_compressed(h, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def predicate_values(col, value):
+    """
+    a where value: a scalar (==), a list or set (isin), or a (low, high) tuple ([low, high) range)
+    """
+    if isinstance(value, tuple):
+        if len(value) != 2:
+            raise ValueError(f"range of {col} must be (low, high)")
+        return None, value
+    if isinstance(value, (list, set, frozenset)):
+        return list(value), None
+    return [value], None
+
+
+def partition_mask(npz, start, end, where):
+    """
+    rows of an open npz which match the time range and where, None if none matches,
+    zone maps and dictionaries are checked before any column is decompressed
+    """
+    names = set(npz.files)
+    checks = []
+    for col, value in (where or {}).items():
+        if col not in names:
+            return None
+        values, bounds = predicate_values(col, value)
+        if f"{col}.dict" in names:
+            if bounds is not None:
+                raise ValueError(f"{col} is a string column, ranges are not supported")
+            codes = np.flatnonzero(np.isin(npz[f"{col}.dict"], [str(i) for i in values]))
+            if not len(codes):
+                return None
+            checks.append((col, lambda x, codes=codes: np.isin(x, codes)))
+            continue
+        low, high = npz[f"{col}.range"] if f"{col}.range" in names else (-np.inf, np.inf)
+        if bounds is not None:
+            if (bounds[1] is not None and bounds[1] <= low) or (bounds[0] is not None and bounds[0] > high):
+                return None
+            checks.append((col, lambda x, b=bounds: ((x >= b[0]) if b[0] is not None else True)
+                           & ((x < b[1]) if b[1] is not None else True)))
+        else:
+            try:
+                values = np.asarray(values, dtype=float)
+            except ValueError:
+                # strings never match a number column, as an all NaN string column of older segments
+                return None
+            if not ((values >= low) & (values <= high)).any():
+                return None
+            checks.append((col, lambda x, v=values: np.isin(x, v)))
+
+    seconds = npz['time']
+    mask = np.ones(len(seconds), dtype=bool)
+    if start is not None:
+        mask &= seconds >= start
+    if end is not None:
+        mask &= seconds < end
+    for col, check in checks:
+        if not mask.any():
+            return None
+        mask &= check(npz[col])
+    return mask if mask.any() else None
+
+
+def read_partition(path, start, end, columns, where):
+    """
+    (rows, {column: values}) of the matching rows of a npz, dictionary columns as Categorical,
+    only the columns asked for are decompressed, None if no row matches
+    """
+    with np.load(path) as npz:
+        mask = partition_mask(npz, start, end, where)
+        if mask is None:
+            return None
+        names = set(npz.files)
+        if columns is None:
+            columns = [i for i in npz.files if '.' not in i]
+        out = {}
+        for col in columns:
+            if col not in names:
+                continue
+            if f"{col}.dict" in names:
+                out[col] = pd.Categorical.from_codes(npz[col][mask].astype(np.int64), categories=npz[f"{col}.dict"])
+            else:
+                out[col] = npz[col][mask]
+        return int(mask.sum()), out
+
+
+def as_categorical(values, rows):
+    """
+    a read_partition column as Categorical with str categories, an empty dictionary has object ones:
+    missing (None) or all NaN numbers of older segments are rows missing values, other numbers their strings
+    """
+    if isinstance(values, pd.Categorical):
+        return pd.Categorical.from_codes(values.codes, categories=pd.Index(values.categories, dtype=str))
+    if values is None:
+        return pd.Categorical.from_codes(np.full(rows, -1), categories=pd.Index([], dtype=str))
+    values = pd.Series(values, dtype=object)
+    return pd.Categorical(values.where(values.isna(), values.astype(str)),
+                          categories=pd.Index(values.dropna().astype(str).unique(), dtype=str))
+
+
+def concat_columns(parts, columns=None):
+    """
+    one frame of the read_partition outputs, categoricals of different partitions are unioned,
+    a column missing in a partition is NaN there
+    """
+    if columns is None:
+        columns = []
+        for _, part in parts:
+            columns += [i for i in part if i not in columns]
+    data = {}
+    for col in columns:
+        values = [part.get(col) for _, part in parts]
+        if any(isinstance(i, pd.Categorical) for i in values):
+            data[col] = pd.api.types.union_categoricals([as_categorical(i, rows) for i, (rows, _) in zip(values, parts)])
+        else:
+            data[col] = np.concatenate([np.full(rows, np.nan) if i is None else i
+                                        for i, (rows, _) in zip(values, parts)])
+    return pd.DataFrame(data)
+
+
+class SnapshotArchive:
+    """
+    compressed, time partitioned archive of qstat and qhost snapshots
+
+    every snapshot is written as a small npz segment to {root}/{table}/{hour}/,
+    compact() merges the segments of a finished hour into {root}/{table}/{hour}.npz,
+    strings (owner, queue, state ...) are dictionary encoded, numbers carry a min/max zone map,
+    a query opens only the partitions of its time range, checks where on the dictionaries
+    and zone maps first, and decompresses only the columns it asks for
+
+    archive = SnapshotArchive()
+    archive.snapshot()
+    df = archive.query('queues', start=datetime(2026, 10, 13, 15), end=datetime(2026, 10, 13, 15, 5),
+                       columns=['time', 'queue', 'slots', 'slots_used'], where={'queue': 'st.q'})
+    """
+    def __init__(self, root=None):
+        self.root = default_archive_root() if root is None else root
+        for table in TABLES:
+            os.makedirs(os.path.join(self.root, table), exist_ok=True)
+
+    def table_dir(self, table):
+        if table not in TABLES:
+            raise ValueError(f"unknown table {table}, one of {', '.join(TABLES)}")
+        return os.path.join(self.root, table)
+
+    @staticmethod
+    def partition_name(seconds):
+        return time.strftime(PARTITION_FORMAT, time.gmtime(seconds))
+
+    @staticmethod
+    def partition_start(name):
+        return calendar.timegm(time.strptime(name, PARTITION_FORMAT))
+
+    def record(self, jobs=None, hosts=None, queues=None, when=None):
+        """
+        archive a snapshot taken at when (seconds, default: now):
+        jobs is a xml2data_frame (or squeue) output, hosts and queues the frames of xml2host_frame
+        """
+        when = time.time() if when is None else when
+        for table, df in [('jobs', None if jobs is None else job_frame(jobs)), ('hosts', hosts), ('queues', queues)]:
+            if df is None:
+                continue
+            segment_dir = os.path.join(self.table_dir(table), self.partition_name(when))
+            os.makedirs(segment_dir, exist_ok=True)
+            write_npz(os.path.join(segment_dir, f"{int(when * 1000)}.npz"), encode_frame(df, when, STRING_COLUMNS[table]))
+        return when
+
+    def snapshot(self, qstat_cmd="qstat -u '*'", qhost_cmd='qhost', hosts=True, cache=None):
+        """
+        run qstat (and qhost) and archive their frames, return the snapshot time
+        """
+        from sgetk.qhost import qhost
+        from sgetk.qstat import qstat
+
+        when = time.time()
+        jobs = qstat(qstat_cmd, cache=cache)
+        host_df, queue_df = qhost(qhost_cmd) if hosts else (None, None)
+        return self.record(jobs, host_df, queue_df, when)
+
+    def compact(self, before=None):
+        """
+        merge the segments of every hour which ended before (seconds, default: now) into one partition,
+        return the number of partitions written
+        """
+        before = time.time() if before is None else before
+        written = 0
+        for table in TABLES:
+            table_dir = self.table_dir(table)
+            for name in sorted(os.listdir(table_dir)):
+                segment_dir = os.path.join(table_dir, name)
+                if not os.path.isdir(segment_dir) or self.partition_start(name) + PARTITION_SECONDS > before:
+                    continue
+                segments = sorted(os.path.join(segment_dir, i) for i in os.listdir(segment_dir) if i.endswith(".npz"))
+                parts = [read_partition(i, None, None, None, None) for i in segments]
+                parts = [i for i in parts if i is not None]
+                if parts:
+                    write_npz(os.path.join(table_dir, f"{name}.npz"),
+                              encode_frame(concat_columns(parts), strings=STRING_COLUMNS[table]))
+                    written += 1
+                shutil.rmtree(segment_dir)
+        return written
+
+    def partitions(self, table, start=None, end=None):
+        """
+        npz files of table which may hold snapshots in [start, end) (seconds), in time order
+        """
+        table_dir = self.table_dir(table)
+        paths = []
+        for name in sorted(os.listdir(table_dir)):
+            hour = name[:-4] if name.endswith(".npz") else name
+            if not hour.isdigit() or name.endswith(".tmp"):
+                continue
+            hour_start = self.partition_start(hour)
+            if (start is not None and hour_start + PARTITION_SECONDS <= start) or (end is not None and hour_start >= end):
+                continue
+            path = os.path.join(table_dir, name)
+            if os.path.isdir(path):
+                paths += sorted(os.path.join(path, i) for i in os.listdir(path) if i.endswith(".npz"))
+            else:
+                paths.append(path)
+        return paths
+
+    def query(self, table, start=None, end=None, columns=None, where=None):
+        """
+        rows of table with a snapshot time in [start, end) (datetime) matching where,
+        where: {column: value (==), [values] (isin) or (low, high) ([low, high), numbers only)},
+        columns: the columns to load, default: all, 'time' is the snapshot time
+        """
+        start = None if start is None else start.timestamp()
+        end = None if end is None else end.timestamp()
+        parts = []
+        for path in self.partitions(table, start, end):
+            try:
+                part = read_partition(path, start, end, columns, where)
+            except FileNotFoundError:
+                # a segment compacted while we were reading, its partition is read instead
+                continue
+            if part is not None:
+                parts.append(part)
+        if not parts:
+            return pd.DataFrame(columns=columns or ['time'])
+        df = concat_columns(parts, columns)
+        for col in TIME_COLUMNS:
+            if col in df.columns:
+                df[col] = local_datetime(df[col])
+        return df
+
+
+def queue_utilization(archive, start, end, queues=None):
+    """
+    mean slots, used and reserved slots of every queue over the snapshots in [start, end),
+    utilization is slots_used / slots
+    """
+    where = None if queues is None else {'queue': list(queues)}
+    df = archive.query('queues', start, end, ['time', 'queue', 'slots', 'slots_used', 'slots_resv'], where)
+    if df.empty:
+        return pd.DataFrame(columns=['snapshots', 'slots', 'slots_used', 'slots_resv', 'utilization'])
+    per_snapshot = df.groupby(['queue', 'time'], observed=True)[['slots', 'slots_used', 'slots_resv']].sum()
+    out = per_snapshot.groupby(level='queue', observed=True).mean()
+    out.insert(0, 'snapshots', per_snapshot.groupby(level='queue', observed=True).size())
+    out['utilization'] = out['slots_used'] / out['slots']
+    return out.sort_values('utilization', ascending=False)
+
+
+def pending_times(archive, start, end, owner=None):
+    """
+    time every job (task) sat pending, from the snapshots in [start, end):
+    wait is start_time - submit_time of a started task, or last seen pending - submit_time
+    of a task still pending at the end (started False), jobs never seen pending are left out
+    """
+    where = {'job_state': ['pending', 'running']}
+    if owner is not None:
+        where['owner'] = owner
+    df = archive.query('jobs', start, end, ['time', 'job_number', 'task', 'owner', 'job_state', 'submit_time', 'start_time'], where)
+    if df.empty:
+        return pd.DataFrame(columns=['job_number', 'task', 'owner', 'submit_time', 'start_time', 'wait', 'started'])
+    for col in ['job_number', 'task', 'owner', 'job_state']:
+        df[col] = df[col].astype(object)
+    # pending array tasks are reported as one range, submit time is a job property
+    submit = df.groupby('job_number')['submit_time'].min()
+    df['submit_time'] = df['job_number'].map(submit)
+    df = df[df['submit_time'].notna()]
+    running = df[df['job_state'] == 'running'].groupby(['job_number', 'task'], dropna=False).agg(
+        owner=('owner', 'first'), submit_time=('submit_time', 'first'), start_time=('start_time', 'min'))
+    running['wait'] = (running['start_time'] - running['submit_time']).dt.total_seconds()
+    running['started'] = True
+    started_jobs = set(running.index.get_level_values('job_number'))
+    pending = df[(df['job_state'] == 'pending') & ~df['job_number'].isin(started_jobs)].groupby(
+        ['job_number', 'task'], dropna=False).agg(owner=('owner', 'first'), submit_time=('submit_time', 'first'),
+                                                  last_seen=('time', 'max'))
+    pending['start_time'] = pd.NaT
+    pending['wait'] = (pending['last_seen'] - pending['submit_time']).dt.total_seconds()
+    pending['started'] = False
+    out = pd.concat([running, pending.drop(columns=['last_seen'])]).reset_index()
+    return out.sort_values('wait', ascending=False).reset_index(drop=True)
+
+
+def parse_where(items):
+    """
+    ['owner=alice,bob', 'slots=4'] -> {'owner': ['alice', 'bob'], 'slots': ['4']},
+    values of number columns are converted by the query
+    """
+    where = {}
+    for item in items or []:
+        col, _, values = item.partition('=')
+        where[col] = values.split(',')
+    return where
+
+
+def main():
+    parser = argparse.ArgumentParser(description='record qstat/qhost snapshots into a compressed archive and query its history')
+    parser.add_argument('-root', type=str, default=None, help=f'archive directory, default: {default_archive_root()}')
+    parser.add_argument('-record', action='store_true', help='take a snapshot every interval seconds')
+    parser.add_argument('-cmd', type=str, default="qstat -u '*'", help="qstat command, default: qstat -u '*'")
+    parser.add_argument('-no-qhost', dest='qhost', action='store_false', help='do not record qhost hosts and queues')
+    parser.add_argument('-interval', type=float, default=60, help='snapshot interval (seconds), default: 60')
+    parser.add_argument('-count', type=int, default=None, help='stop after count snapshots, default: None (forever)')
+    parser.add_argument('-compact', action='store_true', help='merge the snapshots of finished hours')
+    parser.add_argument('-query', choices=TABLES, default=None, help='print the rows of a table')
+    parser.add_argument('-columns', nargs='*', default=None, help='columns to print, -query needed, default: all')
+    parser.add_argument('-where', nargs='*', default=None, help='filters as column=value[,value...], e.g. owner=alice state=r,qw')
+    parser.add_argument('-utilization', action='store_true', help='print the mean slot utilization of every queue')
+    parser.add_argument('-pending', action='store_true', help='print how long jobs sat pending')
+    parser.add_argument('-start', type=str, default=None, help='start of the time range, e.g. 2026-10-13T15:00, default: 1 day before -end')
+    parser.add_argument('-end', type=str, default=None, help='end of the time range, default: now')
+    args = parser.parse_args()
+
+    archive = SnapshotArchive(args.root)
+    if args.record:
+        snapshots = 0
+        next_poll = time.monotonic()
+        while (args.count is None) or (snapshots < args.count):
+            snapshots += 1
+            try:
+                archive.snapshot(args.cmd, hosts=args.qhost)
+            except (subp.CalledProcessError, subp.TimeoutExpired) as e:
+                print(f"snapshot failed: {e}", file=sys.stderr)
+            archive.compact()
+            if (args.count is not None) and (snapshots >= args.count):
+                break
+            next_poll += args.interval
+            time.sleep(max(0.0, next_poll - time.monotonic()))
+    if args.compact:
+        print(f"compacted {archive.compact()} partitions", file=sys.stderr)
+
+    end = datetime.now() if args.end is None else datetime.fromisoformat(args.end)
+    start = end - timedelta(days=1) if args.start is None else datetime.fromisoformat(args.start)
+    if args.query is not None:
+        df = archive.query(args.query, start, end, args.columns, parse_where(args.where))
+        df.to_csv(sys.stdout, sep='\t', index=False)
+    if args.utilization:
+        queues = parse_where(args.where).get('queue')
+        queue_utilization(archive, start, end, queues).to_csv(sys.stdout, sep='\t')
+    if args.pending:
+        owner = parse_where(args.where).get('owner')
+        pending_times(archive, start, end, owner).to_csv(sys.stdout, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,71 +1,270 @@
 #!/ldfssz1/ST_META/share/User/zhujie/.conda/envs/bioenv/bin/python
 
-import subprocess
-import sys
-import re
+import argparse
+import collections
+import mmap
 import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+import lxml.etree as etree
+
+try:
+    from sgetk.asub import compact_ranges
+    from sgetk.retry import check_output
+except ImportError:
+    # run as a script, the sgetk package is the directory of this file
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from sgetk.asub import compact_ranges
+    from sgetk.retry import check_output
+
+FORMATS = ["sh", "shp", "o", "op", "e", "ep"]
+CHUNK_SIZE = 1 << 16
+
+# stderr lines which mark a task as failed
+ERROR_PATTERN = r'(?i)error|exception|traceback|killed|segmentation fault|core dumped|out of memory|command not found|no such file'
+# {job_name}_N.e/.o (sge) or {job_name}_N.err/.out (slurm), as asub writes them
+LOG_NAME = re.compile(r'^(?P<job_name>.+)_(?P<task>\d+)\.(?P<ext>e|o|err|out)$')
+
+
+def qstat_j_xml(job_ids):
+    """
+    one 'qstat -j id1,id2,... -xml' call for all jobs, timeout and retries of sgetk.retry
+    """
+    cmd = ["qstat", "-j", ",".join(str(i) for i in job_ids), "-xml"]
+    return check_output(cmd)
 
-cmd = "qstat -j %s" % str(sys.argv[1])
-output = subprocess.getoutput(cmd).split("\n")
 
-is_array_job = False
-work_dir = ""
-prefix = ""
-script_file = ""
-sh_files = []
-o_files = []
-e_files = []
+def user_job_ids(user):
+    cmd = ["qstat", "-u", user, "-xml"]
+    xml_str = check_output(cmd)
+    job_ids = []
+    for _, elem in etree.iterparse(BytesIO(xml_str), events=('end',), tag='JB_job_number'):
+        if elem.text not in job_ids:
+            job_ids.append(elem.text)
+        elem.clear(keep_tail=True)
+    return job_ids
 
 
-def print_content(file_path, format):
-    if not format.endswith("p"):
-        if os.path.exists(file_path):
-            ih = open(file_path, 'r')
-            print(ih.read().rstrip())
-            ih.close()
+def job_files(elem):
+    """
+    extract the work directory, script file and task files of a djob_info element
+    """
+    work_dir = ""
+    for var in elem.iterfind("JB_env_list/*"):
+        if var.findtext("VA_variable") == "__SGE_PREFIX__O_WORKDIR":
+            work_dir = var.findtext("VA_value") or ""
+            break
+    if work_dir == "":
+        work_dir = elem.findtext("JB_cwd") or ""
+
+    stdout_path = elem.findtext("JB_stdout_path_list//PN_path") or ""
+    prefix = os.path.join(work_dir, stdout_path.split("$")[0])
+
+    task_range = elem.find("JB_ja_structure//RN_max")
+    is_array_job = ("$TASK_ID" in stdout_path) or \
+        (task_range is not None and task_range.text != elem.findtext("JB_ja_structure//RN_min"))
+
+    tasks = [i.text for i in elem.iterfind("JB_ja_tasks//JAT_task_number")]
+    return {
+        'job_number': elem.findtext("JB_job_number"),
+        'work_dir': work_dir,
+        'script_file': os.path.join(work_dir, elem.findtext("JB_script_file") or ""),
+        'is_array_job': is_array_job,
+        'sh_files': ["%s%s.sh" % (prefix, num) for num in tasks],
+        'o_files': ["%s%s.o" % (prefix, num) for num in tasks],
+        'e_files': ["%s%s.e" % (prefix, num) for num in tasks],
+    }
+
+
+def parse_job_xml(xml_str):
+    """
+    yield job_files of every job in a 'qstat -j ... -xml' output
+    """
+    for _, elem in etree.iterparse(BytesIO(xml_str), events=('end',), tag='element'):
+        parent = elem.getparent()
+        if parent is None or parent.tag != 'djob_info':
+            continue
+        yield job_files(elem)
+        elem.clear(keep_tail=True)
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def open_task_file(file_path):
+    """
+    open a file and read its first chunk, run in the thread pool
+    """
+    try:
+        h = open(file_path, 'rb')
+    except FileNotFoundError:
+        return file_path, None, b''
+    return file_path, h, h.read(CHUNK_SIZE)
+
+
+def write_stripped(out, h, first_chunk):
+    """
+    stream a file to out with its trailing whitespace removed, same as print(h.read().rstrip())
+    """
+    pending = b''
+    chunk = first_chunk
+    while chunk:
+        body = chunk.rstrip()
+        if body:
+            out.write(pending)
+            out.write(body)
+            pending = chunk[len(body):]
         else:
-            print("%s does not exists!" % file_path)
-    else:
-        print(file_path)
-
-
-for line in output:
-    if line.startswith("sge_o_workdir"):
-        work_dir = re.split(r"\s+", line)[-1]
-        continue
-    if line.startswith("stdout_path_list"):
-        prefix = re.split(r":|\$", line)[3]
-        continue
-    if line.startswith("script_file"):
-        script_file = os.path.join(work_dir, re.split(r"\s+", line)[-1])
-        continue
-    if line.startswith("job-array"):
-        is_array_job = True
-        continue
-    if line.startswith("usage") and is_array_job:
-        num = re.split(r'\s+', line)[1].rstrip(":")
-        sh_files.append("%s%s.sh" % (os.path.join(work_dir, prefix), num))
-        o_files.append("%s%s.o" % (os.path.join(work_dir, prefix), num))
-        e_files.append("%s%s.e" % (os.path.join(work_dir, prefix), num))
-        continue
-
-if len(sys.argv) > 2:
-    format = sys.argv[2]
-    if is_array_job:
-        for sh_file, o_file, e_file in zip(sh_files, o_files, e_files):
-            if format == "sh" or format == "shp":
-                print_content(sh_file, format)
-            elif format == "o" or format == "op":
-                print_content(o_file, format)
-            elif format == "e" or format == "ep":
-                print_content(e_file, format)
+            pending += chunk
+        chunk = h.read(CHUNK_SIZE)
+    out.write(b"\n")
+
+
+def print_contents(file_paths, format, threads=8):
+    """
+    print task files in order, files are opened and prefetched by a bounded thread pool
+    """
+    out = sys.stdout.buffer
+    if format.endswith("p"):
+        for file_path in file_paths:
+            out.write(file_path.encode() + b"\n")
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        window = collections.deque()
+        file_iter = iter(file_paths)
+        for file_path in file_iter:
+            window.append(executor.submit(open_task_file, file_path))
+            if len(window) >= threads * 2:
+                break
+        while window:
+            file_path, h, first_chunk = window.popleft().result()
+            next_path = next(file_iter, None)
+            if next_path is not None:
+                window.append(executor.submit(open_task_file, next_path))
+            if h is None:
+                out.write(b"%s does not exists!\n" % file_path.encode())
+                continue
+            with h:
+                write_stripped(out, h, first_chunk)
+    out.flush()
+
+
+def task_logs(logdir, job_name=None):
+    """
+    {task id: {'e': [stderr paths], 'o': [stdout paths]}} of the asub logs in logdir
+    """
+    tasks = collections.defaultdict(lambda: {'e': [], 'o': []})
+    with os.scandir(logdir) as entries:
+        for entry in entries:
+            match = LOG_NAME.match(entry.name)
+            if match is None:
+                continue
+            if (job_name is not None) and (match.group('job_name') != job_name):
+                continue
+            tasks[int(match.group('task'))][match.group('ext')[0]].append(entry.path)
+    return tasks
+
+
+def grep_file(file_path, regex, max_matches):
+    """
+    the first max_matches lines of a file matching regex (bytes),
+    the file is mmapped and the search stops early
+    """
+    lines = []
+    if (max_matches <= 0) or (not os.path.getsize(file_path)):
+        return lines
+    with open(file_path, 'rb') as h, mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for match in regex.finditer(mm):
+            start = mm.rfind(b"\n", 0, match.start()) + 1
+            end = mm.find(b"\n", match.end())
+            lines.append(mm[start:end if end >= 0 else len(mm)].decode(errors='replace'))
+            if len(lines) >= max_matches:
+                break
+    return lines
+
+
+def scan_task(task, logs, error_regex, marker_regex, max_matches):
+    """
+    return (task id, failed lines), a task fails when its stderr matches error_regex,
+    or its stdout misses marker_regex
+    """
+    failed = []
+    for file_path in logs['e']:
+        failed += [f"{file_path}: {line}" for line in grep_file(file_path, error_regex, max_matches)]
+    if marker_regex is not None:
+        if not any(grep_file(file_path, marker_regex, 1) for file_path in logs['o']):
+            failed.append(f"{','.join(logs['o']) or 'stdout'}: exit marker not found")
+    return task, failed
+
+
+def scan_failed_tasks(logdir, job_name=None, error_pattern=ERROR_PATTERN, exit_marker=None,
+                      max_matches=3, threads=8):
+    """
+    scan array job logs in parallel, yield (task id, failed lines) of failed tasks as they are found
+    """
+    error_regex = re.compile(error_pattern.encode())
+    marker_regex = re.compile(exit_marker.encode()) if exit_marker else None
+    tasks = task_logs(logdir, job_name)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(scan_task, task, logs, error_regex, marker_regex, max_matches)
+                   for task, logs in tasks.items()]
+        for future in as_completed(futures):
+            task, failed = future.result()
+            if failed:
+                yield task, failed
+
+
+def print_failed_tasks(logdir, job_name, error_pattern, exit_marker, max_matches, threads):
+    failed_tasks = []
+    for task, failed in scan_failed_tasks(logdir, job_name, error_pattern, exit_marker, max_matches, threads):
+        failed_tasks.append(task)
+        for line in failed:
+            print(f"{task}\t{line}", flush=True)
+    print(f"failed tasks ({len(failed_tasks)}): {compact_ranges(failed_tasks)}")
+    return failed_tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='show script, stdout or stderr files of (array) jobs')
+    parser.add_argument('job_id', nargs='*', help=f'job ids, the last one can be a format: {" | ".join(FORMATS)}')
+    parser.add_argument('-u', dest='user', type=str, default=None, help='show all jobs of a user')
+    parser.add_argument('-f', dest='format', choices=FORMATS, default=None, help='print file contents (sh, o, e) or paths (shp, op, ep)')
+    parser.add_argument('-threads', type=int, default=8, help='threads to read task files, default: 8')
+    parser.add_argument('-scan', type=str, default=None, metavar='LOGDIR', help='find failed tasks of an asub array log directory')
+    parser.add_argument('-jobname', type=str, default=None, help='only scan logs of this job name, -scan needed')
+    parser.add_argument('-pattern', type=str, default=ERROR_PATTERN, help='regex of stderr lines which mark a failed task, -scan needed')
+    parser.add_argument('-marker', type=str, default=None, help='regex which must be in stdout of a finished task, -scan needed, default: None')
+    parser.add_argument('-max-matches', dest='max_matches', type=int, default=3, help='matched lines reported per task, -scan needed, default: 3')
+    args = parser.parse_args()
+
+    if args.scan is not None:
+        failed_tasks = print_failed_tasks(args.scan, args.jobname, args.pattern, args.marker, args.max_matches, args.threads)
+        sys.exit(1 if failed_tasks else 0)
+
+    job_ids = list(args.job_id)
+    if job_ids and job_ids[-1] in FORMATS:
+        args.format = job_ids.pop()
+    if args.user is not None:
+        job_ids += user_job_ids(args.user)
+    if not job_ids:
+        parser.print_help()
+        sys.exit(1)
+
+    for job in parse_job_xml(qstat_j_xml(job_ids)):
+        if args.format is None:
+            if job['is_array_job']:
+                print_contents(job['sh_files'], "shp")
             else:
-                print("please: sh | shp | o | op | e | ep")
-    else:
-        print_content(script_file, format)
-else:
-    if is_array_job:
-        for sh_file in sh_files:
-            print(sh_file)
-    else:
-        print(script_file)
+                print_contents([job['script_file']], "shp")
+        elif job['is_array_job']:
+            files = {"sh": job['sh_files'], "o": job['o_files'], "e": job['e_files']}[args.format.rstrip("p")]
+            print_contents(files, args.format, args.threads)
+        else:
+            print_contents([job['script_file']], args.format, args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,22 +2,109 @@
 # please see https://github.com/lh3/asub
 import argparse
 import csv
+import heapq
+import json
+import math
 import os
 import re
+import shlex
 import shutil
+import sqlite3
 import stat
 import subprocess
 import sys
-import pandas as pd
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+try:
+    from sgetk.paths import STORE_ENV, default_store_path
+    from sgetk.retry import TIMEOUT, check_output
+except ImportError:
+    # run as a script, the sgetk package is the directory of this file
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from sgetk.paths import STORE_ENV, default_store_path
+    from sgetk.retry import TIMEOUT, check_output
+
 __author__ = 'Jie Zhu'
 __email__ = 'zhujie@genomics.cn, jiezhu@hku.hk'
 __version__ = '0.3.1'
 __date__ = 'Aug 22, 2019'
 
+# every task of a bundle has a fixed width record "offset length\n" in the index file,
+# so a task can seek to its record directly
+BUNDLE_INDEX_WIDTH = 32
+
+# accounting store of sgetk.acct, the history of -rightsize
+HISTORY_DB = default_store_path()
+HISTORY_DAYS = 90
+RIGHTSIZE_MIN_SAMPLES = 5
+RIGHTSIZE_QUANTILE = 0.95
+# min memory request, bytes
+RIGHTSIZE_MIN_MEMORY = 50 << 20
+# busy cores above a whole number tolerated before one more core is requested,
+# cpu overuse only slows a task down, memory overuse kills it
+RIGHTSIZE_CORE_TOLERANCE = 0.1
+MEMORY_UNITS = {'': 1 << 20, 'B': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+# bash function of -parallel-lines: run the lines of stdin with at most $1 at a time,
+# line k writes $2.line{k}.o/.e and "k status" to $2.lines, non zero if any line failed,
+# a new line starts as soon as one ends with wait -n of bash >= 4.3, older bash waits for the whole batch
+RUN_LINES = r'''run_lines() {
+    local jobs=$1 prefix=$2 n=0 line wait_any=wait
+    if [ "${BASH_VERSINFO[0]}" -gt 4 ] || { [ "${BASH_VERSINFO[0]}" -eq 4 ] && [ "${BASH_VERSINFO[1]}" -ge 3 ]; }; then
+        wait_any="wait -n"
+    fi
+    : > "$prefix.lines"
+    while IFS= read -r line || [ -n "$line" ]; do
+        [ -z "${line//[[:space:]]/}" ] && continue
+        n=$((n + 1))
+        while [ "$(jobs -rp | wc -l)" -ge "$jobs" ]; do $wait_any; done
+        { bash -c "$line" < /dev/null > "$prefix.line$n.o" 2> "$prefix.line$n.e"; echo "$n $?" >> "$prefix.lines"; } &
+    done
+    wait
+    awk '$2 != 0 {failed = 1} END {exit failed}' "$prefix.lines"
+}'''
+# every task writes a fixed width record of its usage to slot {task_id} of {job_name}.stats
+STATS_WIDTH = 128
+STATS_FIELDS = ['task', 'exit', 'start', 'end', 'user', 'sys', 'maxrss', 'host']
+STATS_FORMAT = "{:10d} {:4d} {:14.3f} {:14.3f} {:12.3f} {:12.3f} {:12d} {:.32s}"
+# a task running longer than this times the median runtime is a straggler
+STRAGGLER_FACTOR = 2.0
+# python wrapper of a task: fork the task, wait4 it for its rusage (maxrss in KB on linux),
+# write the record and exit with the task status, argv: stats file, task id, command
+TASK_STATS = r'''import os, socket, sys, time
+path, task, argv = sys.argv[1], int(sys.argv[2]), sys.argv[3:]
+start = time.time()
+pid = os.fork()
+if pid == 0:
+    try:
+        os.execvp(argv[0], argv)
+    finally:
+        os._exit(127)
+_, status, usage = os.wait4(pid, 0)
+end = time.time()
+code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 128 + os.WTERMSIG(status)
+record = FORMAT.format(task, code, start, end, usage.ru_utime, usage.ru_stime, usage.ru_maxrss,
+                       socket.gethostname().split(".")[0])
+try:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    os.pwrite(fd, record.encode()[:WIDTH - 1].ljust(WIDTH - 1) + b"\n", (task - 1) * WIDTH)
+    os.close(fd)
+except OSError as e:
+    print(f"can not write task stats to {path}: {e}", file=sys.stderr)
+sys.exit(code)'''
+# keys of a pipeline stage besides asub options
+STAGE_KEYS = {'name', 'after', 'after_task', 'jobfile', 'jobline', 'queue', 'project', 'partition', 'qos', 'node',
+              'threads', 'memory', 'resource', 'bundle', 'max_array_size', 'max_running', 'rightsize',
+              'rightsize_margin', 'pack_by', 'tasks', 'parallel_lines', 'line_jobs'}
+# shell words which are not the program of a command
+SIGNATURE_SKIP = {'time', 'nohup', 'env', 'exec', 'then', 'do', 'else', 'if', 'sudo', 'cd', 'export', 'set', 'source', '.'}
+
 
 def parse_job(system, job_name, job_file, a_job_line, logdir):
+    # pandas is only needed here, keep it out of asub startup
+    import pandas as pd
+
     df_list = []
     df = pd.DataFrame()
     if job_file is not None:
@@ -37,11 +124,307 @@ def parse_job(system, job_name, job_file, a_job_line, logdir):
     return job_num
 
 
-def submit_job_sge(job_name, total_job_num, queue, prj_id, resource, logdir):
-    submit_f = os.path.join(os.path.dirname(logdir), f"{job_name}_submit.sh")
+def iter_job_line(job_file):
+    """
+    yield the lines of job files (stdin if job_file is None) as raw bytes,
+    blank lines are skipped
+    """
+    if job_file is None:
+        handles = [sys.stdin.buffer]
+    else:
+        handles = (open(f, 'rb') for f in job_file)
+    for h in handles:
+        try:
+            for line in h:
+                if line.strip() == b'':
+                    continue
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                yield line
+        finally:
+            if h is not sys.stdin.buffer:
+                h.close()
+
+
+def parse_job_bundle(job_name, job_file, a_job_line, logdir):
+    """
+    stream job files once into {job_name}.bundle, every a_job_line lines form a task,
+    the byte offset and length of each task are written to {job_name}.index
+    """
+    bundle_f = os.path.join(logdir, f"{job_name}.bundle")
+    index_f = os.path.join(logdir, f"{job_name}.index")
+    job_num = 0
+    with open(bundle_f, 'wb') as bundle_h, open(index_f, 'wb') as index_h:
+        offset = 0
+        length = 0
+        line_num = 0
+        for line in iter_job_line(job_file):
+            bundle_h.write(line)
+            length += len(line)
+            line_num += 1
+            if line_num == a_job_line:
+                index_h.write(bundle_index_record(offset, length))
+                job_num += 1
+                offset += length
+                length = 0
+                line_num = 0
+        if line_num > 0:
+            index_h.write(bundle_index_record(offset, length))
+            job_num += 1
+    return job_num
+
+
+def line_weights(lines, pack_by):
+    """
+    estimated cost of every job line:
+      length:   bytes of the line
+      column:   a number in the last tab separated column, which is removed from the line
+      filesize: total size of the existing files named in the line
+    return (lines, weights)
+    """
+    if pack_by == "length":
+        return lines, [len(line) for line in lines]
+    if pack_by == "column":
+        commands = []
+        weights = []
+        for line in lines:
+            command, _, weight = line.rstrip(b'\n').rpartition(b'\t')
+            if not command:
+                raise ValueError(f"no weight column in job line: {line.decode(errors='replace').strip()}")
+            commands.append(command + b'\n')
+            weights.append(float(weight))
+        return commands, weights
+    sizes = {}
+    weights = []
+    for line in lines:
+        weight = 0
+        for word in set(line.decode(errors='replace').split()):
+            if word not in sizes:
+                try:
+                    sizes[word] = os.stat(word).st_size if os.path.isfile(word) else 0
+                except (OSError, ValueError):
+                    sizes[word] = 0
+            weight += sizes[word]
+        weights.append(weight)
+    return lines, weights
+
+
+def pack_lines(weights, task_num):
+    """
+    LPT: give the heaviest remaining line to the least loaded task,
+    the max task load is at most 4/3 of the optimum,
+    return ([line indexes of each task, in input order], [load of each task])
+    """
+    heap = [(0, i) for i in range(task_num)]
+    tasks = [[] for _ in range(task_num)]
+    loads = [0] * task_num
+    for index in sorted(range(len(weights)), key=lambda i: -weights[i]):
+        load, task = heapq.heappop(heap)
+        tasks[task].append(index)
+        loads[task] = load + weights[index]
+        heapq.heappush(heap, (loads[task], task))
+    return [sorted(i) for i in tasks], loads
+
+
+def parse_job_packed(job_name, job_file, a_job_line, logdir, pack_by, task_num=None, bundle=False):
+    """
+    group job lines into task_num tasks (default: lines / a_job_line) by weight instead of by order,
+    tasks are written as {job_name}_{n}.sh files or as a bundle
+    """
+    lines, weights = line_weights(list(iter_job_line(job_file)), pack_by)
+    if not lines:
+        return 0
+    if task_num is None:
+        task_num = math.ceil(len(lines) / a_job_line)
+    task_num = max(1, min(task_num, len(lines)))
+    tasks, loads = pack_lines(weights, task_num)
+    size = math.ceil(len(lines) / task_num)
+    chunked = [sum(weights[i:i + size]) for i in range(0, len(weights), size)]
+    print(f"packed {len(lines)} lines into {task_num} tasks by {pack_by}, max task load {max(loads):g} "
+          f"(mean {sum(loads) / task_num:g}), consecutive chunks of {size} lines: max {max(chunked):g}")
+
+    if bundle:
+        bundle_f = os.path.join(logdir, f"{job_name}.bundle")
+        index_f = os.path.join(logdir, f"{job_name}.index")
+        with open(bundle_f, 'wb') as bundle_h, open(index_f, 'wb') as index_h:
+            offset = 0
+            for task in tasks:
+                data = b''.join(lines[i] for i in task)
+                bundle_h.write(data)
+                index_h.write(bundle_index_record(offset, len(data)))
+                offset += len(data)
+    else:
+        for job_num, task in enumerate(tasks, 1):
+            job_f = os.path.join(logdir, f"{job_name}_{job_num}.sh")
+            with open(job_f, 'wb') as h:
+                h.write(b''.join(lines[i] for i in task))
+            os.chmod(job_f, 0o744)
+    return task_num
+
+
+def bundle_index_record(offset, length):
+    half = BUNDLE_INDEX_WIDTH // 2
+    return f"{offset:{half - 1}d} {length:{half - 1}d}\n".encode()
+
+
+def bundle_task_command(job_name, logdir, task_id, line_jobs=None):
+    """
+    shell lines to run task {task_id} of a bundle: read its record from the index
+    and feed its bytes from the bundle to bash, both by seeking,
+    or to run_lines when line_jobs is given
+    """
+    bundle_f = os.path.join(logdir, f"{job_name}.bundle")
+    index_f = os.path.join(logdir, f"{job_name}.index")
+    task = f"<(tail -c +$((offset + 1)) {bundle_f} | head -c $length)"
+    read_index = f"read offset length < <(dd if={index_f} bs={BUNDLE_INDEX_WIDTH} skip=$(({task_id} - 1)) count=1 2>/dev/null)"
+    if line_jobs:
+        prefix = os.path.join(logdir, f"{job_name}_{task_id}")
+        return f"{RUN_LINES}\n{read_index}\nrun_lines {line_jobs} \"{prefix}\" < {task}"
+    return f"{read_index}\nbash {task}"
+
+
+def parallel_task_command(job_name, logdir, task_id, line_jobs):
+    """
+    shell lines to run the lines of task {task_id} through run_lines
+    """
+    job_script = os.path.join(logdir, f"{job_name}_{task_id}.sh")
+    prefix = os.path.join(logdir, f"{job_name}_{task_id}")
+    return f"{RUN_LINES}\nrun_lines {line_jobs} \"{prefix}\" < {job_script}"
+
+
+def array_chunks(total_job_num, max_array_size=None):
+    """
+    split task 1..total_job_num into (start, end) ranges of at most max_array_size tasks
+    """
+    if (max_array_size is None) or (max_array_size <= 0):
+        max_array_size = total_job_num
+    return [(start, min(start + max_array_size - 1, total_job_num))
+            for start in range(1, total_job_num + 1, max_array_size)]
+
+
+def run_scheduler(argv):
+    """
+    run a scheduler command without a shell and return its stdout, with the timeout and retries
+    of sgetk.retry: a timeout is not retried, the submission may have reached the scheduler
+    """
+    try:
+        return check_output(argv).decode()
+    except subprocess.CalledProcessError as e:
+        sys.stderr.write(e.stderr.decode(errors='replace'))
+        raise
+
+
+def submit(argv):
+    """
+    run a qsub -terse or sbatch --parsable command, return the job id it printed
+    """
+    print(f"Running: {' '.join(shlex.quote(i) for i in argv)}")
+    output = run_scheduler(argv)
+    sys.stdout.write(output)
+    sys.stdout.flush()
+    # "123.1-10:1" (sge array), "123" or "123;cluster" (slurm)
+    match = re.match(r'\s*(\d+)', output)
+    if match is None:
+        raise RuntimeError(f"no job id in the output of {os.path.basename(argv[0])}: {output.strip()!r}")
+    return match.group(1)
+
+
+def dependency_argv(system, depends, chunk):
+    """
+    qsub or sbatch options which hold array chunk {chunk} on the upstream stages of a pipeline,
+    depends: [(job ids of an upstream stage, one per chunk, taskwise)],
+    taskwise: task i waits for task i of the same chunk, else for the whole upstream stage,
+    sge releases a held job whatever the upstream exit status, see exit_marker_command for holding on failure,
+    slurm cancels a job whose dependency can never be satisfied
+    """
+    whole = [i for job_ids, taskwise in depends if not taskwise for i in job_ids]
+    tasks = [job_ids[chunk] for job_ids, taskwise in depends if taskwise]
+    if system == "sge":
+        return (["-hold_jid", ",".join(whole)] if whole else []) + \
+            (["-hold_jid_ad", ",".join(tasks)] if tasks else [])
+    conditions = (["afterok:" + ":".join(whole)] if whole else []) + \
+        (["aftercorr:" + ":".join(tasks)] if tasks else [])
+    return ["--dependency=" + ",".join(conditions), "--kill-on-invalid-dep=yes"] if conditions else []
+
+
+def probe_max_array_size(system):
+    """
+    the max number of tasks in one array job allowed by the scheduler,
+    SGE: max_aj_tasks of qconf -sconf, SLURM: MaxArraySize - 1 of scontrol show config,
+    None if unlimited or unknown
+    """
+    if system == "sge":
+        cmd, pattern, shift = ["qconf", "-sconf"], r'^max_aj_tasks\s+(\d+)', 0
+    elif system == "slurm":
+        cmd, pattern, shift = ["scontrol", "show", "config"], r'^MaxArraySize\s*=\s*(\d+)', 1
+    else:
+        return None
+    try:
+        output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True, timeout=TIMEOUT).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    match = re.search(pattern, output, re.M)
+    if match is None or int(match.group(1)) - shift <= 0:
+        return None
+    return int(match.group(1)) - shift
+
+
+def submit_script_path(job_name, logdir):
+    return os.path.join(os.path.dirname(logdir), f"{job_name}_submit.sh")
+
+
+def exit_marker_command(job_name, logdir, task_id, hold_on_failure=False):
+    """
+    shell lines which write the exit status of the task to {job_name}_{task_id}.exit
+    and exit with it, a task killed by the scheduler leaves no marker,
+    hold_on_failure: a failed task exits 100 instead, sge puts it in error state
+    and keeps the jobs held on it, qdel it to resume
+    """
+    marker = os.path.join(logdir, f"{job_name}_{task_id}.exit")
+    failure = "\n[ $status -ne 0 ] && exit 100" if hold_on_failure else ""
+    return f'''status=$?
+echo $status > {marker}.tmp && mv -f {marker}.tmp {marker}{failure}
+exit $status'''
+
+
+def stats_path(job_name, logdir):
+    return os.path.join(logdir, f"{job_name}.stats")
+
+
+def task_stats_code():
+    return f"FORMAT = {STATS_FORMAT!r}\nWIDTH = {STATS_WIDTH}\n{TASK_STATS}"
+
+
+def stats_task_command(job_name, logdir, task_id, run_task):
+    """
+    shell lines which run the task lines run_task under the TASK_STATS wrapper,
+    or as they are when the node has no python3
+    """
+    wrapper = shlex.quote(task_stats_code())
+    return f'''run_task() {{
+{run_task}
+}}
+if command -v python3 > /dev/null 2>&1; then
+    export -f run_task
+    python3 -c {wrapper} {stats_path(job_name, logdir)} {task_id} bash -c run_task
+else
+    run_task
+fi'''
+
+
+def submit_job_sge(job_name, total_job_num, queue, prj_id, resource, logdir, bundle=False,
+                   max_array_size=None, max_running=None, line_jobs=None, depends=None, hold_on_failure=False):
+    submit_f = submit_script_path(job_name, logdir)
     array_range = f"1-{total_job_num}:1"
     job_script = os.path.join(logdir, f"{job_name}_$SGE_TASK_ID.sh")
     num_proc = resource.split('=')[-1]
+    if bundle:
+        run_task = bundle_task_command(job_name, logdir, "$SGE_TASK_ID", line_jobs)
+    elif line_jobs:
+        run_task = parallel_task_command(job_name, logdir, "$SGE_TASK_ID", line_jobs)
+    else:
+        run_task = f"jobscript={job_script}\nbash $jobscript"
 
     with open(submit_f, 'w') as submit_h:
         submit_h.write(f'''#!/bin/bash\n\
@@ -55,18 +438,36 @@ def submit_job_sge(job_name, total_job_num, queue, prj_id, resource, logdir):
 #$ -q {queue}
 #$ -P {prj_id}
 #$ -t {array_range}
-jobscript={job_script}
-bash $jobscript\n''')
+{stats_task_command(job_name, logdir, "$SGE_TASK_ID", run_task)}
+{exit_marker_command(job_name, logdir, "$SGE_TASK_ID", hold_on_failure)}\n''')
 
     os.chmod(submit_f, 0o744)
-    error = os.path.join(logdir, f"{job_name}_\\$TASK_ID.e")
-    output = os.path.join(logdir, f"{job_name}_\\$TASK_ID.o")
-    qsub = shutil.which("qsub")
-    submit_cmd = f"{qsub} -e {error} -o {output} {submit_f}"
-    subprocess.call(submit_cmd, shell=True)
+    chunks = array_chunks(total_job_num, max_array_size)
+    return submit_array_sge(job_name, logdir, submit_f, chunks, max_running, whole=len(chunks) == 1, depends=depends)
 
 
-def submit_job_slurm(job_name, total_job_num, partition_list, qos_list, node, threads, memory, logdir):
+def submit_array_sge(job_name, logdir, submit_f, ranges, max_running=None, whole=False, depends=None):
+    """
+    one qsub of submit_f per (start, end) task range, -t takes a single range,
+    whole: ranges is the full array of the script, no -t needed,
+    depends: see dependency_argv, return the job id of every range
+    """
+    # no shell in between, qsub expands $TASK_ID itself
+    error = os.path.join(logdir, f"{job_name}_$TASK_ID.e")
+    output = os.path.join(logdir, f"{job_name}_$TASK_ID.o")
+    qsub = shutil.which("qsub") or "qsub"
+    throttle = ["-tc", str(max_running)] if max_running else []
+    job_ids = []
+    for chunk, (start, end) in enumerate(ranges):
+        # max_aj_tasks limits the number of tasks, so every chunk keeps its real task id
+        array = [] if whole else ["-t", f"{start}-{end}:1"]
+        hold = dependency_argv("sge", depends, chunk) if depends else []
+        job_ids.append(submit([qsub, "-terse", "-e", error, "-o", output] + array + throttle + hold + [submit_f]))
+    return job_ids
+
+
+def submit_job_slurm(job_name, total_job_num, partition_list, qos_list, node, threads, memory, logdir, bundle=False,
+                     max_array_size=None, max_running=None, line_jobs=None, depends=None):
     """ 
     Refer here: https://hpc.hku.hk/guide/slurm-guide/
     Replacement Symbol  Description
@@ -75,19 +476,29 @@ def submit_job_slurm(job_name, total_job_num, partition_list, qos_list, node, th
     %J  JobID.stepid of the running job (e.g. “128.0”)
     %j  JobID of the running job
     %x  Job name
+
+    MaxArraySize limits the array index, so every chunk of a split array is submitted
+    as 1-N with ASUB_TASK_OFFSET exported, the script adds it back to get the real task id
+    and writes its own {job_name}_{task_id}.out/.err
     """
  
     GPU_INFO = ""
     if ("gpu" in partition_list) or ("gpu" in qos_list):
         GPU_INFO = "#SBATCH --gres=gpu:1"
 
-    submit_f = os.path.join(os.path.dirname(logdir), f"{job_name}_submit.sh")
+    submit_f = submit_script_path(job_name, logdir)
     array_range = f"1-{total_job_num}:1"
-    job_script = os.path.join(logdir, f'''{job_name}_${{SLURM_ARRAY_TASK_ID}}.sh''')
+    job_script = os.path.join(logdir, f'''{job_name}_${{task_id}}.sh''')
     job_out = os.path.join(logdir, f'''{job_name}_%a.out''')
     job_err = os.path.join(logdir, f'''{job_name}_%a.err''')
     partition = ",".join(partition_list)
     qos = ",".join(qos_list)
+    if bundle:
+        run_task = bundle_task_command(job_name, logdir, "${task_id}", line_jobs)
+    elif line_jobs:
+        run_task = parallel_task_command(job_name, logdir, "${task_id}", line_jobs)
+    else:
+        run_task = f"bash {job_script}"
 
     with open(submit_f, 'w') as submit_h:
         submit_h.write(f'''#!/bin/bash\n\
@@ -102,33 +513,549 @@ def submit_job_slurm(job_name, total_job_num, partition_list, qos_list, node, th
 #SBATCH --output={job_out}
 #SBATCH --error={job_err}
 
-bash {job_script}\n''')
+export task_id=$((${{ASUB_TASK_OFFSET:-0}} + SLURM_ARRAY_TASK_ID))
+if [ "${{ASUB_TASK_OFFSET:-0}}" -gt 0 ]; then
+    exec >{job_out.replace("%a", "${task_id}")} 2>{job_err.replace("%a", "${task_id}")}
+fi
+{stats_task_command(job_name, logdir, "${task_id}", run_task)}
+{exit_marker_command(job_name, logdir, "${task_id}")}\n''')
 
     os.chmod(submit_f, 0o744)
-    sbatch = shutil.which("sbatch")
-    submit_cmd = f"{sbatch} {submit_f}"
-    print(f"Running: {submit_cmd}")
-    subprocess.call(submit_cmd, shell=True)
+    return submit_array_slurm(job_name, logdir, submit_f, range(1, total_job_num + 1), max_array_size, max_running,
+                              whole=True, depends=depends)
 
 
-def main():
-    '''it is a very simple script to submit array job, but you need supply real run command'''
-    parser = argparse.ArgumentParser(description='make submit array job easy')
-    parser.add_argument('-system', choices=["slurm", "sge"], help='resource scheduling system, support SGE and SLURM, default: slurm', default="slurm")
-    parser.add_argument('-jobfile', nargs='*', help='job file to read, if empty, stdin is used')
-    parser.add_argument('-jobname', type=str, help='job name, default: job', default='job')
-    parser.add_argument('-jobline', type=int, help='set the number of lines to form a job, default: 1', default=1)
-    parser.add_argument('-queue', type=str, help='submit queue, sge needed, default: st.q', default='st.q')
-    parser.add_argument('-project', type=str, help='project id, sge needed, default: st.m', default='st.m')
-    parser.add_argument('-partition', nargs='*', help='partition, slurm needed, default: ["intel", "amd"], you can choose from: intel, amd, gpu, hugemem', default=['intel', 'amd'])
-    parser.add_argument('-qos', nargs='*', help='qos, slurm needed, default: ["normal"], you can choose from: debug, normal, long, special, gpu, hugemem', default=["normal"])
-    parser.add_argument('-node', type=str, help='nodes, slurm needed, default: 1', default='1')
-    parser.add_argument('-threads', type=str, help='threads, slurm needed, default: 1', default='1')
-    parser.add_argument('-memory', type=str, help='memory of each cpu, slurm need, default: 3G', default='3G')
-    parser.add_argument('-resource', type=str, help='resourse requirment, sge needed, default: vf=50M,p=1', default='vf=50M,p=1')
-    parser.add_argument('-logdir', type=str, default=None, help='array job log directory, default: None')
-    args = parser.parse_args()
+def slurm_array_windows(task_ids, max_array_size=None):
+    """
+    group task ids by MaxArraySize window: [(offset, [task id - offset, ...]), ...]
+    """
+    windows = {}
+    for task in task_ids:
+        offset = (task - 1) // max_array_size * max_array_size if max_array_size else 0
+        windows.setdefault(offset, []).append(task - offset)
+    return sorted(windows.items())
+
+
+def submit_array_slurm(job_name, logdir, submit_f, task_ids, max_array_size=None, max_running=None, whole=False,
+                       depends=None):
+    """
+    one sbatch of submit_f per MaxArraySize window, the indexes of a window can be sparse:
+    --array=3,17,200-210, whole: task_ids is the full array of the script,
+    depends: see dependency_argv, return the job id of every window
+    """
+    sbatch = shutil.which("sbatch") or "sbatch"
+    throttle = f"%{max_running}" if max_running else ""
+    windows = slurm_array_windows(task_ids, max_array_size)
+    job_ids = []
+    for chunk, (offset, indexes) in enumerate(windows):
+        array = [f"--array={compact_ranges(indexes)}{throttle}"] if (len(windows) > 1) or throttle or not whole else []
+        if offset > 0:
+            array += [f"--export=ALL,ASUB_TASK_OFFSET={offset}",
+                      "--output=" + os.path.join(logdir, f"{job_name}_offset{offset}_%a.out"),
+                      "--error=" + os.path.join(logdir, f"{job_name}_offset{offset}_%a.err")]
+        after = dependency_argv("slurm", depends, chunk) if depends else []
+        job_ids.append(submit([sbatch, "--parsable"] + array + after + [submit_f]))
+    return job_ids
+
 
+def memory_bytes(memory):
+    """
+    '50M', '3G', '10.5g', '4000' (M) -> bytes
+    """
+    match = re.match(r'^([\d.]+)([a-zA-Z]?)[bB]?$', memory.strip())
+    if match is None:
+        raise ValueError(f"can't interpret memory {memory}")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2).upper()])
+
+
+def memory_string(n):
+    """
+    bytes -> a request rounded up to M, or to 0.1G above 10G
+    """
+    if n >= 10 << 30:
+        return f"{math.ceil(n / (1 << 30) * 10) / 10:g}G"
+    return f"{math.ceil(n / (1 << 20))}M"
+
+
+def task_lines(job_name, logdir, bundle, task_id=1):
+    """
+    command lines of a task, as written by parse_job or parse_job_bundle
+    """
+    if not bundle:
+        with open(os.path.join(logdir, f"{job_name}_{task_id}.sh"), 'rb') as h:
+            return h.read().decode(errors='replace').splitlines()
+    with open(os.path.join(logdir, f"{job_name}.index"), 'rb') as h:
+        h.seek((task_id - 1) * BUNDLE_INDEX_WIDTH)
+        offset, length = (int(i) for i in h.read(BUNDLE_INDEX_WIDTH).split())
+    with open(os.path.join(logdir, f"{job_name}.bundle"), 'rb') as h:
+        h.seek(offset)
+        return h.read(length).decode(errors='replace').splitlines()
+
+
+def command_signature(lines):
+    """
+    the programs run by a task, in order of first use: "bwa mem ref.fa x.fq | samtools sort" -> "bwa+samtools",
+    tasks of the same pipeline have the same signature whatever their file arguments
+    """
+    programs = []
+    for line in lines:
+        for command in re.split(r'\|\||&&|[|;&]', line):
+            for word in command.split():
+                if '=' in word.split('/')[0] or word in SIGNATURE_SKIP:
+                    continue
+                program = os.path.basename(word)
+                if program not in programs:
+                    programs.append(program)
+                break
+    return "+".join(programs)
+
+
+def base_job_name(job_name):
+    """
+    job name without the _%Y%m%d%H%M%S suffix added by asub
+    """
+    return re.sub(r'_\d{14}$', '', job_name)
+
+
+def record_submission(db, job_name, signature, system):
+    """
+    remember the signature of a submitted job in the accounting store, only if the store exists,
+    so later -rightsize runs find the accounting records of the same pipeline
+    """
+    if not os.path.exists(db):
+        return
+    try:
+        conn = sqlite3.connect(db, timeout=10)
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS asub_jobs "
+                         "(job_name TEXT PRIMARY KEY, base_name TEXT, signature TEXT, system TEXT, submit_time REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS asub_jobs_signature ON asub_jobs (signature)")
+            conn.execute("INSERT OR REPLACE INTO asub_jobs VALUES (?, ?, ?, ?, ?)",
+                         (job_name, base_job_name(job_name), signature, system, time.time()))
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"can't record {job_name} in {db}: {e}", file=sys.stderr)
+
+
+def record_local_tasks(db, job_name, logdir, cores):
+    """
+    the usage records of the finished tasks of a local run as jobs rows of backend local in the accounting store,
+    only if the store exists, sge and slurm rows come from sgetk.acct ingesting qacct and sacct
+    """
+    if not os.path.exists(db):
+        return
+    rows = [("local", job_name, str(i['task']), job_name, os.environ.get("USER"), i['host'],
+             'completed' if i['exit'] == 0 else 'failed', i['exit'], cores, cores, i['user'] + i['sys'],
+             i['maxrss'] << 10, i['runtime'], i['start'], i['start'], i['end'])
+            for i in read_task_stats(job_name, logdir)]
+    try:
+        conn = sqlite3.connect(db, timeout=10)
+        with conn:
+            if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'jobs'").fetchone():
+                conn.executemany(
+                    "INSERT OR IGNORE INTO jobs (backend, job_number, task, job_name, owner, host, state, exit_status, "
+                    "slots, num_proc, cpu_usage, maxvmem, wallclock, submit_time, start_time, end_time) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"can't record the tasks of {job_name} in {db}: {e}", file=sys.stderr)
+
+
+def job_history(db, job_name, signature, system, days=HISTORY_DAYS):
+    """
+    (num_proc, cpu seconds, wallclock seconds, peak memory bytes) of completed tasks
+    of earlier runs with the same job name (asub suffix ignored) or the same command signature
+    """
+    if not os.path.exists(db):
+        return []
+    base = base_job_name(job_name)
+    conn = sqlite3.connect(db, timeout=10)
+    try:
+        tables = {i[0] for i in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'jobs' not in tables:
+            return []
+        same_commands = set()
+        if signature and 'asub_jobs' in tables:
+            same_commands = {i[0] for i in conn.execute(
+                "SELECT job_name FROM asub_jobs WHERE signature = ?", (signature,))}
+        names = "job_name GLOB ?" + " OR job_name = ?" * len(same_commands)
+        params = [system, time.time() - days * 86400, f"{base}_[0-9]*"] + sorted(same_commands)
+        rows = conn.execute(
+            "SELECT job_name, num_proc, cpu_usage, wallclock, maxvmem FROM jobs "
+            f"WHERE backend = ? AND state = 'completed' AND end_time >= ? AND ({names}) "
+            "ORDER BY end_time DESC LIMIT 100000", params).fetchall()
+    finally:
+        conn.close()
+    name_regex = re.compile(re.escape(base) + r'_\d{14}$')
+    return [row[1:] for row in rows
+            if (name_regex.match(row[0]) or row[0] in same_commands) and row[3] and row[4]]
+
+
+def quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def recommend_request(history, margin, q=RIGHTSIZE_QUANTILE, min_samples=RIGHTSIZE_MIN_SAMPLES):
+    """
+    memory: the q quantile of peak memory plus margin,
+    cores: the q quantile of busy cores (cpu seconds / wallclock), rounded up,
+    None if there are less than min_samples tasks
+    """
+    if len(history) < min_samples:
+        return None
+    peak = quantile([row[3] for row in history], q)
+    busy = quantile([row[1] / row[2] for row in history], q)
+    return {
+        'samples': len(history),
+        'memory_peak': peak,
+        'cores_busy': busy,
+        'memory': max(RIGHTSIZE_MIN_MEMORY, int(peak * (1 + margin))),
+        'cores': max(1, math.ceil(busy - RIGHTSIZE_CORE_TOLERANCE)),
+    }
+
+
+def current_request(args):
+    """
+    (memory bytes, cores) of one task as requested on the command line
+    """
+    if args.system == "sge":
+        match = re.match(r'vf=([\d\.]+\w),p=(\d+)', args.resource)
+        return memory_bytes(match.group(1)), int(match.group(2))
+    return memory_bytes(args.memory) * int(args.threads), int(args.threads)
+
+
+def rightsize(args, total_job_num, signature):
+    """
+    print the recommended request and the expected savings over all tasks,
+    in apply mode args.resource (sge) or args.memory/args.threads (slurm) are rewritten
+    """
+    history = job_history(args.history_db, args.jobname, signature, args.system)
+    advice = recommend_request(history, args.rightsize_margin)
+    if advice is None:
+        print(f"rightsize: {len(history)} completed tasks of {base_job_name(args.jobname)} "
+              f"or {signature or 'its commands'} in history, {RIGHTSIZE_MIN_SAMPLES} needed, request unchanged")
+        if not os.path.exists(args.history_db):
+            print(f"rightsize: no accounting store at {args.history_db}, see -history-db and ${STORE_ENV}")
+        return
+    memory, cores = current_request(args)
+    new_memory, new_cores = advice['memory'], advice['cores']
+    print(f"rightsize: {advice['samples']} completed tasks, peak memory {memory_string(advice['memory_peak'])}, "
+          f"busy cores {advice['cores_busy']:.2f} ({RIGHTSIZE_QUANTILE:.0%} quantile), memory margin {args.rightsize_margin:.0%}")
+    print(f"rightsize: per task {memory_string(memory)} x {cores} cores -> {memory_string(new_memory)} x {new_cores} cores")
+    saved_memory = (memory - new_memory) * total_job_num
+    saved_cores = (cores - new_cores) * total_job_num
+    print(f"rightsize: {total_job_num} tasks, memory {memory_string(memory * total_job_num)} -> "
+          f"{memory_string(new_memory * total_job_num)} ({saved_memory / (memory * total_job_num):.0%} saved), "
+          f"cores {cores * total_job_num} -> {new_cores * total_job_num} ({saved_cores} saved)")
+
+    if args.rightsize == "apply":
+        if args.system == "sge":
+            args.resource = re.sub(r'vf=[\d\.]+\w', f"vf={memory_string(new_memory)}", args.resource)
+            args.resource = re.sub(r'p=\d+', f"p={new_cores}", args.resource)
+        else:
+            args.threads = str(new_cores)
+            args.memory = memory_string(math.ceil(new_memory / new_cores))
+        print(f"rightsize: applied, {args.resource if args.system == 'sge' else f'-threads {args.threads} -memory {args.memory}'}")
+
+
+def task_ranges(task_ids):
+    """
+    [3, 17, 200, 201, 202] -> [(3, 3), (17, 17), (200, 202)]
+    """
+    ranges = []
+    for task in sorted(task_ids):
+        if ranges and task == ranges[-1][1] + 1:
+            ranges[-1][1] = task
+        else:
+            ranges.append([task, task])
+    return [tuple(i) for i in ranges]
+
+
+def compact_ranges(task_ids):
+    """
+    [3, 17, 200, 201, 202] -> "3,17,200-202"
+    """
+    return ",".join(f"{i}" if i == j else f"{i}-{j}" for i, j in task_ranges(task_ids))
+
+
+def manifest_path(job_name, logdir):
+    return os.path.join(logdir, f"{job_name}.manifest")
+
+
+def write_manifest(args, total_job_num):
+    """
+    what -resume needs to run the task set of a log directory again
+    """
+    manifest = {
+        'job_name': args.jobname,
+        'logdir': args.logdir,
+        # tasks and the submit script use paths relative to it
+        'cwd': os.getcwd(),
+        'system': args.system,
+        'submit_script': submit_script_path(args.jobname, args.logdir),
+        'max_array_size': args.max_array_size,
+        'max_running': args.max_running,
+        'total_job_num': total_job_num,
+        'bundle': args.bundle,
+        'jobline': args.jobline,
+        # the request after -rightsize apply
+        'resource': args.resource,
+        'threads': args.threads,
+        'memory': args.memory,
+        'cores': task_cores(args),
+        'line_jobs': line_jobs(args),
+        'created': datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(manifest_path(args.jobname, args.logdir), 'w') as h:
+        json.dump(manifest, h, indent=2)
+
+
+def read_manifest(logdir):
+    """
+    the manifest of a log directory written by an earlier asub run
+    """
+    logdir = logdir.rstrip("/")
+    names = [i for i in os.listdir(logdir) if i.endswith(".manifest")]
+    if len(names) != 1:
+        raise ValueError(f"{logdir} has {len(names)} manifest files, one expected")
+    with open(os.path.join(logdir, names[0])) as h:
+        return json.load(h)
+
+
+def exit_marker_path(job_name, logdir, task_id):
+    return os.path.join(logdir, f"{job_name}_{task_id}.exit")
+
+
+def write_exit_marker(job_name, logdir, task_id, returncode):
+    path = exit_marker_path(job_name, logdir, task_id)
+    with open(path + ".tmp", 'w') as h:
+        h.write(f"{returncode}\n")
+    os.replace(path + ".tmp", path)
+
+
+def read_exit_marker(job_name, logdir, task_id):
+    """
+    exit status of a finished task, None if it never finished
+    """
+    try:
+        with open(exit_marker_path(job_name, logdir, task_id)) as h:
+            return int(h.read().split()[0])
+    except (FileNotFoundError, IndexError, ValueError):
+        return None
+
+
+def unfinished_tasks(job_name, logdir, total_job_num):
+    """
+    tasks without an exit marker or with a non zero exit status
+    """
+    return [i for i in range(1, total_job_num + 1) if read_exit_marker(job_name, logdir, i) != 0]
+
+
+def task_cores(args):
+    """
+    cores of one task: -threads or p= of -resource, the larger one
+    """
+    match = re.search(r'p=(\d+)', args.resource)
+    return max(int(args.threads), int(match.group(1)) if match else 1)
+
+
+def line_jobs(args):
+    """
+    lines run at a time inside a task with -parallel-lines: -line-jobs, default the cores of a task
+    """
+    if not args.parallel_lines:
+        return None
+    return args.line_jobs or task_cores(args)
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def run_local_task(job_name, logdir, bundle, task_id, cores, procs, line_jobs=None):
+    """
+    run one task with bash under the TASK_STATS wrapper, stdout and stderr go to {job_name}_{task_id}.o/.e
+    as on SGE, the exit status is written to {job_name}_{task_id}.exit when it ends
+    """
+    if bundle:
+        argv = ["bash", "-c", bundle_task_command(job_name, logdir, str(task_id), line_jobs)]
+    elif line_jobs:
+        argv = ["bash", "-c", parallel_task_command(job_name, logdir, str(task_id), line_jobs)]
+    else:
+        argv = ["bash", os.path.join(logdir, f"{job_name}_{task_id}.sh")]
+    argv = [sys.executable, "-c", task_stats_code(), stats_path(job_name, logdir), str(task_id)] + argv
+    env = dict(os.environ, ASUB_TASK_ID=str(task_id), SGE_TASK_ID=str(task_id), NSLOTS=str(cores))
+    with open(os.path.join(logdir, f"{job_name}_{task_id}.o"), 'wb') as out_h, \
+         open(os.path.join(logdir, f"{job_name}_{task_id}.e"), 'wb') as err_h:
+        proc = subprocess.Popen(argv, stdout=out_h, stderr=err_h, env=env, start_new_session=True)
+        procs.add(proc)
+        try:
+            returncode = proc.wait()
+        finally:
+            procs.discard(proc)
+    write_exit_marker(job_name, logdir, task_id, returncode)
+    return task_id, returncode
+
+
+def run_job_local(job_name, task_ids, logdir, bundle=False, cores=1, max_running=None, line_jobs=None):
+    """
+    run tasks on this host, as many at a time as the available cores allow for cores per task,
+    return the failed task ids
+    """
+    available = available_cores()
+    if cores > available:
+        print(f"a task needs {cores} cores, only {available} available, tasks run one at a time")
+    workers = max(1, available // cores)
+    if max_running:
+        workers = min(workers, max_running)
+    print(f"Running {len(task_ids)} tasks of {job_name} locally, {workers} at a time, {cores} cores each")
+
+    procs = set()
+    failed = []
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(run_local_task, job_name, logdir, bundle, i, cores, procs, line_jobs)
+                   for i in task_ids]
+        for future in as_completed(futures):
+            task_id, returncode = future.result()
+            if returncode != 0:
+                failed.append(task_id)
+                print(f"task {task_id} exited with {returncode}, see {os.path.join(logdir, f'{job_name}_{task_id}.e')}", flush=True)
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+        for proc in list(procs):
+            try:
+                os.killpg(proc.pid, 15)
+            except ProcessLookupError:
+                pass
+        raise
+    executor.shutdown()
+    print(f"{len(task_ids) - len(failed)} tasks done, {len(failed)} failed{': ' + compact_ranges(failed) if failed else ''}")
+    return failed
+
+
+def resume_job(args):
+    """
+    run the failed or never finished tasks of an earlier asub log directory again,
+    with the same task files and submit script: local tasks in the process pool,
+    sge as one qsub -t per task range, slurm as sparse --array lists,
+    return the failed task ids of a local run
+    """
+    manifest = read_manifest(args.resume)
+    os.chdir(manifest.get('cwd', os.getcwd()))
+    job_name, logdir = manifest['job_name'], manifest['logdir']
+    tasks = unfinished_tasks(job_name, logdir, manifest['total_job_num'])
+    print(f"{job_name}: {manifest['total_job_num'] - len(tasks)} of {manifest['total_job_num']} tasks finished, "
+          f"{len(tasks)} to run{': ' + compact_ranges(tasks) if tasks else ''}")
+    if not tasks:
+        return []
+    max_running = args.max_running or manifest.get('max_running')
+    if manifest['system'] == "local":
+        failed = run_job_local(job_name, tasks, logdir, manifest['bundle'], manifest['cores'], max_running,
+                               manifest.get('line_jobs'))
+        record_local_tasks(args.history_db, job_name, logdir, manifest['cores'])
+        return failed
+
+    print("tasks still queued or running have no exit marker yet, resume an array after it left the queue")
+    max_array_size = manifest.get('max_array_size')
+    if manifest['system'] == "sge":
+        ranges = []
+        for start, end in task_ranges(tasks):
+            ranges += [(i + start - 1, j + start - 1) for i, j in array_chunks(end - start + 1, max_array_size)]
+        submit_array_sge(job_name, logdir, manifest['submit_script'], ranges, max_running)
+    else:
+        submit_array_slurm(job_name, logdir, manifest['submit_script'], tasks, max_array_size, max_running)
+    return []
+
+
+def read_task_stats(job_name, logdir):
+    """
+    the usage records of {job_name}.stats, one dict per finished task,
+    slots of tasks which never finished are holes of zero bytes
+    """
+    path = stats_path(job_name, logdir)
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, 'rb') as h:
+        while True:
+            record = h.read(STATS_WIDTH)
+            if not record:
+                break
+            values = record.strip(b"\0").split()
+            if len(values) != len(STATS_FIELDS):
+                continue
+            task = dict(zip(STATS_FIELDS, (i.decode(errors='replace') for i in values)))
+            for field in ['task', 'exit', 'maxrss']:
+                task[field] = int(task[field])
+            for field in ['start', 'end', 'user', 'sys']:
+                task[field] = float(task[field])
+            task['runtime'] = task['end'] - task['start']
+            records.append(task)
+    return records
+
+
+def duration_string(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def distribution(values, to_string):
+    return "  ".join(f"{name} {to_string(quantile(values, q))}" for name, q in
+                     [("min", 0), ("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1)])
+
+
+def print_task_stats(logdir, top=10):
+    """
+    runtime, peak memory and cpu use of the finished tasks of an asub log directory,
+    the stragglers (runtime above STRAGGLER_FACTOR x median) and the hosts with the slowest tasks
+    """
+    manifest = read_manifest(logdir)
+    job_name, total_job_num = manifest['job_name'], manifest['total_job_num']
+    records = read_task_stats(job_name, logdir.rstrip("/"))
+    failed = [i['task'] for i in records if i['exit'] != 0]
+    print(f"{job_name}: {len(records)} of {total_job_num} tasks recorded, "
+          f"{len(failed)} failed{': ' + compact_ranges(failed) if failed else ''}")
+    if not records:
+        return records
+
+    runtimes = [i['runtime'] for i in records]
+    median = quantile(runtimes, 0.5)
+    cores = manifest.get('cores') or 1
+    print(f"runtime   {distribution(runtimes, duration_string)}")
+    print(f"max rss   {distribution([i['maxrss'] << 10 for i in records], memory_string)}")
+    print(f"cpu       {distribution([(i['user'] + i['sys']) / max(i['runtime'], 1e-3) for i in records], lambda x: f'{x:.2f}')}"
+          f"  (busy cores, {cores} requested)")
+    span = max(i['end'] for i in records) - min(i['start'] for i in records)
+    print(f"span      {duration_string(span)}, {duration_string(sum(runtimes))} task time")
+
+    stragglers = sorted((i for i in records if i['runtime'] > STRAGGLER_FACTOR * median),
+                        key=lambda i: i['runtime'], reverse=True)
+    print(f"stragglers ({len(stragglers)} tasks above {STRAGGLER_FACTOR:g} x median {duration_string(median)}):")
+    for i in stragglers[:top]:
+        print(f"  task {i['task']}\t{i['host']}\t{duration_string(i['runtime'])}\t{i['runtime'] / max(median, 1e-3):.1f}x")
+
+    hosts = {}
+    for i in records:
+        hosts.setdefault(i['host'], []).append(i['runtime'])
+    slowest = sorted(hosts.items(), key=lambda i: quantile(i[1], 0.5), reverse=True)
+    print(f"slowest hosts ({len(hosts)} hosts, median runtime):")
+    for host, values in slowest[:top]:
+        print(f"  {host}\t{len(values)} tasks\t{duration_string(quantile(values, 0.5))}"
+              f"\t{quantile(values, 0.5) / max(median, 1e-3):.1f}x")
+    return records
+
+
+def setup_job(args):
+    """
+    check the options, name the job and its log directory, write the task files and the manifest,
+    return (number of tasks, command signature)
+    """
     if args.system == "sge":
         assert re.match(r'vf=[\d\.]+\w,p=\d+', args.resource), "please specific memory usage and number processor"
         assert not re.match(r'^\d+', args.jobname), "array job name cannot start with a digit"
@@ -147,13 +1074,193 @@ def main():
     #print(args.logdir)
     os.makedirs(args.logdir)
 
-    total_job_num = parse_job(args.system, args.jobname, args.jobfile, args.jobline, args.logdir)
+    if args.pack_by is not None:
+        total_job_num = parse_job_packed(args.jobname, args.jobfile, args.jobline, args.logdir, args.pack_by,
+                                         args.tasks, args.bundle)
+    elif args.bundle:
+        total_job_num = parse_job_bundle(args.jobname, args.jobfile, args.jobline, args.logdir)
+    else:
+        total_job_num = parse_job(args.system, args.jobname, args.jobfile, args.jobline, args.logdir)
+
+    signature = command_signature(task_lines(args.jobname, args.logdir, args.bundle)) if total_job_num else ""
+    if args.rightsize != "off":
+        rightsize(args, total_job_num, signature)
+
+    if (args.max_array_size is None) and (args.system != "local"):
+        args.max_array_size = probe_max_array_size(args.system)
+    write_manifest(args, total_job_num)
+    return total_job_num, signature
+
 
+def submit_job(args, total_job_num, depends=None, hold_on_failure=False):
+    """
+    submit the array of a set up job to sge or slurm, return the job id of every array chunk,
+    hold_on_failure: see exit_marker_command, sge only
+    """
     if args.system == "sge":
-        submit_job_sge(args.jobname, total_job_num, args.queue, args.project, args.resource, args.logdir)
-    elif args.system == "slurm":
-        submit_job_slurm(args.jobname, total_job_num, args.partition, args.qos, args.node, args.threads, args.memory, args.logdir)
+        return submit_job_sge(args.jobname, total_job_num, args.queue, args.project, args.resource, args.logdir, args.bundle,
+                              args.max_array_size, args.max_running, line_jobs(args), depends, hold_on_failure)
+    return submit_job_slurm(args.jobname, total_job_num, args.partition, args.qos, args.node, args.threads, args.memory, args.logdir, args.bundle,
+                            args.max_array_size, args.max_running, line_jobs(args), depends)
+
+
+def read_pipeline(path):
+    """
+    a pipeline spec (json): {"name": "wgs", "stages": [
+        {"name": "align", "jobfile": "align.sh", "resource": "vf=8G,p=8"},
+        {"name": "sort", "jobfile": "sort.sh", "after_task": ["align"]},
+        {"name": "call", "jobfile": "call.sh", "after": ["sort"]}]}
+    a stage waits for the whole of its "after" stages, and task i waits for task i of its "after_task" stages,
+    other keys are asub options of the stage (jobline, queue, threads, memory ...), default: the command line,
+    job files are relative to the spec
+    """
+    with open(path) as h:
+        spec = json.load(h)
+    names = [stage['name'] for stage in spec['stages']]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{path}: stage names are not unique")
+    for stage in spec['stages']:
+        unknown = set(stage) - STAGE_KEYS
+        if unknown:
+            raise ValueError(f"{path}: unknown keys of stage {stage['name']}: {', '.join(sorted(unknown))}")
+        for upstream in stage.get('after', []) + stage.get('after_task', []):
+            if upstream not in names:
+                raise ValueError(f"{path}: stage {stage['name']} depends on unknown stage {upstream}")
+        job_files = stage.get('jobfile', [])
+        job_files = [job_files] if isinstance(job_files, str) else job_files
+        if not job_files:
+            raise ValueError(f"{path}: stage {stage['name']} has no jobfile")
+        stage['jobfile'] = [os.path.join(os.path.dirname(path), i) for i in job_files]
+    spec.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    spec['stages'] = stage_order(spec['stages'])
+    return spec
+
+
+def stage_order(stages):
+    """
+    stages sorted so every stage comes after its upstream stages, raise ValueError on a cycle
+    """
+    pending = list(stages)
+    ordered, done = [], set()
+    while pending:
+        ready = [i for i in pending if set(i.get('after', []) + i.get('after_task', [])) <= done]
+        if not ready:
+            raise ValueError(f"dependency cycle among stages {', '.join(i['name'] for i in pending)}")
+        for stage in ready:
+            ordered.append(stage)
+            done.add(stage['name'])
+            pending.remove(stage)
+    return ordered
+
+
+def submit_pipeline(args):
+    """
+    set up every stage of a pipeline spec and submit them all at once, held by the scheduler:
+    sge -hold_jid / -hold_jid_ad, slurm --dependency=afterok / aftercorr,
+    a failed sge task of a stage with downstream stages goes to error state so they stay held,
+    a taskwise dependency needs the same number of tasks and array chunks on both stages, else the stage waits for the whole upstream stage,
+    local stages run one after another, a stage is skipped when an upstream stage failed,
+    return the failed stage names
+    """
+    spec = read_pipeline(args.pipeline)
+    upstream_names = {i for stage in spec['stages'] for i in stage.get('after', []) + stage.get('after_task', [])}
+    submitted = {}
+    failed = []
+    for stage in spec['stages']:
+        stage_args = argparse.Namespace(**vars(args))
+        for key, value in stage.items():
+            if key not in ('name', 'after', 'after_task'):
+                setattr(stage_args, key, value)
+        stage_args.jobname = f"{spec['name']}_{stage['name']}"
+        if args.logdir is not None:
+            stage_args.logdir = os.path.join(args.logdir, stage_args.jobname)
+        upstream = stage.get('after', []) + stage.get('after_task', [])
+
+        if args.system == "local":
+            if set(upstream) & set(failed):
+                print(f"stage {stage['name']} skipped, upstream stage failed")
+                failed.append(stage['name'])
+                continue
+            total_job_num, signature = setup_job(stage_args)
+            if run_job_local(stage_args.jobname, list(range(1, total_job_num + 1)), stage_args.logdir, stage_args.bundle,
+                             task_cores(stage_args), stage_args.max_running, line_jobs(stage_args)):
+                failed.append(stage['name'])
+            record_local_tasks(args.history_db, stage_args.jobname, stage_args.logdir, task_cores(stage_args))
+            record_submission(args.history_db, stage_args.jobname, signature, args.system)
+            continue
+
+        total_job_num, signature = setup_job(stage_args)
+        depends = []
+        for name in upstream:
+            taskwise = name in stage.get('after_task', [])
+            shape = (submitted[name]['total_job_num'], submitted[name]['max_array_size'])
+            if taskwise and shape != (total_job_num, stage_args.max_array_size):
+                print(f"stage {stage['name']} has {total_job_num} tasks, {name} {shape[0]}, "
+                      f"it waits for the whole of {name} instead of task by task")
+                taskwise = False
+            depends.append((submitted[name]['job_ids'], taskwise))
+        job_ids = submit_job(stage_args, total_job_num, depends, hold_on_failure=stage['name'] in upstream_names)
+        submitted[stage['name']] = {'job_ids': job_ids, 'total_job_num': total_job_num,
+                                    'max_array_size': stage_args.max_array_size}
+        record_submission(args.history_db, stage_args.jobname, signature, args.system)
+        print(f"stage {stage['name']}: {total_job_num} tasks, job {','.join(str(i) for i in job_ids)}")
+    return failed
+
+
+def main():
+    '''it is a very simple script to submit array job, but you need supply real run command'''
+    parser = argparse.ArgumentParser(description='make submit array job easy')
+    parser.add_argument('-system', choices=["slurm", "sge", "local"], help='resource scheduling system, support SGE, SLURM and local (run tasks on this host), default: slurm', default="slurm")
+    parser.add_argument('-jobfile', nargs='*', help='job file to read, if empty, stdin is used')
+    parser.add_argument('-jobname', type=str, help='job name, default: job', default='job')
+    parser.add_argument('-jobline', type=int, help='set the number of lines to form a job, default: 1', default=1)
+    parser.add_argument('-queue', type=str, help='submit queue, sge needed, default: st.q', default='st.q')
+    parser.add_argument('-project', type=str, help='project id, sge needed, default: st.m', default='st.m')
+    parser.add_argument('-partition', nargs='*', help='partition, slurm needed, default: ["intel", "amd"], you can choose from: intel, amd, gpu, hugemem', default=['intel', 'amd'])
+    parser.add_argument('-qos', nargs='*', help='qos, slurm needed, default: ["normal"], you can choose from: debug, normal, long, special, gpu, hugemem', default=["normal"])
+    parser.add_argument('-node', type=str, help='nodes, slurm needed, default: 1', default='1')
+    parser.add_argument('-threads', type=str, help='threads, slurm and local needed, default: 1', default='1')
+    parser.add_argument('-memory', type=str, help='memory of each cpu, slurm need, default: 3G', default='3G')
+    parser.add_argument('-resource', type=str, help='resourse requirment, sge needed, default: vf=50M,p=1', default='vf=50M,p=1')
+    parser.add_argument('-logdir', type=str, default=None, help='array job log directory, default: None')
+    parser.add_argument('-bundle', action='store_true', help='pack all tasks into one bundle file with a byte offset index, instead of one .sh file per task')
+    parser.add_argument('-max-array-size', dest='max_array_size', type=int, default=None, help='max tasks per array job, larger task sets are split into several arrays, default: probe max_aj_tasks (sge) or MaxArraySize (slurm)')
+    parser.add_argument('-max-running', dest='max_running', type=int, default=None, help='max running tasks of each array job, sge -tc or slurm %%N, default: None')
+    parser.add_argument('-rightsize', choices=["off", "recommend", "apply"], default="off", help=f'size memory and cores from peak usage of earlier runs with the same job name or commands, read from the accounting store of sgetk.acct (-history-db, ${STORE_ENV}), default: off')
+    parser.add_argument('-rightsize-margin', dest='rightsize_margin', type=float, default=0.2, help='safety margin added to the observed peak, default: 0.2')
+    parser.add_argument('-history-db', dest='history_db', type=str, default=HISTORY_DB, help=f'accounting store of sgetk.acct, default: ${STORE_ENV} or ~/.sgetk/accounting.db')
+    parser.add_argument('-pack-by', dest='pack_by', choices=["length", "column", "filesize"], default=None, help='group lines into tasks by weight (LPT) instead of every -jobline lines: line length, a number in the last tab separated column, or the size of files named in the line, default: None')
+    parser.add_argument('-tasks', type=int, default=None, help='number of tasks to pack lines into, -pack-by needed, default: lines / -jobline')
+    parser.add_argument('-parallel-lines', dest='parallel_lines', action='store_true', help='run the lines of a task in parallel, each line logs to {job_name}_{n}.line{k}.o/.e and its exit status to {job_name}_{n}.lines, bash >= 4.3 starts a line as soon as one ends, older bash runs them in batches')
+    parser.add_argument('-line-jobs', dest='line_jobs', type=int, default=None, help='lines run at a time inside a task, -parallel-lines needed, default: cores of a task (-threads or p=)')
+    parser.add_argument('-resume', type=str, default=None, metavar='LOGDIR', help='submit or run the failed or never finished tasks of an earlier log directory again, with its -system, task files and submit script')
+    parser.add_argument('-stats', type=str, default=None, metavar='LOGDIR', help='show runtime, memory and cpu of the finished tasks of a log directory, the stragglers and the slowest hosts')
+    parser.add_argument('-top', type=int, default=10, help='stragglers and hosts shown, -stats needed, default: 10')
+    parser.add_argument('-pipeline', type=str, default=None, metavar='SPEC', help='submit all stages of a pipeline spec (json) at once, later stages are held by scheduler dependencies, task i of an after_task stage waits only for task i upstream')
+    args = parser.parse_args()
+
+    if args.stats is not None:
+        print_task_stats(args.stats, args.top)
+        sys.exit(0)
+
+    if args.resume is not None:
+        failed = resume_job(args)
+        sys.exit(1 if failed else 0)
+
+    if args.pipeline is not None:
+        failed = submit_pipeline(args)
+        sys.exit(1 if failed else 0)
+
+    total_job_num, signature = setup_job(args)
+    if args.system == "local":
+        failed = run_job_local(args.jobname, list(range(1, total_job_num + 1)), args.logdir, args.bundle,
+                               task_cores(args), args.max_running, line_jobs(args))
+        record_local_tasks(args.history_db, args.jobname, args.logdir, task_cores(args))
+        record_submission(args.history_db, args.jobname, signature, args.system)
+        sys.exit(1 if failed else 0)
 
+    submit_job(args, total_job_num)
+    record_submission(args.history_db, args.jobname, signature, args.system)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# statement: modules it must not import
+IMPORT_CASES = {
+    "import sgetk": ["pandas", "numpy", "lxml"],
+    "from sgetk import human2bytes, bytes2human; human2bytes('10.5g'); bytes2human(1 << 30)": ["pandas", "numpy", "lxml"],
+    "import sgetk.asub": ["pandas", "numpy"],
+    "import sgetk.qstat": ["pandas", "numpy", "lxml"],
+    "from sgetk import qstat": ["pandas", "numpy", "lxml"],
+    "import sgetk.archive": ["pandas", "numpy"],
+}
+
+IMPORT_TIMER = '''
+import sys, time, json
+t = time.perf_counter()
+exec(sys.argv[1])
+t = time.perf_counter() - t
+print(json.dumps({"seconds": t, "modules": sorted(sys.modules)}))
+'''
+
+
+def import_time(statement, repeat=5):
+    """
+    run statement in fresh interpreters, return (best seconds, modules loaded by the last run)
+    """
+    best = None
+    modules = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_TIMER, statement])
+        result = json.loads(output)
+        modules = result["modules"]
+        if best is None or result["seconds"] < best:
+            best = result["seconds"]
+    return best, modules
+
+
+def bench_import(repeat=5, max_seconds=None):
+    """
+    import time regression benchmark, a case fails when it loads a forbidden module
+    or is slower than max_seconds
+    """
+    failed = 0
+    for statement, forbidden in IMPORT_CASES.items():
+        seconds, modules = import_time(statement, repeat)
+        loaded = [i for i in forbidden if i in modules]
+        status = "ok"
+        if loaded:
+            status = "loaded " + ",".join(loaded)
+        elif (max_seconds is not None) and (seconds > max_seconds):
+            status = f"slower than {max_seconds}s"
+        if status != "ok":
+            failed += 1
+        print(f"{seconds * 1000:10.2f} ms\t{status}\t{statement}")
+    return failed
+
+
+OWNERS = [f"user{i:03d}" for i in range(200)]
+PROJECTS = [f"P{i:02d}Z{i * 7 % 100:02d}" for i in range(40)]
+QUEUES = ["st.q", "st_supermem.q", "gpu.q"]
+# virtual_free strings as users write them, a plain number is bytes
+MEMORY_REQUESTS = ["500M", "1G", "2g", "5G", "10.5g", "50M", "1.5G", "4000000000", "16G", "100G"]
+# snapshots in the archive of the archive.query stage
+ARCHIVE_SNAPSHOTS = 10
+
+
+def hard_request_xml(rnd):
+    """
+    a mix of hard_request shapes: none, a single element (dict after element2dict)
+    or a list of two or three elements
+    """
+    shape = rnd.random()
+    requests = []
+    if shape < 0.05:
+        return ""
+    if shape < 0.85:
+        requests.append(("num_proc", str(rnd.choice([1, 1, 2, 4, 8, 16]))))
+    if shape > 0.15:
+        requests.append(("virtual_free", rnd.choice(MEMORY_REQUESTS)))
+    if shape > 0.95:
+        requests.append(("high_priority", "TRUE"))
+    return "".join(f"<hard_request name=\"{name}\" resource_contribution=\"0.000000\">{value}</hard_request>"
+                   for name, value in requests)
+
+
+def job_list_xml(rnd, job_number, task, running):
+    owner = rnd.choice(OWNERS)
+    queue = rnd.choice(QUEUES)
+    slots = rnd.choice([1, 1, 1, 2, 4])
+    job = [f"<job_list state=\"{'running' if running else 'pending'}\">",
+           f"<JB_job_number>{job_number}</JB_job_number>",
+           f"<JAT_prio>{rnd.random():.5f}</JAT_prio>",
+           f"<JAT_ntix>{rnd.random():.5f}</JAT_ntix>",
+           f"<JB_name>job_{job_number % 997}</JB_name>",
+           f"<JB_owner>{owner}</JB_owner>",
+           f"<JB_project>{rnd.choice(PROJECTS)}</JB_project>",
+           "<JB_department>defaultdepartment</JB_department>",
+           f"<state>{'r' if running else 'qw'}</state>"]
+    if running:
+        job += [f"<JAT_start_time>2026-10-01T{rnd.randrange(24):02d}:00:00</JAT_start_time>",
+                f"<cpu_usage>{rnd.uniform(0, 1e6):.2f}</cpu_usage>",
+                f"<mem_usage>{rnd.uniform(0, 1e5):.5f}</mem_usage>",
+                f"<io_usage>{rnd.uniform(0, 100):.5f}</io_usage>",
+                f"<queue_name>{queue}@node{rnd.randrange(2000):04d}</queue_name>"]
+    else:
+        job += ["<JB_submission_time>2026-10-01T00:00:00</JB_submission_time>",
+                "<queue_name></queue_name>"]
+    job += [f"<slots>{slots}</slots>", hard_request_xml(rnd),
+            f"<hard_req_queue>{queue}</hard_req_queue>"]
+    job.append(f"<binding>{rnd.choice(['set linear:1', 'set linear:4', 'set striding:2:1'])}</binding>")
+    if task is not None:
+        job.append(f"<tasks>{task}</tasks>")
+    job.append("</job_list>\n")
+    return "".join(job)
+
+
+def write_qstat_xml(handle, tasks, running_fraction=0.6, array_fraction=0.3, seed=1):
+    """
+    write a 'qstat -xml -ext -r -t -pri' like document of tasks job_list elements to a binary handle,
+    running tasks go to queue_info, pending ones to job_info, array jobs have tasks elements
+    """
+    rnd = random.Random(seed)
+    rows = []
+    job_number = 1000000
+    while len(rows) < tasks:
+        job_number += 1
+        running = rnd.random() < running_fraction
+        if rnd.random() < array_fraction:
+            for task in range(1, min(rnd.randrange(2, 200), tasks - len(rows)) + 1):
+                rows.append((job_number, task, running))
+        else:
+            rows.append((job_number, None, running))
+
+    handle.write(b"<?xml version='1.0'?>\n<job_info xmlns:xsd=\"http://arc.liv.ac.uk/repos/darcs/sge/source/dist/util/resources/schemas/qstat/qstat.xsd\">\n")
+    for section, running in [("queue_info", True), ("job_info", False)]:
+        handle.write(f"<{section}>\n".encode())
+        for job_number, task, job_running in rows:
+            if job_running == running:
+                handle.write(job_list_xml(rnd, job_number, task, running).encode())
+        handle.write(f"</{section}>\n".encode())
+    handle.write(b"</job_info>\n")
+
+
+def write_qhost_xml(handle, hosts, seed=1):
+    """
+    write a 'qhost -xml -q -F' like document of hosts hosts to a binary handle,
+    a few hosts are down ('-' values, au state), some have a second queue
+    """
+    rnd = random.Random(seed)
+    handle.write(b"<?xml version='1.0'?>\n<qhost>\n <host name='global'>\n"
+                 b"  <hostvalue name='arch_string'>-</hostvalue>\n  <hostvalue name='num_proc'>-</hostvalue>\n </host>\n")
+    for i in range(hosts):
+        down = rnd.random() < 0.02
+        cores = rnd.choice([24, 48, 96])
+        total = rnd.choice([125.8, 251.6, 503.5, 1007.8])
+
+        def value(x):
+            return '-' if down else x
+
+        host = [f" <host name='node{i:05d}'>",
+                "<hostvalue name='arch_string'>lx-amd64</hostvalue>",
+                f"<hostvalue name='num_proc'>{value(cores)}</hostvalue>",
+                f"<hostvalue name='m_socket'>{value(2)}</hostvalue>",
+                f"<hostvalue name='m_core'>{value(cores // 2)}</hostvalue>",
+                f"<hostvalue name='m_thread'>{value(cores)}</hostvalue>",
+                f"<hostvalue name='load_avg'>{value(f'{rnd.uniform(0, cores):.2f}')}</hostvalue>",
+                f"<hostvalue name='mem_total'>{value(f'{total}G')}</hostvalue>",
+                f"<hostvalue name='mem_used'>{value(f'{rnd.uniform(0, total):.1f}G')}</hostvalue>",
+                f"<hostvalue name='swap_total'>{value('4.0G')}</hostvalue>",
+                f"<hostvalue name='swap_used'>{value(rnd.choice(['0.0', '512.0M', '2.0G']))}</hostvalue>",
+                f"<resourcevalue name='virtual_free' dominance='hc'>{rnd.uniform(0, total):.3f}G</resourcevalue>",
+                f"<resourcevalue name='num_proc' dominance='hc'>{rnd.randrange(cores + 1)}</resourcevalue>"]
+        for queue in QUEUES[:1 + (i % 3 == 0)]:
+            host.append(f"<queue name='{queue}'>"
+                        f"<queuevalue qname='{queue}' name='qtype_string'>BIP</queuevalue>"
+                        f"<queuevalue qname='{queue}' name='slots_used'>{rnd.randrange(cores + 1)}</queuevalue>"
+                        f"<queuevalue qname='{queue}' name='slots'>{cores}</queuevalue>"
+                        f"<queuevalue qname='{queue}' name='slots_resv'>0</queuevalue>"
+                        f"<queuevalue qname='{queue}' name='state_string'>{'au' if down else ''}</queuevalue>"
+                        "</queue>")
+        host.append(" </host>\n")
+        handle.write("".join(host).encode())
+    handle.write(b"</qhost>\n")
+
+
+def write_job_file(handle, lines, seed=1):
+    """
+    write an asub job file of lines commands to a text handle
+    """
+    rnd = random.Random(seed)
+    for i in range(lines):
+        sample = f"sample{i:07d}"
+        handle.write(rnd.choice([
+            f"bwa mem -t 8 ref.fa {sample}.1.fq.gz {sample}.2.fq.gz | samtools sort -o {sample}.bam -\n",
+            f"fastp -i {sample}.1.fq.gz -I {sample}.2.fq.gz -o {sample}.clean.1.fq.gz -O {sample}.clean.2.fq.gz -w 4\n",
+            f"metaphlan {sample}.fq.gz --input_type fastq --nproc 4 -o {sample}.profile.txt\n",
+        ]))
+
+
+def peak_rss(func):
+    """
+    peak resident bytes one call of func adds, from ru_maxrss of RUSAGE_CHILDREN (KB on linux),
+    so memory of C libraries as libxml2 counts too: a measuring process forks an idle child
+    for the baseline, then a child calling func, and reports the growth of the children peak
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        gc.collect()
+        rss = []
+        for run in [None, func]:
+            child = os.fork()
+            if child == 0:
+                try:
+                    if run is not None:
+                        run()
+                except BaseException:
+                    os._exit(1)
+                os._exit(0)
+            _, status = os.waitpid(child, 0)
+            if status != 0:
+                os._exit(1)
+            rss.append(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        os.write(write_fd, f"{rss[1] - rss[0]}".encode())
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as h:
+        output = h.read()
+    os.waitpid(pid, 0)
+    if not output:
+        raise RuntimeError("the stage failed in the measuring process")
+    return max(0, int(output)) << 10
+
+
+def measure(func, repeat=3):
+    """
+    (best wall seconds of repeat calls, peak resident bytes of one more call in a child process)
+    """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, peak_rss(func)
+
+
+def stage_cases(workdir, tasks, hosts, lines, seed=1):
+    """
+    {stage: callable}, the synthetic inputs are written to workdir once,
+    stages which need a parsed frame get it outside of the timed call
+    """
+    import pandas as pd
+    import sgetk.archive
+    import sgetk.asub
+    import sgetk.sge_summary
+    import sgetk.slurm
+    from sgetk.qhost import xml2host_frame
+    from sgetk.qstat import extract_mem_core, running_job_info, user_running_job_info, xml2data_frame
+
+    qstat_f = os.path.join(workdir, "qstat.xml")
+    qhost_f = os.path.join(workdir, "qhost.xml")
+    job_f = os.path.join(workdir, "jobs.txt")
+    with open(qstat_f, 'wb') as h:
+        write_qstat_xml(h, tasks, seed=seed)
+    with open(qhost_f, 'wb') as h:
+        write_qhost_xml(h, hosts, seed=seed)
+    with open(job_f, 'w') as h:
+        write_job_file(h, lines, seed=seed)
+    with open(qstat_f, 'rb') as h:
+        qstat_xml = h.read()
+    with open(qhost_f, 'rb') as h:
+        qhost_xml = h.read()
+
+    df = xml2data_frame(qstat_xml)
+    running = df[df['@state'] == 'running']
+    host_df, queue_df = xml2host_frame(qhost_xml)
+    # an archive of ARCHIVE_SNAPSHOTS one minute snapshots in one compacted hour
+    archive = sgetk.archive.SnapshotArchive(os.path.join(workdir, "archive"))
+    hour = 1790000000 // 3600 * 3600
+    for i in range(ARCHIVE_SNAPSHOTS):
+        archive.record(df, host_df, queue_df, when=hour + i * 60)
+    archive.compact(before=hour + 3600)
+    memory = [i + 'B' if i[-1].isdigit() else i for i in pd.Series(MEMORY_REQUESTS).sample(
+        max(tasks, 1), replace=True, random_state=seed)]
+
+    def human2bytes():
+        sgetk.sge_summary.human2bytes.cache_clear()
+        for i in memory:
+            sgetk.sge_summary.human2bytes(i)
+
+    def parse_job(bundle):
+        def run():
+            with tempfile.TemporaryDirectory(dir=workdir) as logdir:
+                if bundle:
+                    sgetk.asub.parse_job_bundle("bench", [job_f], 1, logdir)
+                else:
+                    sgetk.asub.parse_job("sge", "bench", [job_f], 1, logdir)
+        return run
+
+    return {
+        "xml2data_frame": lambda: xml2data_frame(qstat_xml),
+        "extract_mem_core": lambda: [extract_mem_core(i) for i in df['hard_request']],
+        # a key Series keeps JB_owner in the groups, as user_running_job_info reads it
+        "user_running_job_info": lambda: running.groupby(running['JB_owner'].copy()).apply(user_running_job_info),
+        "running_job_info": lambda: running_job_info(running),
+        # empty squeue and sacct output, the idle case of a slurm cluster
+        "running_job_info.empty_squeue": lambda: running_job_info(sgetk.slurm.squeue_records(pd.DataFrame())),
+        "running_job_info.empty_sacct": lambda: running_job_info(sgetk.slurm.sacct_records(pd.DataFrame())),
+        "human2bytes": human2bytes,
+        "human2bytes_array": lambda: sgetk.sge_summary.human2bytes_array(memory),
+        "xml2host_frame": lambda: xml2host_frame(qhost_xml),
+        "asub.parse_job": parse_job(False),
+        "asub.parse_job_bundle": parse_job(True),
+        "archive.record": lambda: sgetk.archive.SnapshotArchive(tempfile.mkdtemp(dir=workdir)).record(df, host_df, queue_df),
+        "archive.query": lambda: archive.query('jobs', columns=['time', 'owner', 'state', 'slots'],
+                                               where={'job_state': 'running'}),
+    }
+
+
+def bench_stages(stages=None, tasks=10000, hosts=1000, lines=10000, repeat=3, seed=1,
+                 baseline=None, tolerance=0.2):
+    """
+    wall time and peak memory of every stage on synthetic inputs,
+    a stage fails when it is tolerance slower or bigger than in the baseline (dict of a saved result)
+    return (result, failed stages)
+    """
+    result = {}
+    failed = []
+    with tempfile.TemporaryDirectory() as workdir:
+        cases = stage_cases(workdir, tasks, hosts, lines, seed)
+        for stage in (stages or cases):
+            seconds, peak = measure(cases[stage], repeat)
+            result[stage] = {"seconds": seconds, "peak_bytes": peak,
+                             "tasks": tasks, "hosts": hosts, "lines": lines}
+            status = "ok"
+            old = (baseline or {}).get(stage)
+            if old is not None:
+                if (old["tasks"], old["hosts"], old["lines"]) != (tasks, hosts, lines):
+                    status = "baseline scale differs"
+                else:
+                    ratio = seconds / old["seconds"]
+                    status = f"{ratio:.2f}x time, {peak / max(old['peak_bytes'], 1):.2f}x memory"
+                    if seconds > old["seconds"] * (1 + tolerance) or peak > old["peak_bytes"] * (1 + tolerance):
+                        failed.append(stage)
+                        status += ", regression"
+            print(f"{seconds * 1000:12.2f} ms\t{peak / (1 << 20):10.1f} MiB\t{stage}\t{status}", flush=True)
+    return result, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sgetk benchmark')
+    parser.add_argument('-suite', choices=['import', 'stages', 'all'], default='import', help='import time cases, stages on synthetic qstat/qhost xml and job files, or both, default: import')
+    parser.add_argument('-repeat', type=int, default=5, help='repeat times, best one is reported, default: 5')
+    parser.add_argument('-max-seconds', dest='max_seconds', type=float, default=None, help='fail when an import case is slower than it, default: None')
+    parser.add_argument('-stages', nargs='*', default=None, help='stages to run, default: all')
+    parser.add_argument('-tasks', type=int, default=10000, help='job_list elements of the synthetic qstat xml, default: 10000')
+    parser.add_argument('-hosts', type=int, default=1000, help='hosts of the synthetic qhost xml, default: 1000')
+    parser.add_argument('-lines', type=int, default=10000, help='lines of the synthetic asub job file, default: 10000')
+    parser.add_argument('-seed', type=int, default=1, help='random seed of the synthetic inputs, default: 1')
+    parser.add_argument('-baseline', type=str, default=None, help='compare stages with a json result saved by -save')
+    parser.add_argument('-tolerance', type=float, default=0.2, help='allowed slowdown or memory growth against the baseline, default: 0.2')
+    parser.add_argument('-save', type=str, default=None, help='save the stage result as json')
+    parser.add_argument('-write', choices=['qstat', 'qhost', 'jobs'], default=None, help='only write a synthetic input to stdout, scaled by -tasks, -hosts or -lines')
+    args = parser.parse_args()
+
+    if args.write == 'qstat':
+        write_qstat_xml(sys.stdout.buffer, args.tasks, seed=args.seed)
+        return
+    if args.write == 'qhost':
+        write_qhost_xml(sys.stdout.buffer, args.hosts, seed=args.seed)
+        return
+    if args.write == 'jobs':
+        write_job_file(sys.stdout, args.lines, seed=args.seed)
+        return
+
+    failed = 0
+    if args.suite in ['import', 'all']:
+        failed += bench_import(args.repeat, args.max_seconds)
+    if args.suite in ['stages', 'all']:
+        baseline = None
+        if args.baseline is not None:
+            with open(args.baseline) as h:
+                baseline = json.load(h)
+        result, failed_stages = bench_stages(args.stages, args.tasks, args.hosts, args.lines,
+                                             args.repeat, args.seed, baseline, args.tolerance)
+        failed += len(failed_stages)
+        if args.save is not None:
+            with open(args.save, 'w') as h:
+                json.dump(result, h, indent=2)
+    sys.exit(1 if failed > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
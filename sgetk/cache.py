@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+
+
+def default_cache_dir():
+    return os.path.join(tempfile.gettempdir(), f"sgetk-cache-{os.getuid()}")
+
+
+class SnapshotCache:
+    """
+    TTL cache of scheduler command output, shared by processes on one host
+
+    every command (normalized by whitespace) has a file in cache_dir,
+    a stale file is refetched under an exclusive flock, so concurrent
+    processes wait for one fetch instead of all calling the scheduler,
+    the file is replaced atomically, so readers never see a partial snapshot
+
+    cache = SnapshotCache(ttl=60)
+    xml_str = qstat2xml("qstat -u '*'", cache=cache)
+    """
+    def __init__(self, ttl=60, cache_dir=None, memo=True):
+        self.ttl = ttl
+        self.cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+        self.memo = {} if memo else None
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def normalize(cmd):
+        return " ".join(cmd.split())
+
+    def path(self, cmd):
+        key = hashlib.sha1(self.normalize(cmd).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.snapshot")
+
+    def _fresh(self, mtime):
+        return time.time() - mtime < self.ttl
+
+    def _read_disk(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        if not self._fresh(mtime):
+            return None
+        with open(path, 'rb') as h:
+            return mtime, h.read()
+
+    def _write_disk(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as h:
+                h.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, cmd):
+        """
+        the cached output of cmd, None if missing or expired
+        """
+        key = self.normalize(cmd)
+        if self.memo is not None and key in self.memo:
+            mtime, data = self.memo[key]
+            if self._fresh(mtime):
+                return data
+            del self.memo[key]
+        cached = self._read_disk(self.path(cmd))
+        if cached is None:
+            return None
+        if self.memo is not None:
+            self.memo[key] = cached
+        return cached[1]
+
+    def fetch(self, cmd, fetch_func):
+        """
+        return the cached output of cmd, or call fetch_func(cmd) and cache its output
+        """
+        data = self.get(cmd)
+        if data is not None:
+            return data
+
+        path = self.path(cmd)
+        with open(path + ".lock", 'a') as lock_h:
+            fcntl.flock(lock_h, fcntl.LOCK_EX)
+            try:
+                # another process may have fetched it while we were waiting
+                cached = self._read_disk(path)
+                if cached is None:
+                    data = fetch_func(cmd)
+                    self._write_disk(path, data)
+                    cached = (os.stat(path).st_mtime, data)
+            finally:
+                fcntl.flock(lock_h, fcntl.LOCK_UN)
+
+        if self.memo is not None:
+            self.memo[self.normalize(cmd)] = cached
+        return cached[1]
+
+    def invalidate(self, cmd=None):
+        """
+        drop the snapshot of cmd, or of all commands when cmd is None
+        """
+        if cmd is None:
+            if self.memo is not None:
+                self.memo.clear()
+            paths = [os.path.join(self.cache_dir, i) for i in os.listdir(self.cache_dir)
+                     if i.endswith(".snapshot")]
+        else:
+            if self.memo is not None:
+                self.memo.pop(self.normalize(cmd), None)
+            paths = [self.path(cmd)]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
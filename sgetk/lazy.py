@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    a module placeholder, the real module is imported at the first attribute access,
+    so heavy modules (pandas, numpy, lxml) only cost import time when they are used
+
+    pd = lazy_import("pandas")
+    pd.DataFrame()  # pandas is imported here
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+class ExportPackage(types.ModuleType):
+    """
+    a package whose exports may have the name of their submodule (sgetk.qstat is the qstat function),
+    the import system binds a submodule to the package when it is imported, the export is bound instead,
+    so the package names do not depend on import order, bind such submodules with importlib.import_module
+    """
+    def __setattr__(self, name, value):
+        exports = self.__dict__.get('_exports', {})
+        if isinstance(value, types.ModuleType) and exports.get(name) == f"{self.__name__}.{name}":
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+def lazy_getattr(module_globals, exports):
+    """
+    build a module level __getattr__ (PEP 562) which imports exports[name] on demand,
+    exports: {attribute name: module name}
+    """
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError(f"module {module_globals['__name__']!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(exports[name]), name)
+        module_globals[name] = value
+        return value
+
+    return __getattr__
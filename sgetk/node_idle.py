@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+from io import BytesIO
+
+import sgetk.sched
+import sgetk.sge_summary
+from sgetk.lazy import lazy_import
+
+pd = lazy_import("pandas")
+etree = lazy_import("lxml.etree")
+
+QUEUE_VALUES = ['name', 'qtype', 'slots_used', 'slots_resv', 'slots_total', 'load_avg', 'arch', 'state']
+RESOURCES = ['num_proc', 'virtual_free']
+
+
+def queue_list():
+    """
+    all cluster queues, 'qconf -sql'
+    """
+    return sgetk.sched.run_command("qconf -sql").decode().split()
+
+
+def qstat_free_cmd(queue, resources=RESOURCES):
+    return ["qstat", "-F", ",".join(resources), "-q", queue, "-xml"]
+
+
+def xml2queue_frame(xml_str, resources=RESOURCES):
+    """
+    parse 'qstat -F ... -xml' output, one Queue-List element (queue instance) per row:
+    queue, host, name, qtype, slots_used, slots_resv, slots_total, load_avg, arch, state
+    and one column per resource
+    """
+    cols = {i: [] for i in QUEUE_VALUES + list(resources)}
+    for _, elem in etree.iterparse(BytesIO(xml_str), events=('end',), tag='Queue-List'):
+        values = {}
+        for child in elem:
+            if child.tag == 'resource':
+                values[child.get('name')] = child.text
+            else:
+                values[child.tag] = child.text
+        for col in cols:
+            cols[col].append(values.get(col))
+        elem.clear(keep_tail=True)
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    df = pd.DataFrame(cols)
+    names = df['name'].fillna('').str.split('@', n=1)
+    df.insert(0, 'queue', names.str[0])
+    df.insert(1, 'host', names.str[-1])
+    df['state'] = df['state'].fillna('')
+    for col in ['slots_used', 'slots_resv', 'slots_total', 'load_avg']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def node_idle(queues=None, resources=RESOURCES, threads=4, all_nodes=False):
+    """
+    free resources of every queue instance of queues (default: all queues),
+    queues are queried concurrently with at most threads qstat calls at a time,
+    the merged frame is sorted by free slots (slots_total - slots_used - slots_resv of the queue instance)
+    and virtual_free,
+    queue instances with a state (d, u, E, a ...) are dropped unless all_nodes
+    """
+    if queues is None:
+        queues = queue_list()
+    xml_list = sgetk.sched.run_commands([qstat_free_cmd(q, resources) for q in queues], concurrency=threads)
+
+    df = pd.concat([xml2queue_frame(i, resources) for i in xml_list], ignore_index=True)
+    if not all_nodes:
+        df = df[df['state'] == ''].reset_index(drop=True)
+    if 'num_proc' in df.columns:
+        df['num_proc'] = pd.to_numeric(df['num_proc'], errors='coerce')
+    if 'virtual_free' in df.columns:
+        df['virtual_free_bytes'] = sgetk.sge_summary.memory2bytes(df['virtual_free'])
+    # num_proc of qstat -F is the processors of the host, busy or not
+    df['free_slots'] = df['slots_total'] - df['slots_used'] - df['slots_resv'].fillna(0)
+    sort_cols = [i for i in ['free_slots', 'virtual_free_bytes'] if i in df.columns]
+    df = df.sort_values(sort_cols, ascending=False, kind='stable').reset_index(drop=True)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='free slots and virtual_free of queue instances')
+    parser.add_argument('-queue', nargs='*', default=None, help='queues to query, default: all queues (qconf -sql)')
+    parser.add_argument('-resource', nargs='*', default=RESOURCES, help='resources to show, default: num_proc virtual_free')
+    parser.add_argument('-threads', type=int, default=4, help='max concurrent qstat calls, default: 4')
+    parser.add_argument('-all', dest='all_nodes', action='store_true', help='also show queue instances with a state (disabled, unknown, error ...)')
+    args = parser.parse_args(argv)
+
+    df = node_idle(args.queue, args.resource, args.threads, args.all_nodes)
+    df.to_csv(sys.stdout, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,11 @@
 #!/usr/bin/env python
 
-import re
-import subprocess
+import os
+import sys
 
-cmd = "qstat -F vf,p -q st_supermem.q"
-output = re.split(r'---+', subprocess.getoutput(cmd))
+# run as a script, the sgetk package is the directory of this file
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-print("\t".join(re.split(r'\s+', output[0]) + ["num_proc", "virtual_free"]))
+from sgetk.node_idle import main
 
-for line in output[1:]:
-    line_list = line.strip().split("\n")
-    first_line = re.split('\s+', line_list[0].strip())
-    if len(first_line) == 6:
-        num_proc = line_list[1].split("=")[-1]
-        virtual_free = line_list[2].split("=")[-1]
-        print("\t".join(first_line + [num_proc, virtual_free]))
+main(["-queue", "st_supermem.q"])
@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+# default locations of sgetk state, stdlib only: the asub script imports it too
+
+import os
+
+# the accounting store of sgetk.acct, also the -rightsize history of asub
+STORE_ENV = "SGETK_ACCOUNTING_DB"
+
+
+def default_store_path():
+    """
+    $SGETK_ACCOUNTING_DB, default: ~/.sgetk/accounting.db
+    """
+    return os.environ.get(STORE_ENV) or os.path.join(os.path.expanduser("~"), ".sgetk", "accounting.db")
@@ -1,238 +1,140 @@
 #!/usr/bin/env python
 
-from typing import OrderedDict
-import pandas as pd
-import numpy as np
 import subprocess as subp
-from io import StringIO
-import xmltodict
-import sgetk
-from pprint import pprint
-import xml.dom.minidom
-import lxml.etree as etree
-
-
-def combine_string(str_old, str_list=[
-        '-xml', '-ext', '-r', '-t', '-pri']):
-    str_new = str_old
-    for i in str_list:
-        if i not in str_new:
-            str_new += f" {i}"
-
-    return str_new
-
-
-def qstat2xml(qstat_cmd, str_list=[
-        '-xml', '-ext', '-r', '-t', '-pri']):
+from io import BytesIO
+import sgetk.sched
+import sgetk.sge_summary
+from sgetk.qstat import combine_string
+from sgetk.lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+etree = lazy_import("lxml.etree")
+
+# hostvalue name: column name
+HOST_VALUES = {
+    'arch_string': 'arch',
+    'num_proc': 'num_proc',
+    'm_socket': 'sockets',
+    'm_core': 'cores',
+    'm_thread': 'threads',
+    'load_avg': 'load_avg',
+    'mem_total': 'mem_total',
+    'mem_used': 'mem_used',
+    'swap_total': 'swap_total',
+    'swap_used': 'swap_used',
+}
+MEMORY_COLUMNS = ['mem_total', 'mem_used', 'swap_total', 'swap_used']
+NUMBER_COLUMNS = ['num_proc', 'sockets', 'cores', 'threads', 'load_avg']
+QUEUE_VALUES = {
+    'qtype_string': 'qtype',
+    'slots': 'slots',
+    'slots_used': 'slots_used',
+    'slots_resv': 'slots_resv',
+    'state_string': 'state',
+}
+
+
+def qhost2xml(qhost_cmd='qhost', str_list=['-xml', '-q', '-F']):
     """
     Returns
     -------
-    qstatxml : string
-        The xml stdout string of the 'qstat -xml' call
+    qhostxml : string
+        The xml stdout string of the 'qhost -xml' call
 
     -xml: display the information in XML format
-    -ext: view additional attributes
-      -r: show requested resources of job(s)
-      -t: show task information (implicitly -g t)
-      -pri: display job priority information
-
-    ["-xml", "-ext", "-r", "-t", "-pri"]
+      -q: show queue instances hosted by each host
+      -F: show resource values of each host
     """
-    qstat_cmd_new = combine_string(qstat_cmd, str_list)
+    qhost_cmd_new = combine_string(qhost_cmd, str_list)
     try:
-        qstatxml = subp.check_output(qstat_cmd_new,
-                                     shell=True, stderr=(subp.STDOUT))
+        qhostxml = sgetk.sched.run_command(qhost_cmd_new)
     except subp.CalledProcessError as e:
-        try:
-            print('qstat returncode: ', e.returncode)
-            print('qstat std output: ', e.output)
-            raise
-        finally:
-            e = None
-            del e
+        print('qhost returncode: ', e.returncode)
+        print('qhost std output: ', e.output)
+        print('qhost std error: ', e.stderr)
+        raise
 
-    return qstatxml
+    return qhostxml
 
 
-def xml2data_frame(xml_str, query_key='job_list'):
+def xml2host_frame(xml_str, resources=['virtual_free']):
     """
-    xml_str is string, xmltodict.parse can parse: string, a file-like object, or a generator of strings
-    when search job info, use "job_list"
-    when search query info, use "Queue-List"
+    parse 'qhost -xml -q -F' output one host element at a time
+
+    Returns
+    -------
+    host_df: one row per host
+        host, arch, num_proc, sockets, cores, threads, load_avg,
+        mem_total, mem_used, swap_total, swap_used (bytes),
+        slots, slots_used, slots_resv (sum of all queue instances on the host),
+        and one column per resource in resources (-F values, memory in bytes)
+    queue_df: one row per queue instance
+        host, queue, qtype, slots, slots_used, slots_resv, state
     """
-    x = xmltodict.parse(xml_str)
+    if isinstance(xml_str, str):
+        xml_str = xml_str.encode()
+    if isinstance(xml_str, bytes):
+        xml_str = BytesIO(xml_str)
+
+    host_cols = {i: [] for i in ['host'] + list(HOST_VALUES.values()) + list(resources)}
+    queue_cols = {i: [] for i in ['host', 'queue'] + list(QUEUE_VALUES.values())}
+
+    for _, elem in etree.iterparse(xml_str, events=('end',), tag='host'):
+        host = elem.get('name')
+        if host != 'global':
+            values = {}
+            for child in elem:
+                name = child.get('name')
+                if child.tag == 'hostvalue' and name in HOST_VALUES:
+                    values[HOST_VALUES[name]] = child.text
+                elif child.tag == 'resourcevalue' and name in resources:
+                    values[name] = child.text
+                elif child.tag == 'queue':
+                    queue_cols['host'].append(host)
+                    queue_cols['queue'].append(child.get('name'))
+                    queue_values = {QUEUE_VALUES[i.get('name')]: i.text for i in child
+                                    if i.get('name') in QUEUE_VALUES}
+                    for col in QUEUE_VALUES.values():
+                        queue_cols[col].append(queue_values.get(col))
+            host_cols['host'].append(host)
+            for col in host_cols:
+                if col != 'host':
+                    host_cols[col].append(values.get(col))
+        elem.clear(keep_tail=True)
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    queue_df = pd.DataFrame(queue_cols)
+    for col in ['slots', 'slots_used', 'slots_resv']:
+        queue_df[col] = pd.to_numeric(queue_df[col], errors='coerce')
+    queue_df['state'] = queue_df['state'].fillna('')
+    for col in ['host', 'queue', 'qtype']:
+        queue_df[col] = queue_df[col].astype('category')
+
+    host_df = pd.DataFrame(host_cols)
+    for col in MEMORY_COLUMNS:
+        host_df[col] = sgetk.sge_summary.memory2bytes(host_df[col])
+    for col in NUMBER_COLUMNS:
+        host_df[col] = pd.to_numeric(host_df[col].replace('-', np.nan), errors='coerce')
+    for col in resources:
+        numbers = pd.to_numeric(host_df[col], errors='coerce')
+        if numbers.notna().sum() == host_df[col].notna().sum():
+            host_df[col] = numbers
+        else:
+            host_df[col] = sgetk.sge_summary.memory2bytes(host_df[col])
+    host_df['arch'] = host_df['arch'].astype('category')
 
-    queue_info = x['job_info']['queue_info']
-    job_info = x['job_info']['job_info']
+    slots = queue_df.groupby('host', observed=True)[['slots', 'slots_used', 'slots_resv']].sum()
+    host_df = host_df.join(slots, on='host')
+    return host_df, queue_df
 
-    queue_df = pd.DataFrame()
-    job_df = pd.DataFrame()
 
-    if queue_info is not None:
-        if query_key in queue_info:
-            if isinstance(queue_info[query_key], list):
-                queue_df = pd.DataFrame(queue_info[query_key])
-            else:
-                queue_df = pd.DataFrame([queue_info[query_key]])
-        else:
-            print(f"{query_key} is not in xml output, please check")
-    if job_info is not None:
-        if query_key in job_info:
-            if isinstance(job_info[query_key], list):
-                job_df = pd.DataFrame(job_info[query_key])
-            else:
-                job_df = pd.DataFrame([job_info[query_key]])
-        else:
-            print(f"{query_key} is not in xml output, please check")
-
-    type_dict = {
-        '@state': str,
-        'cpu_usage': float,
-        'mem_usage': float,
-        'io_usage': float,
-        'slots': float,
-        'JAT_prio': float,
-        'hard_req_queue': str,
-        'JB_owner': str,
-        'JB_department': str,
-        'JB_project': str
-    }
-    type_dict_ = {}
-    all_df = pd.concat([queue_df, job_df])
-    for i in type_dict:
-        if i in all_df.columns:
-            type_dict_[i] = type_dict[i]
-    all_df = all_df.astype(type_dict_)
-    return all_df
-
-
-def qhost(q):
-    xml_str = qstat2xml(qstat_cmd, str_list)
-    return xml2data_frame(xml_str, query_key)
-
-
-def extract_mem_core(x):
+def qhost(qhost_cmd='qhost', str_list=['-xml', '-q', '-F'], resources=['virtual_free']):
     """
-    Args:
-      x:
-        [OrderedDict([('@name', 'num_proc'),
-                      ('@resource_contribution', '800.000000'),
-                      ('#text', '8')])
-
-         OrderedDict([('@name', 'virtual_free'),
-                      ('@resource_contribution', '0.000000'),
-                      ('#text', '5g')])]
-
-        [OrderedDict([('@name', 'high_priority'),
-                      ('@resource_contribution', '100000.000000'),
-                      ('#text', 'TRUE')]),
-         OrderedDict([('@name', 'num_proc'),
-                      ('@resource_contribution', '400.000000'),
-                      ('#text', '4')]),
-         OrderedDict([('@name', 'virtual_free'),
-                      ('@resource_contribution', '0.000000'),
-                      ('#text', '10.5g')])]
+    Returns
+    -------
+    (host_df, queue_df), see xml2host_frame
     """
-    core = 0
-    mem = 0
-    if isinstance(x, list):
-        for i in x:
-            if isinstance(i, OrderedDict):
-                if i['@name'] == 'num_proc':
-                    core = int(i['#text'])
-                elif i['@name'] == 'virtual_free':
-                    mem_str = str(i['#text'])
-                    if mem_str[(-1)].isdigit():
-                        mem_str += 'B'
-                    mem = sgetk.sge_summary.human2bytes(mem_str)
-            else:
-                print('detect non ordered dict')
-                pprint(i)
-
-    elif isinstance(x, OrderedDict):
-        if x['@name'] == 'num_proc':
-            core = int(x['#text'])
-        elif x['@name'] == 'virtual_free':
-            mem_str = str(x['#text'])
-            if mem_str[(-1)].isdigit():
-                mem_str += 'B'
-            mem = sgetk.sge_summary.human2bytes(mem_str)
-    return (
-        mem, core)
-
-
-def extract_mem_core_v2(x):
-    core = 0
-    mem = ''
-    for i in x:
-        if i['@name'] == 'num_proc':
-            core = int(i['#text'])
-        if i['@name'] == 'virtual_free':
-            mem = str(i['#text'])
-
-    return (
-        mem, core)
-
-
-def user_running_job_info(x):
-    job_count = 0.0
-    for i in x['slots']:
-        job_count += float(i)
-
-    job_host = []
-    for i in x['queue_name']:
-        job_host.append(i)
-
-    cpu_usage = sum(x['cpu_usage'])
-    cpu_usage_average = cpu_usage / job_count
-    mem_usage = sum(x['mem_usage'])
-    mem_usage_average = mem_usage / job_count
-    io_usage = sum(x['io_usage'])
-    io_usage_average = io_usage / job_count
-    JAT_prio_average = sum(x['JAT_prio']) / job_count
-    mem_request = 0.0
-    core_request = 0.0
-    for i in x['hard_request']:
-        mem, core = extract_mem_core(i)
-        core_request += core
-        mem_request += mem
-
-    mem_request_average = mem_request / job_count
-    core_request_average = core_request / job_count
-    core_binding = 0.0
-    for i in x['binding']:
-        if i is not None:
-            try:
-                str_int = float(i.split(':')[(-1)])
-            except:
-                print(f'''error core binnind: {x["JB_owner"]} {x["JB_job_number"]} {i}''')
-                core_binding += 1
-        else:
-            core_binding += 1
-
-    core_binding_average = core_binding / job_count
-    return pd.Series({'job_count': job_count,  'job_host': job_host,
-                      'JAT_prio_average': JAT_prio_average,
-                      'cpu_usage_total(hour)': cpu_usage / 3600,
-                      'cpu_usage_per_job(hour)': cpu_usage_average / 36000,
-                      'cpu_usage_average_per_job_per_core(hour)': cpu_usage_average / core_request_average / 3600,
-                      'mem_usage_total': sgetk.sge_summary.bytes2human(mem_usage) if not pd.isna(mem_usage) else 0,
-                      'mem_usage_average': sgetk.sge_summary.bytes2human(mem_usage_average) if not pd.isna(mem_usage_average) else 0,
-                      'mem_request_total': sgetk.sge_summary.bytes2human(mem_request) if not pd.isna(mem_request) else 0,
-                      'mem_request_average': sgetk.sge_summary.bytes2human(mem_request_average) if not pd.isna(mem_request_average) else 0,
-                      'core_request_total': core_request,
-                      'core_request_average': core_request_average,
-                      'core_binding': core_binding,
-                      'core_binding_average': core_binding_average,
-                      'io_usage_total': io_usage,
-                      'io_usage_average': io_usage_average})
-
-
-def pretty_xml(xml_str):
-    x = etree.fromstring(xml_str)
-    print(etree.tostring(x, pretty_print=True))
-
-
-def print_xml(xml_str):
-    print(xml.dom.minidom.parseString(xml_str).toprettyxml())
-# okay decompiling sgetk/__pycache__/qstat.cpython-37.pyc
+    xml_str = qhost2xml(qhost_cmd, str_list)
+    return xml2host_frame(xml_str, resources)
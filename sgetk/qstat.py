@@ -1,15 +1,17 @@
 #!/usr/bin/env python
 
-from typing import OrderedDict
-import pandas as pd
-import numpy as np
+import collections
 import subprocess as subp
-from io import StringIO
-import xmltodict
-import sgetk
+from io import BytesIO
+import sgetk.sched
+import sgetk.sge_summary
 from pprint import pprint
-import xml.dom.minidom
-import lxml.etree as etree
+from sgetk.lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+etree = lazy_import("lxml.etree")
+minidom = lazy_import("xml.dom.minidom")
 
 
 def combine_string(str_old, str_list=[
@@ -23,7 +25,7 @@ def combine_string(str_old, str_list=[
 
 
 def qstat2xml(qstat_cmd, str_list=[
-        '-xml', '-ext', '-r', '-t', '-pri']):
+        '-xml', '-ext', '-r', '-t', '-pri'], cache=None):
     """
     Returns
     -------
@@ -37,15 +39,24 @@ def qstat2xml(qstat_cmd, str_list=[
       -pri: display job priority information
 
     ["-xml", "-ext", "-r", "-t", "-pri"]
+
+    cache: a sgetk.cache.SnapshotCache, reuse a snapshot of the same command
+           fetched less than cache.ttl seconds ago, default: None (always call qstat)
     """
     qstat_cmd_new = combine_string(qstat_cmd, str_list)
+    if cache is not None:
+        return cache.fetch(qstat_cmd_new, run_qstat)
+    return run_qstat(qstat_cmd_new)
+
+
+def run_qstat(qstat_cmd, timeout=sgetk.sched.TIMEOUT):
     try:
-        qstatxml = subp.check_output(qstat_cmd_new,
-                                     shell=True, stderr=(subp.STDOUT))
+        qstatxml = sgetk.sched.run_command(qstat_cmd, timeout)
     except subp.CalledProcessError as e:
         try:
             print('qstat returncode: ', e.returncode)
             print('qstat std output: ', e.output)
+            print('qstat std error: ', e.stderr)
             raise
         finally:
             e = None
@@ -54,37 +65,121 @@ def qstat2xml(qstat_cmd, str_list=[
     return qstatxml
 
 
+def element2dict(elem):
+    """
+    convert a lxml element to the same value xmltodict.parse gives it:
+    attributes become '@name' keys, repeated children become lists,
+    text goes to '#text' (or is the value itself for a leaf element)
+    """
+    attrib = elem.attrib
+    if len(elem) == 0 and len(attrib) == 0:
+        text = elem.text
+        if text is None:
+            return None
+        text = text.strip()
+        return text if text != "" else None
+
+    value = collections.OrderedDict()
+    for k, v in attrib.items():
+        value[f"@{k}"] = v
+    text = [elem.text] if elem.text is not None else []
+    for child in elem:
+        if child.tail is not None:
+            text.append(child.tail)
+        tag = child.tag
+        if not isinstance(tag, str):
+            continue
+        child_value = element2dict(child)
+        if tag not in value:
+            value[tag] = child_value
+        elif isinstance(value[tag], list):
+            value[tag].append(child_value)
+        else:
+            value[tag] = [value[tag], child_value]
+    text = "".join(text).strip()
+    if len(value) == 0:
+        return text if text != "" else None
+    if text != "":
+        value['#text'] = text
+    return value
+
+
+class ColumnBuffer:
+    """
+    collect rows (dict) into per-column lists, missing cells are NaN,
+    column order is the order of first appearance, same as pd.DataFrame(list_of_dict)
+    """
+    def __init__(self):
+        self.columns = collections.OrderedDict()
+        self.nrows = 0
+
+    def append(self, row):
+        for k, col in self.columns.items():
+            col.append(row.pop(k, np.nan))
+        for k, v in row.items():
+            self.columns[k] = [np.nan] * self.nrows + [v]
+        self.nrows += 1
+
+    def to_data_frame(self):
+        if self.nrows == 0:
+            return pd.DataFrame()
+        return pd.DataFrame(self.columns)
+
+
+def parse_job_info_events(events, query_key='job_list', buffers=None):
+    """
+    consume (event, element) pairs of a qstat xml document ('end' events),
+    every query_key element under queue_info/job_info is converted and then cleared,
+    so memory only grows with the column buffers
+
+    buffers: {'queue_info': ColumnBuffer, 'job_info': ColumnBuffer} to append to,
+             so events of one document can be consumed in several calls
+    """
+    if buffers is None:
+        buffers = {'queue_info': ColumnBuffer(), 'job_info': ColumnBuffer()}
+    for event, elem in events:
+        parent = elem.getparent()
+        if parent is None:
+            continue
+        if (elem.tag in buffers) and (parent.getparent() is None):
+            if buffers[elem.tag].nrows == 0 and len(elem) > 0:
+                print(f"{query_key} is not in xml output, please check")
+            elem.clear(keep_tail=True)
+            continue
+        if (elem.tag == query_key) and (parent.tag in buffers):
+            grandparent = parent.getparent()
+            if (grandparent is None) or (grandparent.getparent() is not None):
+                continue
+            row = element2dict(elem)
+            if not isinstance(row, dict):
+                row = collections.OrderedDict()
+            buffers[parent.tag].append(row)
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del parent[0]
+    return buffers['queue_info'], buffers['job_info']
+
+
 def xml2data_frame(xml_str, query_key='job_list'):
     """
-    xml_str is string, xmltodict.parse can parse: string, a file-like object, or a generator of strings
+    xml_str is bytes, string or a file-like object of 'qstat -xml' output,
+    it is parsed by lxml.etree.iterparse, one query_key element at a time
     when search job info, use "job_list"
     when search query info, use "Queue-List"
     """
-    x = xmltodict.parse(xml_str)
+    if isinstance(xml_str, str):
+        xml_str = xml_str.encode()
+    if isinstance(xml_str, bytes):
+        xml_str = BytesIO(xml_str)
 
-    queue_info = x['job_info']['queue_info']
-    job_info = x['job_info']['job_info']
+    events = etree.iterparse(xml_str, events=('end',),
+                             tag=(query_key, 'queue_info', 'job_info'))
+    queue_buffer, job_buffer = parse_job_info_events(events, query_key)
 
-    queue_df = pd.DataFrame()
-    job_df = pd.DataFrame()
+    return typed_data_frame(queue_buffer.to_data_frame(), job_buffer.to_data_frame())
 
-    if queue_info is not None:
-        if query_key in queue_info:
-            if isinstance(queue_info[query_key], list):
-                queue_df = pd.DataFrame(queue_info[query_key])
-            else:
-                queue_df = pd.DataFrame([queue_info[query_key]])
-        else:
-            print(f"{query_key} is not in xml output, please check")
-    if job_info is not None:
-        if query_key in job_info:
-            if isinstance(job_info[query_key], list):
-                job_df = pd.DataFrame(job_info[query_key])
-            else:
-                job_df = pd.DataFrame([job_info[query_key]])
-        else:
-            print(f"{query_key} is not in xml output, please check")
 
+def typed_data_frame(queue_df, job_df):
     type_dict = {
         '@state': str,
         'cpu_usage': float,
@@ -106,11 +201,35 @@ def xml2data_frame(xml_str, query_key='job_list'):
     return all_df
 
 
-def qstat(qstat_cmd, query_key='job_list', str_list=['-xml', '-ext', '-r', '-t', '-pri']):
-    xml_str = qstat2xml(qstat_cmd, str_list)
+def qstat(qstat_cmd, query_key='job_list', str_list=['-xml', '-ext', '-r', '-t', '-pri'], cache=None):
+    xml_str = qstat2xml(qstat_cmd, str_list, cache)
     return xml2data_frame(xml_str, query_key)
 
 
+async def qstat_async(qstat_cmd, query_key='job_list', str_list=['-xml', '-ext', '-r', '-t', '-pri'],
+                      client=None, timeout=None):
+    """
+    asyncio qstat: stdout of qstat is fed to the xml parser while qstat is still writing it,
+    client: a sgetk.sched.SchedulerClient (timeout, retries, concurrency), default: a new one
+    """
+    if client is None:
+        client = sgetk.sched.SchedulerClient()
+    qstat_cmd_new = combine_string(qstat_cmd, str_list)
+    tags = (query_key, 'queue_info', 'job_info')
+    state = {}
+
+    def new_parser():
+        state['buffers'] = {'queue_info': ColumnBuffer(), 'job_info': ColumnBuffer()}
+        return etree.XMLPullParser(events=('end',), tag=tags)
+
+    def consume(events):
+        parse_job_info_events(events, query_key, state['buffers'])
+
+    await client.parse(qstat_cmd_new, new_parser, consume, timeout)
+    buffers = state['buffers']
+    return typed_data_frame(buffers['queue_info'].to_data_frame(), buffers['job_info'].to_data_frame())
+
+
 def extract_mem_core(x):
     """
     Args:
@@ -137,7 +256,7 @@ def extract_mem_core(x):
     mem = 0
     if isinstance(x, list):
         for i in x:
-            if isinstance(i, OrderedDict):
+            if isinstance(i, collections.OrderedDict):
                 if i['@name'] == 'num_proc':
                     core = int(i['#text'])
                 elif i['@name'] == 'virtual_free':
@@ -149,7 +268,7 @@ def extract_mem_core(x):
                 print('detect non ordered dict')
                 pprint(i)
 
-    elif isinstance(x, OrderedDict):
+    elif isinstance(x, collections.OrderedDict):
         if x['@name'] == 'num_proc':
             core = int(x['#text'])
         elif x['@name'] == 'virtual_free':
@@ -228,11 +347,104 @@ def user_running_job_info(x):
                       'io_usage_average': io_usage_average})
 
 
+def parse_job_request(df):
+    """
+    parse 'hard_request' and 'binding' of a xml2data_frame output once,
+    return a copy of df with three numeric columns:
+      mem_request:  bytes of virtual_free, 0 if not requested (same as extract_mem_core)
+      core_request: num_proc, 0 if not requested (same as extract_mem_core)
+      core_binding: 1 if binding is missing or can't be parsed, else 0 (same as user_running_job_info)
+    """
+    df = df.copy()
+    n = len(df)
+
+    if 'hard_request' in df.columns:
+        request = pd.Series(df['hard_request'].to_numpy(), index=np.arange(n))
+        request = request.map(lambda x: [x] if isinstance(x, dict) else x).explode()
+        request = request[request.map(lambda x: isinstance(x, dict))]
+        # map, not .str: the request is empty and float typed when no row has a dict request (an idle squeue)
+        name = request.map(lambda x: x.get('@name'))
+        text = request.map(lambda x: str(x.get('#text'))).astype(str)
+
+        core = text[name == 'num_proc'].astype(int)
+        core = core.groupby(level=0).last()
+
+        mem_str = text[name == 'virtual_free']
+        mem_str = mem_str.where(~mem_str.str[-1].str.isdigit(), mem_str + 'B')
+        mem = pd.Series(sgetk.sge_summary.human2bytes_array(mem_str), index=mem_str.index)
+        mem = mem.groupby(level=0).last()
+
+        df['mem_request'] = mem.reindex(np.arange(n), fill_value=0).to_numpy()
+        df['core_request'] = core.reindex(np.arange(n), fill_value=0).to_numpy()
+    else:
+        df['mem_request'] = 0
+        df['core_request'] = 0
+
+    if 'binding' in df.columns:
+        binding = df['binding'].map(lambda x: x if isinstance(x, str) else np.nan).astype(object)
+        binding = pd.to_numeric(binding.str.split(':').str[-1], errors='coerce')
+        df['core_binding'] = binding.isna().astype(float).to_numpy()
+    else:
+        df['core_binding'] = 1.0
+
+    return df
+
+
+def running_job_info(df, by='JB_owner'):
+    """
+    vectorized user_running_job_info, compute all metrics in one groupby,
+    by can be any key accepted by DataFrame.groupby: 'JB_owner', 'JB_project',
+    'hard_req_queue', ['JB_owner', 'JB_project'], or a host Series like
+    df['queue_name'].str.split('@').str[-1]
+
+    the result is the same as df.groupby(by).apply(user_running_job_info)
+    """
+    df = parse_job_request(df).reset_index(drop=True)
+    keys = []
+    for key in (by if isinstance(by, list) else [by]):
+        if isinstance(key, pd.Series):
+            keys.append(pd.Series(key.to_numpy(), name=key.name))
+        else:
+            keys.append(df[key])
+    by = keys if len(keys) > 1 else keys[0]
+
+    usage_cols = ['cpu_usage', 'mem_usage', 'io_usage', 'JAT_prio']
+    # python sum() of a group is NaN when any value is NaN, groupby.sum() skips it
+    usage = df[usage_cols].astype(float)
+    usage_sum = usage.groupby(by).sum().mask(usage.isna().groupby(by).any())
+
+    grouped = df.groupby(by)
+    sums = grouped[['slots', 'mem_request', 'core_request', 'core_binding']].sum()
+    job_count = sums['slots'].astype(float)
+    core_request_average = sums['core_request'] / job_count
+
+    def to_human(x):
+        return x.map(lambda i: sgetk.sge_summary.bytes2human(i) if not pd.isna(i) else 0)
+
+    return pd.DataFrame({
+        'job_count': job_count,
+        'job_host': grouped['queue_name'].agg(list),
+        'JAT_prio_average': usage_sum['JAT_prio'] / job_count,
+        'cpu_usage_total(hour)': usage_sum['cpu_usage'] / 3600,
+        'cpu_usage_per_job(hour)': usage_sum['cpu_usage'] / job_count / 36000,
+        'cpu_usage_average_per_job_per_core(hour)': usage_sum['cpu_usage'] / job_count / core_request_average / 3600,
+        'mem_usage_total': to_human(usage_sum['mem_usage']),
+        'mem_usage_average': to_human(usage_sum['mem_usage'] / job_count),
+        'mem_request_total': to_human(sums['mem_request']),
+        'mem_request_average': to_human(sums['mem_request'] / job_count),
+        'core_request_total': sums['core_request'].astype(float),
+        'core_request_average': core_request_average,
+        'core_binding': sums['core_binding'],
+        'core_binding_average': sums['core_binding'] / job_count,
+        'io_usage_total': usage_sum['io_usage'],
+        'io_usage_average': usage_sum['io_usage'] / job_count})
+
+
 def pretty_xml(xml_str):
     x = etree.fromstring(xml_str)
     print(etree.tostring(x, pretty_print=True))
 
 
 def print_xml(xml_str):
-    print(xml.dom.minidom.parseString(xml_str).toprettyxml())
+    print(minidom.parseString(xml_str).toprettyxml())
 # okay decompiling sgetk/__pycache__/qstat.cpython-37.pyc
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# the timeout and retry policy of scheduler calls, stdlib only:
+# sgetk.sched runs it with asyncio, asub and astat import it when they run as scripts
+
+import os
+import signal
+import subprocess as subp
+import sys
+import time
+
+# seconds, a scheduler call running longer is killed
+TIMEOUT = 120
+RETRIES = 3
+BACKOFF = 2.0
+
+# output of a failed call which means the scheduler was busy or unreachable, worth a retry
+TRANSIENT_ERRORS = (
+    b"unable to contact qmaster",
+    b"commlib error",
+    b"failed receiving gdi request",
+    b"Socket timed out",
+    b"Unable to contact slurm controller",
+    b"slurm_receive_msg",
+    b"Resource temporarily unavailable",
+    b"Connection refused",
+)
+
+
+def is_transient(error, retry_timeouts=False):
+    """
+    a failure worth a retry: TRANSIENT_ERRORS in the output, or a timeout when retry_timeouts,
+    a timeout is not retried by default, a hung qmaster would block for (retries + 1) x timeout
+    """
+    if isinstance(error, subp.TimeoutExpired):
+        return retry_timeouts
+    output = (error.output or b"") + (error.stderr or b"")
+    return any(i in output for i in TRANSIENT_ERRORS)
+
+
+def run_once(argv, timeout=TIMEOUT):
+    """
+    (stdout, stderr) bytes of argv, no shell, in its own process group,
+    so a timeout kills the children holding the pipes too
+    """
+    proc = subp.Popen(argv, stdout=subp.PIPE, stderr=subp.PIPE, start_new_session=True)
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subp.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proc.communicate()
+        raise subp.TimeoutExpired(argv, timeout)
+    if proc.returncode != 0:
+        raise subp.CalledProcessError(proc.returncode, argv, output=stdout, stderr=stderr)
+    return stdout, stderr
+
+
+def check_output(argv, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF, retry_timeouts=False):
+    """
+    sync SchedulerClient.run: stdout (bytes) of argv, stderr is passed through,
+    retry with exponential backoff when the call fails with TRANSIENT_ERRORS (or times out, with retry_timeouts),
+    raise subprocess.CalledProcessError or subprocess.TimeoutExpired
+    """
+    for attempt in range(retries + 1):
+        try:
+            stdout, stderr = run_once(argv, timeout)
+            sys.stderr.write(stderr.decode(errors='replace'))
+            return stdout
+        except (subp.CalledProcessError, subp.TimeoutExpired) as e:
+            if attempt >= retries or not is_transient(e, retry_timeouts):
+                raise
+            reason = (e.stderr or b"").decode(errors='replace').strip() or "timeout"
+            print(f"{argv[0]} failed ({reason}), retry in {backoff * (2 ** attempt):g}s", file=sys.stderr)
+        time.sleep(backoff * (2 ** attempt))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import asyncio
+import os
+import shlex
+import signal
+import subprocess as subp
+from concurrent.futures import ThreadPoolExecutor
+
+# one timeout and retry policy with the asub and astat scripts
+from sgetk.retry import BACKOFF, RETRIES, TIMEOUT, TRANSIENT_ERRORS, is_transient
+
+CONCURRENCY = 4
+CHUNK_SIZE = 1 << 16
+
+
+def command_argv(cmd):
+    """
+    "qstat -u '*'" -> ['qstat', '-u', '*'], the command runs without a shell
+    """
+    if isinstance(cmd, str):
+        return shlex.split(cmd)
+    return [str(i) for i in cmd]
+
+
+class SchedulerClient:
+    """
+    run scheduler binaries (qstat, qhost, qsub, sbatch, squeue ...) with asyncio:
+    no shell, a timeout per call, at most concurrency calls at a time,
+    and retry with exponential backoff when a call fails with TRANSIENT_ERRORS
+    (or times out, with retry_timeouts)
+
+    client = SchedulerClient(timeout=60)
+    xml_list = asyncio.run(client.run_many(["qstat -q st.q -F -xml", "qstat -q gpu.q -F -xml"]))
+    """
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF, concurrency=CONCURRENCY,
+                 retry_timeouts=False):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.concurrency = concurrency
+        self.retry_timeouts = retry_timeouts
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _retry(self, call):
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    return await call()
+            except (subp.CalledProcessError, subp.TimeoutExpired) as e:
+                if attempt >= self.retries or not is_transient(e, self.retry_timeouts):
+                    raise
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+
+    async def _stream_once(self, argv, consumer, timeout):
+        # own process group, a timeout kills the children holding the pipes too
+        proc = await asyncio.create_subprocess_exec(
+            *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True)
+        stderr_task = asyncio.ensure_future(proc.stderr.read())
+        head = b""
+
+        async def pump():
+            nonlocal head
+            while True:
+                chunk = await proc.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(head) < CHUNK_SIZE:
+                    head += chunk[:CHUNK_SIZE - len(head)]
+                consumer(chunk)
+            return await proc.wait()
+
+        try:
+            returncode = await asyncio.wait_for(pump(), timeout)
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+            stderr_task.cancel()
+            raise subp.TimeoutExpired(argv, timeout)
+        stderr = await stderr_task
+        if returncode != 0:
+            raise subp.CalledProcessError(returncode, argv, output=head, stderr=stderr)
+
+    async def stream(self, cmd, consumer, reset=None, timeout=None):
+        """
+        feed stdout chunks of cmd to consumer(chunk) as they arrive,
+        reset() is called before a retry, so the consumer can drop a partial output
+        """
+        argv = command_argv(cmd)
+        timeout = self.timeout if timeout is None else timeout
+        first = True
+
+        async def call():
+            nonlocal first
+            if not first and reset is not None:
+                reset()
+            first = False
+            await self._stream_once(argv, consumer, timeout)
+
+        await self._retry(call)
+
+    async def run(self, cmd, timeout=None):
+        """
+        stdout (bytes) of cmd
+        """
+        chunks = []
+        await self.stream(cmd, chunks.append, chunks.clear, timeout)
+        return b"".join(chunks)
+
+    async def run_many(self, cmds, timeout=None):
+        return await asyncio.gather(*[self.run(i, timeout) for i in cmds])
+
+    async def parse(self, cmd, parser, consume_events, timeout=None):
+        """
+        stream stdout of cmd into parser (lxml.etree.XMLPullParser), consume_events(parser.read_events())
+        is called after every chunk, so the xml is parsed while the command is still running
+        """
+        state = {'parser': parser()}
+
+        def consumer(chunk):
+            state['parser'].feed(chunk)
+            consume_events(state['parser'].read_events())
+
+        def reset():
+            state['parser'] = parser()
+
+        await self.stream(cmd, consumer, reset, timeout)
+        state['parser'].close()
+        consume_events(state['parser'].read_events())
+
+
+def run_sync(coro):
+    """
+    asyncio.run(coro) for sync callers, asyncio.run can not nest,
+    so when this thread already runs an event loop (jupyter, an async host)
+    the coroutine runs on a private loop in a worker thread
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def run_command(cmd, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF):
+    """
+    sync wrapper of SchedulerClient.run, stdout (bytes) of cmd,
+    raise subprocess.CalledProcessError or subprocess.TimeoutExpired
+    """
+    client = SchedulerClient(timeout, retries, backoff)
+    return run_sync(client.run(cmd))
+
+
+def run_commands(cmds, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF, concurrency=CONCURRENCY):
+    """
+    sync wrapper of SchedulerClient.run_many, stdout of every cmd, at most concurrency at a time
+    """
+    client = SchedulerClient(timeout, retries, backoff, concurrency)
+    return run_sync(client.run_many(cmds))
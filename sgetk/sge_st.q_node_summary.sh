@@ -10,4 +10,4 @@ qstat -u \* | \
     tr '\n' ' ' | \
     xargs -I xxx echo qhost -h xxx | \
     xargs -I xxx bash -c xxx | \
-    python3 `dirname $0`/sge_summary.py
+    python3 `dirname $0`/sge_summary.py -queue st.q
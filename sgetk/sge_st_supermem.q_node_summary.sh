@@ -1,5 +1,5 @@
 #!/usr/bin/env bash
-# get st.q queue compute node resource information
+# get st_supermem.q queue compute node resource information
 
 qstat -u \* | \
     tail -n +3 | \
@@ -10,4 +10,4 @@ qstat -u \* | \
     tr '\n' ' ' | \
     xargs -I xxx echo qhost -h xxx | \
     xargs -I xxx bash -c xxx | \
-    python3 `dirname $0`/sge_summary.py
+    python3 `dirname $0`/sge_summary.py -queue st_supermem.q
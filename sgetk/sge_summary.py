@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import functools
+import os
 import sys
 import re
 
@@ -12,164 +14,273 @@ SYMBOLS = {
 }
 
 
+# symbol: multiplier, a symbol takes its value from the first symbol set containing it
+HUMAN_PREFIX = {}
+for _sset in SYMBOLS.values():
+    for _i, _s in enumerate(_sset):
+        HUMAN_PREFIX.setdefault(_s, 1 << _i*10)
+# treat 'k' as an alias for 'K' as per: http://goo.gl/kTQMs
+for _s in ('k', 'm', 'g'):
+    HUMAN_PREFIX.setdefault(_s, HUMAN_PREFIX[_s.upper()])
+
+# symbols name: ((symbol, multiplier), ...) from the largest to 1K
+BYTES_PREFIX = {name: tuple((s, 1 << (i+1)*10) for i, s in reversed(list(enumerate(sset[1:]))))
+                for name, sset in SYMBOLS.items()}
+
+HUMAN_NUMBER = re.compile(r'[\d.]*')
+
+
 def bytes2human(n, format='%(value).1f %(symbol)s', symbols='customary'):
     n = int(n)
     if n < 0:
         raise ValueError("n < 0")
-    symbols = SYMBOLS[symbols]
-    prefix = {}
-    for i, s in enumerate(symbols[1:]):
-        prefix[s] = 1 << (i+1)*10
-    for symbol in reversed(symbols[1:]):
-        if n >= prefix[symbol]:
-            value = float(n) / prefix[symbol]
-            return format % locals()
-    return format % dict(symbol=symbols[0], value=n)
+    for symbol, prefix in BYTES_PREFIX[symbols]:
+        if n >= prefix:
+            value = float(n) / prefix
+            return format % dict(n=n, symbol=symbol, value=value)
+    return format % dict(symbol=SYMBOLS[symbols][0], value=n)
 
 
+@functools.lru_cache(maxsize=4096)
 def human2bytes(s):
-    init = s
-    num = ""
-    while s and s[0:1].isdigit() or s[0:1] == '.':
-        num += s[0]
-        s = s[1:]
-    if num != "":
-        num = float(num)
-    else:
+    num = HUMAN_NUMBER.match(s).group()
+    if num == "":
         raise ValueError(f"can't covert {s} to float")
-    letter = s.strip()
-    #print(letter)
-    for name, sset in SYMBOLS.items():
-        if letter in sset:
-            break
+    prefix = HUMAN_PREFIX.get(s[len(num):].strip())
+    num = float(num)
+    if prefix is None:
+        raise ValueError("can't interpret %r" % s)
+    return int(num * prefix)
+
+
+def human2bytes_array(values):
+    """
+    vectorized human2bytes: a numpy array, pandas Series or list of strings like
+    '10.5g', '50M', '3G' -> int64 numpy array, every distinct string is parsed once
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=str)
+    uniques, inverse = np.unique(values, return_inverse=True)
+    table = np.array([human2bytes(i) for i in uniques], dtype=np.int64)
+    return table[inverse.reshape(values.shape)]
+
+
+def bytes2human_array(values, format='%(value).1f %(symbol)s', symbols='customary'):
+    """
+    vectorized bytes2human: numbers -> numpy array of strings,
+    the symbol of every value is found by one numpy searchsorted,
+    a missing value (NaN, None, '-' of qhost parsed by memory2bytes) is '-'
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values)
+    n = np.where(finite, values, 0).astype(np.int64)
+    if (n < 0).any():
+        raise ValueError("n < 0")
+    sset = SYMBOLS[symbols]
+    prefix = np.array([1 << i*10 for i in range(len(sset))], dtype=np.float64)
+    level = np.maximum(np.searchsorted(prefix, n, side='right') - 1, 0)
+    value = n / prefix[level]
+    return np.array([format % dict(n=i, symbol=sset[j], value=(v if j > 0 else i)) if ok else '-'
+                     for i, j, v, ok in zip(n.tolist(), level.tolist(), value.tolist(), finite.tolist())], dtype=object)
+
+
+def memory2bytes(values):
+    """
+    qhost memory strings to float bytes: '125.8G' -> 135080476262.0, '0.0' -> 0.0, '-' -> NaN
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=object)
+    result = np.full(values.shape, np.nan)
+    known = np.array([isinstance(i, str) and i != '-' for i in values.ravel()], dtype=bool).reshape(values.shape)
+    strings = values[known].astype(str)
+    if strings.size == 0:
+        return result
+    plain = np.char.isdigit(np.char.replace(strings, '.', ''))
+    converted = np.empty(strings.shape)
+    converted[plain] = strings[plain].astype(float)
+    converted[~plain] = human2bytes_array(strings[~plain])
+    result[known] = converted
+    return result
+
+
+# node memory buckets, in G (1e9 bytes)
+BUCKETS = [100, 200, 300, 500]
+QHOST_TEXT_COLUMNS = ['host', 'arch', 'num_proc', 'sockets', 'cores', 'threads', 'load_avg',
+                      'mem_total', 'mem_used', 'swap_total', 'swap_used']
+MEMORY_COLUMNS = ['mem_total', 'mem_used', 'swap_total', 'swap_used']
+
+
+def read_qhost_text(handle):
+    """
+    load 'qhost' text output (header, dash line, global line, then one line per host)
+    into a host frame with the same columns as sgetk.qhost.xml2host_frame,
+    the header is None for empty input (no host matched the grep of the node summary scripts)
+    """
+    import numpy as np
+    import pandas as pd
+
+    from io import StringIO
+
+    lines = handle.read().splitlines()
+    header = lines[0] if lines else None
+    host_lines = [i.strip() for i in lines[3:] if i.strip() != ""]
+    host_df = pd.read_csv(StringIO("\n".join(host_lines)), sep=r'\s+', header=None, names=QHOST_TEXT_COLUMNS,
+                          usecols=range(len(QHOST_TEXT_COLUMNS)), dtype=str)
+    host_df['line'] = host_lines
+    for col in MEMORY_COLUMNS:
+        host_df[col] = memory2bytes(host_df[col])
+    for col in ['num_proc', 'sockets', 'cores', 'threads', 'load_avg']:
+        host_df[col] = pd.to_numeric(host_df[col], errors='coerce')
+    return header, host_df
+
+
+def node_status(host_df, buckets=BUCKETS):
+    """
+    vectorized per host status:
+      died:      a host value is missing, or it has no memory, cores or threads
+      dangerous: more than 1/3 of swap is used
+      mem_can_use: mem_total - mem_used
+      bucket:    index of the memory bucket, -1 for unknown or 0.0 memory, such a host is died and in no bucket
+    """
+    import numpy as np
+
+    values = host_df[['cores', 'threads'] + MEMORY_COLUMNS]
+    status = host_df[['host']].copy()
+    status['died'] = values.isna().any(axis=1).to_numpy() | \
+        (host_df[['cores', 'threads', 'mem_total']] == 0).any(axis=1).to_numpy()
+    status['dangerous'] = (host_df['swap_total'].fillna(0) / 3 < host_df['swap_used'].fillna(0)).to_numpy()
+    status['mem_can_use'] = (host_df['mem_total'] - host_df['mem_used']).fillna(0).to_numpy()
+    mem_tag = (host_df['mem_total'] / 1000000000).to_numpy()
+    status['bucket'] = np.where(np.isnan(mem_tag) | (mem_tag == 0), -1, np.digitize(np.nan_to_num(mem_tag), buckets))
+    return status
+
+
+def summarize(host_df, queue_df=None, queues=None, buckets=BUCKETS):
+    """
+    per queue and cluster wide node summary, one row per scope
+
+    host_df: sgetk.qhost.xml2host_frame or read_qhost_text output
+    queue_df: sgetk.qhost.xml2host_frame queue frame, hosts of each queue come from it,
+              None means all hosts belong to the queues, reported as one scope named after them
+    queues: queues to summarize, default: all queues in queue_df
+    """
+    import numpy as np
+    import pandas as pd
+
+    status = node_status(host_df, buckets)
+    hosts = pd.concat([host_df[['host', 'cores', 'threads'] + MEMORY_COLUMNS].reset_index(drop=True),
+                       status.drop(columns='host').reset_index(drop=True)], axis=1)
+    hosts[['cores', 'threads'] + MEMORY_COLUMNS] = hosts[['cores', 'threads'] + MEMORY_COLUMNS].fillna(0)
+
+    if queue_df is None:
+        scope = pd.DataFrame({'scope': ",".join(queues or ['all']), 'host': hosts['host']})
+        names = [",".join(queues or ['all'])]
     else:
-        if (letter == 'k') or (letter == "m") or (letter == "g"):
-            # treat 'k' as an alias for 'K' as per: http://goo.gl/kTQMs
-            sset = SYMBOLS['customary']
-            letter = letter.upper()
-        else:
-            raise ValueError("can't interpret %r" % init)
-    prefix = {sset[0]:1}
-    for i, s in enumerate(sset[1:]):
-        prefix[s] = 1 << (i+1)*10
-    return int(num * prefix[letter])
+        scope = queue_df[['queue', 'host']].astype(str).rename(columns={'queue': 'scope'})
+        if queues is not None:
+            scope = scope[scope['scope'].isin(queues)]
+        names = list(dict.fromkeys(list(scope['scope']) + list(queues or []) + ['cluster']))
+        scope = pd.concat([scope, pd.DataFrame({'scope': 'cluster', 'host': hosts['host']})])
+    merged = scope.drop_duplicates().merge(hosts, on='host')
+
+    labels = bucket_labels(buckets)
+    grouped = merged.groupby('scope', sort=False)
+    summary = grouped.agg(nodes=('host', 'size'),
+                          cores=('cores', 'sum'),
+                          threads=('threads', 'sum'),
+                          mem_total=('mem_total', 'sum'),
+                          mem_used=('mem_used', 'sum'),
+                          mem_can_use=('mem_can_use', 'sum'),
+                          swap_total=('swap_total', 'sum'),
+                          swap_used=('swap_used', 'sum'))
+    # a scope without hosts is reported with zeros, as an empty qhost output
+    summary = summary.reindex(pd.Index(names, name='scope'), fill_value=0)
+    counts = pd.crosstab(merged['scope'], merged['bucket']).reindex(
+        index=summary.index, columns=range(len(labels)), fill_value=0)
+    counts.columns = labels
+    summary = pd.concat([summary, counts], axis=1)
+    for col in ['died', 'dangerous']:
+        nodes = merged[merged[col]].groupby('scope')['host'].agg(sorted)
+        summary[col] = [nodes.get(i, []) for i in summary.index]
+    return summary.reset_index()
+
+
+def bucket_labels(buckets):
+    edges = [0] + list(buckets)
+    labels = [f"{lo}G ~ {hi}G" for lo, hi in zip(edges[:-1], edges[1:])]
+    return labels + [f"{edges[-1]}G ~ "]
+
+
+def print_text(summary, buckets=BUCKETS):
+    labels = bucket_labels(buckets)
+    for _, row in summary.iterrows():
+        q = row['scope']
+        print("\nsummary:")
+        print("total %s computer node : %d" % (q, row['nodes']))
+        for label in reversed(labels):
+            print("total %s computer node (%s): %d" % (q, label, row[label]))
+
+        print("total %s cpu cores: %d" % (q, row['cores']))
+        print("total %s cpu threads: %d" % (q, row['threads']))
+        print("total %s memory: %s" % (q, bytes2human(row['mem_total'])))
+        print("total %s memory used: %s" % (q, bytes2human(row['mem_used'])))
+        print("total %s memory can be used: %s" % (q, bytes2human(row['mem_can_use'])))
+        print("total %s swap memory: %s" % (q, bytes2human(row['swap_total'])))
+        print("total %s swap memory used: %s" % (q, bytes2human(row['swap_used'])))
+
+        print("\ndied %s node:" % q)
+        for i in row['died']:
+            print(i)
+
+        print("\ndangerous %s node:" % q)
+        for i in row['dangerous']:
+            print(i)
 
 
 def main():
-    count = 0
-    count_500G = 0
-    count_300G = 0
-    count_200G = 0
-    count_100G = 0
-    count_0G = 0
-
-    total_mem = 0.0
-    total_ncor = 0
-    total_nthr = 0
-    total_mem_used = 0.0
-    total_mem_can_use = 0.0
-
-    total_mem_swap = 0.0
-    total_mem_swap_used = 0.0
-
-    node_died = set()
-    node_danger = set()
-
-    for line in sys.stdin:
-        count += 1
-        if count == 1:
-            print(line.strip() + " MEM_CAN_USE")
-        if count > 3:
-            line_list = re.split(r'\s+', line.strip())
-
-            mem_total = 0.0
-            mem_used = 0.0
-            mem_can_use = 0.0
-            mem_swap = 0.0
-            mem_swap_used = 0.0
-            ncor = 0
-            nthr = 0
-
-            if line_list[9] != "-" and line_list[9] != "0.0":
-                mem_swap = human2bytes(line_list[9])
-            else:
-                node_died.add(line_list[0])
-            if line_list[10] != "-" and line_list[10] != "0.0":
-                mem_swap_used = human2bytes(line_list[10])
-            else:
-                node_died.add(line_list[0])
-
-            if mem_swap / 3 < mem_swap_used:
-                node_danger.add(line_list[0])
-
-            if line_list[7] != "-" and line_list[7] != "0.0":
-                mem_total = human2bytes(line_list[7])
-                mem_tag = mem_total / 1000000000
-                if mem_tag >= 500:
-                    count_500G += 1
-                elif mem_tag >= 300:
-                    count_300G += 1
-                elif mem_tag >= 200:
-                    count_200G += 1
-                elif mem_tag >= 100:
-                    count_100G += 1
-                else:
-                    count_0G += 1
-            else:
-                node_died.add(line_list[0])
-
-            if line_list[8] != '-' and line_list[9] != "0.0":
-                mem_used = human2bytes(line_list[8])
-            else:
-                node_died.add(line_list[0])
-
-            if line_list[4] != "-" and line_list[4] != "0.0":
-                ncor = int(line_list[4])
-            else:
-                node_died.add(line_list[0])
-            if line_list[5] != "-" and line_list[5] != "0.0":
-                nthr = int(line_list[5])
-            else:
-                node_died.add(line_list[0])
-
-            total_ncor += ncor
-            total_nthr += nthr
-
-            total_mem += mem_total
-            total_mem_used += mem_used
-
-            total_mem_swap += mem_swap
-            total_mem_swap_used += mem_swap_used
-
-            if line_list[7] != "-" and line_list[8] != "-":
-                mem_can_use = mem_total - mem_used
-            total_mem_can_use += mem_can_use
-            print(line.strip() + " " + bytes2human(mem_can_use))
-
-    print("\nsummary:")
-    print("total st.q computer node : %d" % (count - 3))
-    print("total st.q computer node (500G ~ ) : %d" % count_500G)
-    print("total st.q computer node (300G ~ 500G): %d" % count_300G)
-    print("total st.q computer node (200G ~ 300G): %d" % count_200G)
-    print("total st.q computer node (100G ~ 200G): %d" % count_100G)
-    print("total st.q computer node (0G   ~ 100G): %d" % count_0G)
-
-    print("total st.q cpu cores: %d" % total_ncor)
-    print("total st.q cpu threads: %d" % total_nthr)
-    print("total st.q memory: %s" % bytes2human(total_mem))
-    print("total st.q memory used: %s" % bytes2human(total_mem_used))
-    print("total st.q memory can be used: %s" % bytes2human(total_mem_can_use))
-    print("total st.q swap memory: %s" % bytes2human(total_mem_swap))
-    print("total st.q swap memory used: %s" % bytes2human(total_mem_swap_used))
-
-    print("\ndied st.q node:")
-    for i in node_died:
-        print(i)
-
-    print("\ndangerous st.q node:")
-    for i in node_danger:
-        print(i)
+    import argparse
+
+    parser = argparse.ArgumentParser(description='summary of compute nodes, per queue and cluster wide')
+    parser.add_argument('-queue', nargs='*', default=None, help='queues to summarize, default: all queues')
+    parser.add_argument('-buckets', type=str, default=",".join(str(i) for i in BUCKETS), help='memory bucket edges in G, default: 100,200,300,500')
+    parser.add_argument('-format', choices=['text', 'tsv', 'json'], default='text', help='output format, default: text')
+    parser.add_argument('-source', choices=['stdin', 'qhost'], default='stdin', help="read 'qhost' text from stdin, its hosts are reported as one scope named after -queue, or call 'qhost -xml -q -F', default: stdin")
+    args = parser.parse_args()
+
+    buckets = [float(i) if '.' in i else int(i) for i in args.buckets.split(",")]
+
+    if args.source == 'stdin':
+        header, host_df = read_qhost_text(sys.stdin)
+        summary = summarize(host_df, None, args.queue, buckets)
+        if args.format == 'text' and header is not None:
+            print(header + " MEM_CAN_USE")
+            mem_can_use = node_status(host_df, buckets)['mem_can_use']
+            for line, mem in zip(host_df['line'], mem_can_use):
+                print(line + " " + bytes2human(mem))
+    else:
+        try:
+            from sgetk.qhost import qhost
+        except ImportError:
+            # run as a script, the sgetk package is the directory of this file
+            sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            from sgetk.qhost import qhost
+        host_df, queue_df = qhost()
+        summary = summarize(host_df, queue_df, args.queue, buckets)
+
+    if args.format == 'text':
+        print_text(summary, buckets)
+    elif args.format == 'tsv':
+        summary['died'] = summary['died'].map(",".join)
+        summary['dangerous'] = summary['dangerous'].map(",".join)
+        summary.to_csv(sys.stdout, sep='\t', index=False)
+    else:
+        summary.to_json(sys.stdout, orient='records')
+        print()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
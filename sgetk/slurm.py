@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+import asyncio
+import collections
+import re
+from datetime import datetime, timedelta
+
+import sgetk.sched
+import sgetk.sge_summary
+from sgetk.qstat import ColumnBuffer, typed_data_frame
+from sgetk.lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+# squeue -o code: column, '|' separated, one row per job (array task with -r)
+SQUEUE_FIELDS = [
+    ('%F', 'array_job_id'),
+    ('%K', 'array_task_id'),
+    ('%j', 'name'),
+    ('%u', 'user'),
+    ('%a', 'account'),
+    ('%P', 'partition'),
+    ('%T', 'state'),
+    ('%C', 'cpus'),
+    ('%m', 'req_mem'),
+    ('%M', 'elapsed'),
+    ('%N', 'nodelist'),
+    ('%p', 'priority'),
+]
+SACCT_FIELDS = ['JobID', 'JobName', 'User', 'Account', 'Partition', 'State', 'AllocCPUS',
+                'ReqMem', 'MaxRSS', 'TotalCPU', 'Elapsed', 'NodeList', 'Submit', 'Start', 'End']
+
+# slurm state: (@state, state) of qstat -xml, the state code is slurm's compact one
+JOB_STATES = {
+    'RUNNING': ('running', 'R'),
+    'COMPLETING': ('running', 'CG'),
+    'CONFIGURING': ('running', 'CF'),
+    'SUSPENDED': ('running', 'S'),
+    'PENDING': ('pending', 'PD'),
+    'REQUEUED': ('pending', 'RQ'),
+    'REQUEUE_HOLD': ('pending', 'RH'),
+    'COMPLETED': ('completed', 'CD'),
+    'FAILED': ('failed', 'F'),
+    'CANCELLED': ('cancelled', 'CA'),
+    'TIMEOUT': ('timeout', 'TO'),
+    'OUT_OF_MEMORY': ('out_of_memory', 'OOM'),
+    'NODE_FAIL': ('node_fail', 'NF'),
+    'PREEMPTED': ('preempted', 'PR'),
+    'BOOT_FAIL': ('boot_fail', 'BF'),
+    'DEADLINE': ('deadline', 'DL'),
+}
+# [D-]HH:MM:SS, MM:SS or MM:SS.mmm
+SLURM_DURATION = re.compile(r'^(?:(?:(?P<d>\d+)-)?(?P<h>\d+):)?(?P<m>\d+):(?P<s>[\d.]+)$')
+SLURM_TIME = '%Y-%m-%dT%H:%M:%S'
+
+
+class RecordParser:
+    """
+    split a '|' separated stream (squeue -o, sacct --parsable2) into rows,
+    chunks may end in the middle of a line, rows are collected by a ColumnBuffer
+    """
+    def __init__(self, columns, sep='|'):
+        self.columns = columns
+        self.sep = sep
+        self.reset()
+
+    def reset(self):
+        self.buffer = ColumnBuffer()
+        self.pending = b''
+
+    def feed(self, chunk):
+        lines = (self.pending + chunk).split(b'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.append(line)
+
+    def close(self):
+        if self.pending:
+            self.append(self.pending)
+        self.pending = b''
+        return self.buffer.to_data_frame()
+
+    def append(self, line):
+        line = line.rstrip(b'\r').decode(errors='replace')
+        if line:
+            self.buffer.append(dict(zip(self.columns, line.split(self.sep))))
+
+
+def duration_seconds(values):
+    """
+    slurm durations to float seconds: '1-02:03:04' -> 93784.0, '05:06.500' -> 306.5,
+    'INVALID', 'UNLIMITED' or '' -> NaN
+    """
+    parts = pd.Series(values, dtype=object).astype(str).str.extract(SLURM_DURATION).astype(float)
+    return (parts['d'].fillna(0) * 86400 + parts['h'].fillna(0) * 3600
+            + parts['m'] * 60 + parts['s']).to_numpy()
+
+
+def memory_bytes(values, cpus):
+    """
+    slurm memory to float bytes, a number without unit is in M,
+    '4Gc' (per cpu, sacct < 21.08) is multiplied by cpus, '16Gn' is per node
+    """
+    values = pd.Series(values, dtype=object).fillna('').astype(str)
+    per_cpu = values.str.endswith('c').to_numpy()
+    values = values.str.rstrip('cn')
+    values = values.where(~values.str.fullmatch(r'[\d.]+'), values + 'M')
+    memory = sgetk.sge_summary.memory2bytes(values.where(values != '', '-').to_numpy())
+    return np.where(per_cpu, memory * np.asarray(cpus, dtype=float), memory)
+
+
+def hard_request(cpus, memory):
+    """
+    the 'hard_request' cell of a qstat -xml job: num_proc and virtual_free,
+    so parse_job_request and extract_mem_core read slurm jobs unchanged
+    """
+    request = [collections.OrderedDict([('@name', 'num_proc'), ('#text', str(cpus))])]
+    if not pd.isna(memory):
+        request.append(collections.OrderedDict([('@name', 'virtual_free'), ('#text', str(int(memory)))]))
+    return request
+
+
+def slurm_data_frame(df, cpu_usage, mem_usage, elapsed):
+    """
+    columns of xml2data_frame from parsed squeue/sacct columns:
+    JB_job_number, tasks, JB_name, JB_owner, JB_project, @state, state, queue_name,
+    hard_req_queue, slots, hard_request, binding, cpu_usage, mem_usage, io_usage, JAT_prio,
+    and elapsed (seconds) of slurm
+    """
+    cpus = pd.to_numeric(df['cpus'], errors='coerce').fillna(1).astype(int)
+    memory = memory_bytes(df['req_mem'], cpus)
+    states = df['state'].str.split(' ').str[0].str.rstrip('+')
+    known = states.map(JOB_STATES)
+    nodes = df['nodelist'].where(~df['nodelist'].isin(['', 'None assigned', '(null)']))
+
+    out = pd.DataFrame({
+        'JB_job_number': df['job_number'],
+        'tasks': df['task'].where(~df['task'].isin(['N/A', '']), np.nan),
+        'JB_name': df['name'],
+        'JB_owner': df['user'],
+        'JB_project': df['account'],
+        '@state': known.str[0].fillna(states.str.lower()),
+        'state': known.str[1].fillna(states),
+        'queue_name': (df['partition'] + '@' + nodes).where(nodes.notna(), None),
+        'hard_req_queue': df['partition'],
+        'slots': 1.0,
+        'hard_request': [hard_request(c, m) for c, m in zip(cpus, memory)],
+        # cgroups bind every slurm job to its cpus
+        'binding': 'cgroup:' + cpus.astype(str),
+        'cpu_usage': cpu_usage,
+        'mem_usage': mem_usage,
+        'io_usage': 0.0,
+        'JAT_prio': pd.to_numeric(df.get('priority', pd.Series(0.0, index=df.index)), errors='coerce'),
+        'elapsed': elapsed,
+    })
+    return typed_data_frame(out.iloc[:0], out).reset_index(drop=True)
+
+
+def squeue_argv(squeue_cmd='squeue', str_list=['-a', '-r', '-h']):
+    fields = '|'.join(i for i, _ in SQUEUE_FIELDS)
+    return sgetk.sched.command_argv(squeue_cmd) + list(str_list) + ['-o', fields]
+
+
+def squeue_records(df):
+    """
+    squeue reports no measured usage, cpu_usage is the allocated cpu time (elapsed x cpus),
+    mem_usage is NaN
+    """
+    if df.empty:
+        df = pd.DataFrame(columns=[i for _, i in SQUEUE_FIELDS])
+    df = df.rename(columns={'array_job_id': 'job_number', 'array_task_id': 'task'})
+    elapsed = duration_seconds(df['elapsed'])
+    cpus = pd.to_numeric(df['cpus'], errors='coerce').fillna(1).to_numpy()
+    return slurm_data_frame(df, elapsed * cpus, np.nan, elapsed)
+
+
+async def squeue_async(squeue_cmd='squeue', str_list=['-a', '-r', '-h'], client=None, timeout=None):
+    """
+    stream 'squeue -o' into the xml2data_frame schema, running_job_info works on the result
+    """
+    if client is None:
+        client = sgetk.sched.SchedulerClient()
+    parser = RecordParser([i for _, i in SQUEUE_FIELDS])
+    await client.stream(squeue_argv(squeue_cmd, str_list), parser.feed, parser.reset, timeout)
+    return squeue_records(parser.close())
+
+
+def squeue(squeue_cmd='squeue', str_list=['-a', '-r', '-h'], client=None, timeout=None):
+    return sgetk.sched.run_sync(squeue_async(squeue_cmd, str_list, client, timeout))
+
+
+def sacct_windows(start, end, window):
+    """
+    split [start, end) into (start, end) windows of at most window (timedelta)
+    """
+    windows = []
+    while start < end:
+        windows.append((start, min(start + window, end)))
+        start += window
+    return windows
+
+
+def sacct_argv(start, end, sacct_cmd='sacct', str_list=['-a', '-n', '-P']):
+    return sgetk.sched.command_argv(sacct_cmd) + list(str_list) + [
+        '-S', start.strftime(SLURM_TIME), '-E', end.strftime(SLURM_TIME),
+        '-o', ','.join(SACCT_FIELDS)]
+
+
+def sacct_records(df):
+    """
+    one row per job (array task): allocation fields from the job line,
+    MaxRSS is the max of its steps (.batch, .extern, .0 ...), TotalCPU of the job line covers all steps
+    """
+    if df.empty:
+        df = pd.DataFrame(columns=SACCT_FIELDS)
+    step_job = df['JobID'].str.split('.').str[0]
+    max_rss = pd.Series(memory_bytes(df['MaxRSS'], 1)).groupby(step_job.to_numpy()).max()
+    # a job running across windows is reported by every window
+    jobs = df[~df['JobID'].str.contains('.', regex=False)].drop_duplicates('JobID', keep='last')
+    ids = jobs['JobID'].str.split('_', n=1)
+    jobs = pd.DataFrame({
+        'job_number': ids.str[0],
+        'task': ids.str[1].fillna(''),
+        'name': jobs['JobName'],
+        'user': jobs['User'],
+        'account': jobs['Account'],
+        'partition': jobs['Partition'],
+        'state': jobs['State'],
+        'cpus': jobs['AllocCPUS'],
+        'req_mem': jobs['ReqMem'],
+        'nodelist': jobs['NodeList'],
+        'total_cpu': jobs['TotalCPU'],
+        'elapsed': jobs['Elapsed'],
+        'job_id': jobs['JobID'],
+        'submit': jobs['Submit'],
+        'start': jobs['Start'],
+        'end': jobs['End'],
+    }).reset_index(drop=True)
+
+    out = slurm_data_frame(jobs, duration_seconds(jobs['total_cpu']),
+                           max_rss.reindex(jobs['job_id']).to_numpy(), duration_seconds(jobs['elapsed']))
+    for col in ['submit', 'start', 'end']:
+        out[col] = pd.to_datetime(jobs[col], format=SLURM_TIME, errors='coerce').to_numpy()
+    return out
+
+
+async def sacct_async(start, end=None, window=timedelta(days=1), sacct_cmd='sacct',
+                      str_list=['-a', '-n', '-P'], client=None, timeout=None):
+    """
+    sacct history of [start, end) in the xml2data_frame schema (plus submit, start, end),
+    the range is fetched as window sized sacct calls, at most client.concurrency at a time,
+    every call is parsed while it streams
+    """
+    if client is None:
+        client = sgetk.sched.SchedulerClient()
+    if end is None:
+        end = datetime.now()
+
+    async def fetch(window_start, window_end):
+        parser = RecordParser(SACCT_FIELDS)
+        cmd = sacct_argv(window_start, window_end, sacct_cmd, str_list)
+        await client.stream(cmd, parser.feed, parser.reset, timeout)
+        return parser.close()
+
+    frames = await asyncio.gather(*[fetch(i, j) for i, j in sacct_windows(start, end, window)])
+    frames = [i for i in frames if not i.empty]
+    return sacct_records(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame())
+
+
+def sacct(start, end=None, window=timedelta(days=1), sacct_cmd='sacct',
+          str_list=['-a', '-n', '-P'], client=None, timeout=None):
+    return sgetk.sched.run_sync(sacct_async(start, end, window, sacct_cmd, str_list, client, timeout))
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import re
+import subprocess as subp
+import sys
+import time
+from datetime import datetime
+
+from sgetk.qstat import qstat
+
+USAGE_COLUMNS = ['cpu_usage', 'mem_usage', 'io_usage']
+# tasks cell of pending array tasks: 1-100:1, 3,7-9:1
+TASK_RANGE = re.compile(r'^\d+(-\d+(:\d+)?)?(,\d+(-\d+(:\d+)?)?)*$')
+
+
+def task_ranges(tasks):
+    """
+    ranges of a pending array tasks cell: '1-5:2,8' -> [range(1, 7, 2), range(8, 9)],
+    None for a single task id or ''
+    """
+    tasks = str(tasks)
+    if tasks.isdigit() or not TASK_RANGE.match(tasks):
+        return None
+    ranges = []
+    for part in tasks.split(','):
+        first, _, rest = part.partition('-')
+        last, _, step = rest.partition(':')
+        first, step = int(first), int(step or 1)
+        ranges.append(range(first, int(last or first) + 1, step))
+    return ranges
+
+
+def range_cell(ranges):
+    """
+    [range(1, 7, 2), range(8, 9)] -> '1-5:2,8', as qstat writes a tasks cell
+    """
+    return ",".join(f"{r.start}" if len(r) == 1 else f"{r.start}-{r[-1]}:{r.step}" for r in ranges if len(r))
+
+
+def subtract_ranges(ranges, others):
+    """
+    the tasks of ranges not in any of others, still as ranges, nothing is expanded when
+    both ranges have the same step and alignment (every range of one array does)
+    """
+    for b in others:
+        rest = []
+        for a in ranges:
+            if not len(a) or not len(b) or a[-1] < b[0] or b[-1] < a[0]:
+                rest.append(a)
+            elif a.step == b.step and (b.start - a.start) % a.step == 0:
+                stop = a[-1] + a.step
+                rest += [r for r in (range(a.start, max(a.start, b.start), a.step),
+                                     range(min(stop, b[-1] + b.step), stop, a.step)) if len(r)]
+            else:
+                rest += [range(t, t + 1) for t in a if t not in b]
+        ranges = rest
+    return ranges
+
+
+def intersect_ranges(ranges, others):
+    """
+    the tasks of ranges which are in others
+    """
+    return subtract_ranges(ranges, subtract_ranges(ranges, others))
+
+
+def task_count(ranges):
+    return sum(len(r) for r in ranges)
+
+
+def job_index(df):
+    """
+    compact index of a xml2data_frame output:
+    {(job number, tasks): (state attribute, state, owner, job name, queue, cpu, mem, io)}
+    tasks is '' for a non array job, the task id of an array task,
+    or the tasks cell of pending array tasks ('1-100000:1'), a range stays one entry
+    """
+    def column(name, default):
+        if name not in df.columns:
+            return [default] * len(df)
+        return df[name].where(df[name].notna(), default).tolist()
+
+    keys = zip(column('JB_job_number', ''), [str(i) for i in column('tasks', '')])
+    values = zip(column('@state', ''), column('state', ''),
+                 column('JB_owner', ''), column('JB_name', ''), column('queue_name', ''),
+                 *[column(i, 0.0) for i in USAGE_COLUMNS])
+    return dict(zip(keys, values))
+
+
+def event_record(event, key, value, old_value=None, now=None):
+    job_state, state, owner, name, queue = value[:5]
+    record = {
+        'time': now,
+        'event': event,
+        'job': key[0],
+        'task': key[1],
+        'owner': owner,
+        'name': name,
+        'state': state,
+        'queue': queue,
+    }
+    ranges = task_ranges(key[1])
+    if ranges is not None:
+        record['task_count'] = task_count(ranges)
+    if old_value is not None:
+        record['old_state'] = old_value[1]
+        for col, new_usage, old_usage in zip(USAGE_COLUMNS, value[5:], old_value[5:]):
+            record[f"{col}_delta"] = float(new_usage) - float(old_usage)
+    return record
+
+
+def change_event(key, value, old_value, usage_threshold, now):
+    """
+    started, state_changed or usage event of a key in both snapshots, None if unchanged
+    """
+    if old_value[1] != value[1]:
+        if old_value[0] != 'running' and value[0] == 'running':
+            return event_record('started', key, value, old_value, now)
+        return event_record('state_changed', key, value, old_value, now)
+    if any(abs(float(i) - float(j)) > usage_threshold for i, j in zip(value[5:], old_value[5:])):
+        return event_record('usage', key, value, old_value, now)
+    return None
+
+
+def pending_ranges(index):
+    """
+    {job number: [(ranges, key, value)]} of the pending array ranges of a job_index
+    """
+    jobs = {}
+    for key, value in index.items():
+        ranges = task_ranges(key[1])
+        if ranges is not None:
+            jobs.setdefault(key[0], []).append((ranges, key, value))
+    return jobs
+
+
+def range_value(jobs, job, task):
+    """
+    the value of the pending range of job holding task, None if none does
+    """
+    if not task.isdigit():
+        return None
+    for ranges, _, value in jobs.get(job, []):
+        if any(int(task) in r for r in ranges):
+            return value
+    return None
+
+
+def diff_index(old, new, usage_threshold=0.0, now=None):
+    """
+    yield the changes between two job_index snapshots:
+      new:           a job/task appears
+      started:       pending -> running, also a task leaving a pending range
+      state_changed: any other state change, e.g. r -> Eqw
+      usage:         same state, a cpu/mem/io usage grew more than usage_threshold
+      finished:      a job/task disappears
+    pending ranges are compared as ranges, their events carry the tasks cell and task_count
+    """
+    old_pending, new_pending = pending_ranges(old), pending_ranges(new)
+    # task ids which left (or joined) a pending range, per job
+    left, joined = {}, {}
+
+    for key, value in new.items():
+        if task_ranges(key[1]) is not None:
+            continue
+        old_value = old.get(key)
+        if old_value is None:
+            old_value = range_value(old_pending, *key)
+            if old_value is None:
+                yield event_record('new', key, value, now=now)
+                continue
+            left.setdefault(key[0], []).append(range(int(key[1]), int(key[1]) + 1))
+        event = change_event(key, value, old_value, usage_threshold, now)
+        if event is not None:
+            yield event
+
+    for key, old_value in old.items():
+        if key in new or task_ranges(key[1]) is not None:
+            continue
+        value = range_value(new_pending, *key)
+        if value is None:
+            yield event_record('finished', key, old_value, now=now)
+            continue
+        # requeued into a pending range
+        joined.setdefault(key[0], []).append(range(int(key[1]), int(key[1]) + 1))
+        yield event_record('state_changed', key, value, old_value, now)
+
+    for job in set(old_pending) | set(new_pending):
+        old_entries, new_entries = old_pending.get(job, []), new_pending.get(job, [])
+        old_all = [r for ranges, _, _ in old_entries for r in ranges]
+        new_all = [r for ranges, _, _ in new_entries for r in ranges]
+        for ranges, key, value in new_entries:
+            if key in old:
+                event = change_event(key, value, old[key], usage_threshold, now)
+                if event is not None:
+                    yield event
+                continue
+            for old_ranges, _, old_value in old_entries:
+                common = intersect_ranges(ranges, old_ranges)
+                if common and old_value[1] != value[1]:
+                    yield event_record('state_changed', (job, range_cell(common)), value, old_value, now)
+            fresh = subtract_ranges(ranges, old_all + joined.get(job, []))
+            if fresh:
+                yield event_record('new', (job, range_cell(fresh)), value, now=now)
+        for ranges, key, old_value in old_entries:
+            if key in new:
+                continue
+            gone = subtract_ranges(ranges, new_all + left.get(job, []))
+            if gone:
+                yield event_record('finished', (job, range_cell(gone)), old_value, now=now)
+
+
+def watch(qstat_cmd="qstat -u '*'", interval=30, count=None, initial=True,
+          usage_threshold=0.0, cache=None):
+    """
+    poll qstat every interval seconds and yield state transition events (dict),
+    only the changes since the last poll are yielded,
+    initial: yield all jobs of the first poll as 'new' events
+    count: stop after count polls, default: None (forever)
+    """
+    index = None
+    polls = 0
+    next_poll = time.monotonic()
+    while (count is None) or (polls < count):
+        polls += 1
+        try:
+            df = qstat(qstat_cmd, cache=cache)
+        except (subp.CalledProcessError, subp.TimeoutExpired):
+            df = None
+        if df is not None:
+            now = datetime.now().isoformat(timespec='seconds')
+            new_index = job_index(df)
+            if index is not None or initial:
+                yield from diff_index(index or {}, new_index, usage_threshold, now)
+            index = new_index
+
+        if (count is not None) and (polls >= count):
+            break
+        next_poll += interval
+        time.sleep(max(0.0, next_poll - time.monotonic()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='watch qstat, print job state transitions as json lines')
+    parser.add_argument('-cmd', type=str, default="qstat -u '*'", help="qstat command, default: qstat -u '*'")
+    parser.add_argument('-interval', type=float, default=30, help='poll interval (seconds), default: 30')
+    parser.add_argument('-count', type=int, default=None, help='stop after count polls, default: None (forever)')
+    parser.add_argument('-usage-threshold', dest='usage_threshold', type=float, default=0.0, help='report usage changes larger than it, default: 0.0')
+    parser.add_argument('-no-initial', dest='initial', action='store_false', help='do not report jobs of the first poll')
+    args = parser.parse_args()
+
+    for event in watch(args.cmd, args.interval, args.count, args.initial, args.usage_threshold):
+        sys.stdout.write(json.dumps(event) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()